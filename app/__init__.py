@@ -13,19 +13,98 @@ def create_app():
     app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'dev-secret-change-in-production')
     app.config['KITE_API_KEY'] = os.environ.get('KITE_API_KEY')
     app.config['KITE_API_SECRET'] = os.environ.get('KITE_API_SECRET')
+    app.config['KITE_API_ROOT'] = os.environ.get('KITE_API_ROOT')
     app.config['RESEND_API_KEY'] = os.environ.get('RESEND_API_KEY')
     app.config['RECIPIENT_EMAIL'] = os.environ.get('RECIPIENT_EMAIL')
     app.config['REPORT_HOUR'] = os.environ.get('REPORT_HOUR', '9')
     app.config['REPORT_MINUTE'] = os.environ.get('REPORT_MINUTE', '0')
+    app.config['REPORT_CHANGE_THRESHOLD'] = os.environ.get('REPORT_CHANGE_THRESHOLD', '0')
+    app.config['REPORT_NO_CHANGE_MODE'] = os.environ.get('REPORT_NO_CHANGE_MODE', 'skip')
+    app.config['REPORT_ATTACH_EXPORT'] = os.environ.get('REPORT_ATTACH_EXPORT', '')
+    app.config['SCHEDULER_LOCK_FILE'] = os.environ.get('SCHEDULER_LOCK_FILE')
+    app.config['CACHE_TTL'] = os.environ.get('CACHE_TTL', '60')
+    app.config['HOLDINGS_TTL'] = os.environ.get('HOLDINGS_TTL')
+    app.config['KITE_TIMEOUT'] = os.environ.get('KITE_TIMEOUT', '5')
+    app.config['KITE_BUDGET'] = os.environ.get('KITE_BUDGET', '8')
+    app.config['KITE_BREAKER_FAILURES'] = os.environ.get('KITE_BREAKER_FAILURES', '5')
+    app.config['KITE_BREAKER_RESET'] = os.environ.get('KITE_BREAKER_RESET', '30')
+    app.config['STALE_TTL'] = os.environ.get('STALE_TTL', '15')
+    app.config['SNAPSHOT_DIR'] = os.environ.get('SNAPSHOT_DIR', 'snapshots')
+    app.config['TICKER_ENABLED'] = os.environ.get('TICKER_ENABLED', 'false')
+    app.config['TICKER_REPLAY_FILE'] = os.environ.get('TICKER_REPLAY_FILE')
+    app.config['TICKER_REPLAY_SPEED'] = os.environ.get('TICKER_REPLAY_SPEED', '1')
+    app.config['TICKER_REFRESH_SECONDS'] = os.environ.get('TICKER_REFRESH_SECONDS', '1')
+    app.config['HISTORY_ENABLED'] = os.environ.get('HISTORY_ENABLED', 'true')
+    app.config['HISTORY_DB'] = os.environ.get('HISTORY_DB', 'history.db')
+    app.config['HISTORY_MIN_INTERVAL'] = os.environ.get('HISTORY_MIN_INTERVAL', '300')
+    app.config['TRADEBOOK_PATH'] = os.environ.get('TRADEBOOK_PATH')
+    app.config['RETURNS_TWR_DAYS'] = os.environ.get('RETURNS_TWR_DAYS', '365')
+    app.config['GROUP_BY'] = os.environ.get('GROUP_BY', 'exchange,product,market_cap,asset_class,tag')
+    app.config['HOLDING_TAGS_PATH'] = os.environ.get('HOLDING_TAGS_PATH')
+    app.config['ANALYSIS_TOP_N'] = os.environ.get('ANALYSIS_TOP_N', '10')
+    app.config['FRAGMENT_CACHE_SIZE'] = os.environ.get('FRAGMENT_CACHE_SIZE', '512')
+    app.config['SHARED_CACHE_PATH'] = os.environ.get('SHARED_CACHE_PATH')
+    app.config['SHARED_CACHE_SIZE_MB'] = os.environ.get('SHARED_CACHE_SIZE_MB', '64')
+    app.config['CORRELATION_ENABLED'] = os.environ.get('CORRELATION_ENABLED', 'true')
+    app.config['CORRELATION_DIR'] = os.environ.get('CORRELATION_DIR', 'correlation')
+    app.config['CORRELATION_WINDOW'] = os.environ.get('CORRELATION_WINDOW', '250')
+    app.config['CORRELATION_CLUSTER_THRESHOLD'] = os.environ.get('CORRELATION_CLUSTER_THRESHOLD', '0.8')
+    app.config['CORRELATION_BOOTSTRAP_DAYS'] = os.environ.get('CORRELATION_BOOTSTRAP_DAYS', '0')
+    app.config['ALERTS_ENABLED'] = os.environ.get('ALERTS_ENABLED', 'true')
+    app.config['ALERT_BATCH_SECONDS'] = os.environ.get('ALERT_BATCH_SECONDS', '60')
+    app.config['ALERT_MIN_INTERVAL'] = os.environ.get('ALERT_MIN_INTERVAL', '900')
+    app.config['STREAM_ENABLED'] = os.environ.get('STREAM_ENABLED', 'false')
+    app.config['STREAM_INTERVAL'] = os.environ.get('STREAM_INTERVAL', '1')
+    app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'true')
+    app.config['MEMORY_PROFILE'] = os.environ.get('MEMORY_PROFILE', 'false')
+    app.config['MEMORY_SAMPLE_SECONDS'] = os.environ.get('MEMORY_SAMPLE_SECONDS', '60')
+    app.config['MEMORY_CEILING_MB'] = os.environ.get('MEMORY_CEILING_MB')
+    app.config['MEMORY_CHECK_SECONDS'] = os.environ.get('MEMORY_CHECK_SECONDS', '30')
 
     # Register blueprints
     from app.routes.auth import auth_bp
     from app.routes.dashboard import dashboard_bp
     from app.routes.api import api_bp
+    from app.routes.metrics import metrics_bp
 
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(dashboard_bp)
     app.register_blueprint(api_bp, url_prefix='/api')
+    app.register_blueprint(metrics_bp)
+
+    # Stage timings, Server-Timing headers and the /metrics endpoint
+    from app.services.metrics import init_metrics
+    init_metrics(app)
+
+    # RSS and figure gauges, optional tracemalloc sampling and the memory watchdog
+    from app.services.memory import init_memory
+    init_memory(app)
+
+    # Configure the portfolio cache shared by dashboard fragments and the API
+    from app.services.cache import init_cache
+    from app.services.fragments import init_fragments
+    from app.services.portfolio import init_portfolio
+    from app.services.ticker import init_ticker
+    from app.services.stream import init_stream
+    from app.services.alerts import init_alerts
+    from app.services.resilience import init_resilience
+    from app.services.history import init_history
+    from app.services.changes import init_changes
+    from app.services.returns import init_returns
+    from app.services.correlation import init_correlation
+    from app.services.export import init_export
+    init_resilience(app)
+    init_history(app)
+    init_changes(app)
+    init_returns(app)
+    init_correlation(app)
+    init_export(app)
+    init_cache(app)
+    init_fragments(app)
+    init_portfolio(app)
+    init_ticker(app)
+    init_alerts(app)
+    init_stream(app)
 
     # Initialize scheduler for daily reports
     from app.services.scheduler import init_scheduler
@@ -1,8 +1,15 @@
 """API routes - email and data refresh endpoints"""
-from flask import Blueprint, jsonify, session, current_app
-from app.services.portfolio import PortfolioService
+from flask import Blueprint, Response, jsonify, session, current_app, request, stream_with_context
+from app.services.portfolio import load_analysis, load_holdings, load_holdings_table, is_stale
 from app.services.email import send_report
-from app.services.token_manager import login_required
+from app.services.charts import load_value_chart
+from app.services.cache import portfolio_cache
+from app.services.token_manager import login_required, get_user_key
+from app.services import stream as analysis_stream
+from app.services.postback import verify_checksum, apply_postback
+from app.services.scenarios import run_scenarios, DEFAULT_LIMIT
+from app.services import alerts, export
+from app.services.holdings import parse_query
 
 api_bp = Blueprint('api', __name__)
 
@@ -25,18 +32,16 @@ def send_email():
         access_token = session.get('access_token')
         api_key = current_app.config['KITE_API_KEY']
 
-        portfolio_service = PortfolioService(api_key, access_token)
-        holdings = portfolio_service.get_holdings()
+        analysis = load_analysis(api_key, access_token, get_user_key())
 
-        if not holdings:
+        if not analysis:
             return jsonify({
                 'status': 'error',
                 'message': 'No holdings found'
             }), 400
 
-        analysis = portfolio_service.analyze(holdings)
-
-        success = send_report(analysis, None, resend_api_key, recipient_email)
+        success = send_report(analysis, None, resend_api_key, recipient_email,
+                              value_chart=load_value_chart(get_user_key()))
 
         if success:
             return jsonify({
@@ -69,9 +74,7 @@ def get_portfolio():
         access_token = session.get('access_token')
         api_key = current_app.config['KITE_API_KEY']
 
-        portfolio_service = PortfolioService(api_key, access_token)
-        holdings = portfolio_service.get_holdings()
-        analysis = portfolio_service.analyze(holdings)
+        analysis = load_analysis(api_key, access_token, get_user_key())
 
         return jsonify({
             'status': 'success',
@@ -83,3 +86,208 @@ def get_portfolio():
             'status': 'error',
             'message': str(e)
         }), 500
+
+
+@api_bp.route('/holdings', methods=['GET'])
+@login_required
+def holdings():
+    """One page of holdings, filtered and sorted server-side"""
+    try:
+        query = parse_query(request.args)
+        access_token = session.get('access_token')
+        api_key = current_app.config['KITE_API_KEY']
+
+        table = load_holdings_table(api_key, access_token, get_user_key())
+        page = table.query(**query)
+        if table.stale:
+            page.update(stale=True, as_of=table.as_of)
+
+        return jsonify({
+            'status': 'success',
+            'data': page
+        })
+
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@api_bp.route('/export', methods=['GET'])
+@login_required
+def export_holdings():
+    """Every matching holding as a CSV, Parquet or XLSX download, streamed"""
+    try:
+        fmt, query = export.parse_export(request.args)
+        access_token = session.get('access_token')
+        api_key = current_app.config['KITE_API_KEY']
+
+        table = load_holdings_table(api_key, access_token, get_user_key())
+        pieces = export.stream(table, fmt, **query)
+        headers = {'Content-Disposition': f'attachment; filename="{export.filename(fmt)}"',
+                   'X-Accel-Buffering': 'no'}
+        if table.stale:
+            headers['X-Holdings-As-Of'] = str(table.as_of)
+        return Response(pieces, mimetype=export.mimetype(fmt), headers=headers)
+
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@api_bp.route('/scenarios', methods=['POST'])
+@login_required
+def scenarios():
+    """Evaluate what-if price shocks and rebalances against the current holdings"""
+    body = request.get_json(silent=True) or {}
+    try:
+        access_token = session.get('access_token')
+        api_key = current_app.config['KITE_API_KEY']
+
+        holdings = load_holdings(api_key, access_token, get_user_key())
+        result = run_scenarios(holdings, body.get('scenarios'),
+                               limit=body.get('limit', DEFAULT_LIMIT), order=body.get('order', 'worst'))
+        if is_stale(holdings):
+            result.update(stale=True, as_of=holdings.as_of)
+
+        return jsonify({
+            'status': 'success',
+            'data': result
+        })
+
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@api_bp.route('/alerts', methods=['GET'])
+@login_required
+def list_alerts():
+    """Alert rules and the alerts triggered most recently"""
+    user_key = get_user_key()
+    return jsonify({
+        'status': 'success',
+        'data': {
+            'rules': alerts.load_rules(user_key)[0],
+            'triggered': alerts.recent_alerts(user_key)
+        }
+    })
+
+
+@api_bp.route('/alerts', methods=['POST'])
+@login_required
+def add_alerts():
+    """Add alert rules: {"rules": [...]} or a single rule object"""
+    body = request.get_json(silent=True) or {}
+    try:
+        specs = body.get('rules', [body]) if isinstance(body, dict) else body
+        created = alerts.add_rules(get_user_key(), specs)
+
+        return jsonify({
+            'status': 'success',
+            'data': {'rules': created}
+        })
+
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@api_bp.route('/alerts/<rule_id>', methods=['DELETE'])
+@login_required
+def delete_alert(rule_id):
+    """Remove one alert rule"""
+    try:
+        if not alerts.delete_rule(get_user_key(), rule_id):
+            return jsonify({
+                'status': 'error',
+                'message': 'No such alert rule'
+            }), 404
+        return jsonify({'status': 'success'})
+
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@api_bp.route('/refresh', methods=['POST'])
+@login_required
+def refresh():
+    """Drop cached portfolio data so the next load refetches from Kite"""
+    portfolio_cache.invalidate(get_user_key())
+    return jsonify({'status': 'success'})
+
+
+@api_bp.route('/postback', methods=['POST'])
+def postback():
+    """Kite order postback - keeps cached holdings in step with fills"""
+    # Kite sends the order as a raw JSON body
+    order = request.get_json(force=True, silent=True) or {}
+
+    if not verify_checksum(order, current_app.config.get('KITE_API_SECRET')):
+        return jsonify({
+            'status': 'error',
+            'message': 'Invalid checksum'
+        }), 403
+
+    try:
+        action = apply_postback(order)
+        return jsonify({'status': 'success', 'action': action})
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@api_bp.route('/stream', methods=['GET'])
+@login_required
+def stream():
+    """Server-Sent Events feed of analysis deltas for open dashboards"""
+    if not analysis_stream.enabled:
+        return jsonify({
+            'status': 'error',
+            'message': 'Live updates are disabled. Set STREAM_ENABLED=true.'
+        }), 404
+
+    access_token = session.get('access_token')
+    api_key = current_app.config['KITE_API_KEY']
+    user_key = get_user_key()
+
+    broadcaster = analysis_stream.get_broadcaster(
+        user_key, lambda: load_analysis(api_key, access_token, user_key)
+    )
+    return Response(
+        stream_with_context(analysis_stream.event_stream(broadcaster)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
@@ -1,7 +1,8 @@
 """Authentication routes - OAuth flow with Kite"""
 from flask import Blueprint, redirect, url_for, session, flash, current_app, render_template, request
 from kiteconnect import KiteConnect
-from app.services.token_manager import save_token, clear_token
+from app.services.token_manager import save_token, clear_token, get_user_key
+from app.services.ticker import stop_feed
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -30,7 +31,8 @@ def callback():
         return redirect(url_for('auth.login'))
 
     try:
-        kite = KiteConnect(api_key=current_app.config['KITE_API_KEY'])
+        kite = KiteConnect(api_key=current_app.config['KITE_API_KEY'],
+                           root=current_app.config.get('KITE_API_ROOT'))
         data = kite.generate_session(
             request_token,
             api_secret=current_app.config['KITE_API_SECRET']
@@ -57,6 +59,7 @@ def callback():
 @auth_bp.route('/logout')
 def logout():
     """Clear session and stored token"""
+    stop_feed(get_user_key())
     session.clear()
     clear_token()
     flash('You have been logged out.', 'info')
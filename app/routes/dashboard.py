@@ -1,56 +1,138 @@
 """Dashboard routes - main portfolio view"""
-from flask import Blueprint, render_template, session, current_app, flash
-from app.services.portfolio import PortfolioService
-from app.services.charts import create_all_charts
-from app.services.token_manager import login_required
-from app.services.scheduler import scheduler
+from flask import Blueprint, render_template, session, current_app, abort, request
+from markupsafe import escape
+from app.services.portfolio import load_analysis, load_holdings_table
+from app.services.holdings import parse_query
+from app.services.charts import CHART_BUILDERS, load_chart, load_value_chart, load_correlation_chart
+from app.services.token_manager import login_required, get_user_key
+from app.services.scheduler import get_next_run_time
+from app.services.metrics import timed
+from app.services import stream as analysis_stream
+from app.services import fragments, export
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
+FRAGMENTS = {
+    'summary': 'fragments/summary.html',
+    'gainers': 'fragments/gainers.html',
+    'losers': 'fragments/losers.html',
+    'sectors': 'fragments/sectors.html',
+    'groups': 'fragments/groups.html'
+}
+
+# Sort choices offered by the holdings table
+HOLDING_SORTS = {
+    '-current_value': 'Value (high to low)',
+    '-pnl': 'P&L (high to low)',
+    'pnl': 'P&L (low to high)',
+    '-pnl_percentage': 'P&L % (high to low)',
+    'pnl_percentage': 'P&L % (low to high)',
+    'symbol': 'Symbol',
+    'sector,-current_value': 'Sector, then value'
+}
+
+CHART_TITLES = {
+    'sector_pie': 'Sector Allocation',
+    'gainers': 'Top Gainers',
+    'losers': 'Top Losers',
+    'value_history': 'Portfolio Value',
+    'correlation': 'Return Correlation'
+}
+
+# Charts drawn from stored history rather than the current analysis
+HISTORY_CHARTS = {'value_history': load_value_chart, 'correlation': load_correlation_chart}
+
 
 def get_schedule_info():
     """Get next scheduled report time"""
     try:
-        job = scheduler.get_job('daily_report')
-        if job:
-            next_run = job.next_run_time
+        next_run = get_next_run_time('daily_report')
+        if next_run:
             return {
                 'enabled': True,
-                'next_run': next_run.strftime('%Y-%m-%d %H:%M:%S %Z') if next_run else 'Not scheduled'
+                'next_run': next_run.strftime('%Y-%m-%d %H:%M:%S %Z')
             }
     except Exception:
         pass
     return {'enabled': False, 'next_run': 'Not configured'}
 
 
+def get_analysis():
+    """Load the current user's analysis (cached across fragment requests)"""
+    return load_analysis(current_app.config['KITE_API_KEY'],
+                         session.get('access_token'),
+                         get_user_key())
+
+
+def fragment_error(e):
+    """Render a load failure in place of a dashboard section"""
+    return f'<div class="alert alert-danger">Error loading portfolio: {escape(str(e))}</div>', 500
+
+
 @dashboard_bp.route('/')
 @login_required
 def index():
-    """Main dashboard - shows portfolio analysis"""
-    access_token = session.get('access_token')
-    api_key = current_app.config['KITE_API_KEY']
+    """Main dashboard - returns the layout; sections load via fragments"""
+    with timed('render_template'):
+        return render_template('dashboard.html',
+                              chart_names=list(CHART_BUILDERS) + list(HISTORY_CHARTS),
+                              user_id=session.get('user_id'),
+                              schedule=get_schedule_info(),
+                              stream_enabled=analysis_stream.enabled)
+
+
+@dashboard_bp.route('/fragments/<name>')
+@login_required
+def fragment(name):
+    """Render one dashboard section (summary cards or a table)"""
+    if name not in FRAGMENTS:
+        abort(404)
 
     try:
-        portfolio_service = PortfolioService(api_key, access_token)
-        holdings = portfolio_service.get_holdings()
+        analysis = get_analysis()
+    except Exception as e:
+        return fragment_error(e)
+
+    with timed('render_template'):
+        return fragments.section(name, analysis, lambda: render_template(FRAGMENTS[name], analysis=analysis))
 
-        if not holdings:
-            flash('No holdings found or error fetching data. You may need to re-authenticate.', 'warning')
-            analysis = None
-            charts = {}
-        else:
-            analysis = portfolio_service.analyze(holdings)
-            charts = create_all_charts(analysis)
 
+@dashboard_bp.route('/fragments/holdings')
+@login_required
+def holdings_fragment():
+    """Render one page of the full holdings table (search, filter, sort)"""
+    try:
+        query = parse_query(request.args)
+        table = load_holdings_table(current_app.config['KITE_API_KEY'],
+                                    session.get('access_token'),
+                                    get_user_key())
+        page = table.query(**query)
+    except ValueError as e:
+        return f'<div class="alert alert-warning">{escape(str(e))}</div>', 400
     except Exception as e:
-        flash(f'Error loading portfolio: {str(e)}', 'error')
-        analysis = None
-        charts = {}
+        return fragment_error(e)
+
+    with timed('render_template'):
+        return render_template('fragments/holdings.html', page=page, query=query,
+                               sorts=HOLDING_SORTS, stale=table.stale,
+                               export_formats=[fmt for fmt in ('csv', 'xlsx') if fmt in export.available_formats])
+
 
-    schedule_info = get_schedule_info()
+@dashboard_bp.route('/fragments/chart/<name>')
+@login_required
+def chart_fragment(name):
+    """Render one dashboard chart"""
+    if name not in CHART_BUILDERS and name not in HISTORY_CHARTS:
+        abort(404)
+
+    try:
+        if name in HISTORY_CHARTS:
+            chart = HISTORY_CHARTS[name](get_user_key())
+        else:
+            analysis = get_analysis()
+            chart = load_chart(get_user_key(), name, analysis) if analysis else None
+    except Exception as e:
+        return fragment_error(e)
 
-    return render_template('dashboard.html',
-                          analysis=analysis,
-                          charts=charts,
-                          user_id=session.get('user_id'),
-                          schedule=schedule_info)
+    with timed('render_template'):
+        return render_template('fragments/chart.html', chart=chart, title=CHART_TITLES.get(name, name))
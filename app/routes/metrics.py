@@ -0,0 +1,11 @@
+"""Metrics routes - Prometheus scrape endpoint"""
+from flask import Blueprint, Response
+from app.services.metrics import render_prometheus
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics')
+def metrics():
+    """Expose stage histograms, cache hit rates and Kite call counts"""
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
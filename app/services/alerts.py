@@ -0,0 +1,522 @@
+"""Alerts service - threshold rules checked against streaming prices
+
+Rules are stored per user next to the holdings snapshots, in three kinds:
+
+    {"type": "price", "symbol": "INFY", "op": "above", "value": 1600}
+    {"type": "pnl_percentage", "symbol": "INFY", "value": -10}
+    {"type": "sector_weight", "sector": "IT", "op": "above", "value": 30}
+
+Price and P&L % rules both become price levels on an instrument. A P&L %
+threshold X is average_price * (1 + X/100) for each holding it covers, and it
+covers every holding when no symbol is given. Levels are kept in sorted lists
+per instrument token. A move from p0 to p1 can only cross the levels between
+the two prices, so each tick costs two bisects however many rules there
+are. Sector weight rules are checked whenever an analysis is computed.
+
+A rule fires when the price or weight crosses its level, not while it stays
+beyond it. Triggered alerts are queued per user and mailed as one digest
+after ALERT_BATCH_SECONDS. A user gets at most one digest every
+ALERT_MIN_INTERVAL seconds.
+
+Every worker with a live feed sees the same crossings, so the queue, the
+recent alerts and the rate limit live in a per-user state file next to the
+rules, updated under a file lock. A rule that fired for a holding (or
+sector) in the last REFIRE_SECONDS is dropped as a copy, and a digest is
+claimed by whichever worker gets to it first. A claimed digest leaves the
+queue, and counts against the rate limit, only once it has been sent. A
+failed send puts its alerts back for the next window, and a claim older than
+SEND_TIMEOUT (its worker died mid-send) is taken over.
+"""
+import bisect
+import fcntl
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from app.services import money, resilience, ticker, records
+from app.services.email import send_alert_digest
+from app.services.metrics import record_alerts
+
+logger = logging.getLogger(__name__)
+
+enabled = True
+batch_seconds = 60.0
+min_interval = 900.0
+resend_api_key = None
+recipient_email = None
+
+RULE_TYPES = ('price', 'pnl_percentage', 'sector_weight')
+OPS = ('above', 'below')
+MAX_RULES = 10000
+# Alerts listed in one digest; the rest are only counted
+DIGEST_ALERTS = 50
+# Alerts held per user while waiting for the next digest
+MAX_PENDING = 1000
+# Triggered alerts kept per user for GET /api/alerts
+RECENT_ALERTS = 100
+# Seconds in which the same rule firing again for a holding is another worker's copy
+REFIRE_SECONDS = 60
+# Seconds after which a digest claimed by another worker is presumed lost with it
+SEND_TIMEOUT = 120
+
+_books = {}
+_books_lock = threading.Lock()
+
+# Users whose queued alerts this worker waits on: user key -> when due (epoch)
+_waiting = {}
+_dispatch = threading.Condition()
+_dispatcher = None
+
+
+def _rules_path(user_key):
+    return os.path.join(resilience.snapshot_dir, f'alerts-{resilience.safe_key(user_key)}.json')
+
+
+def _state_path(user_key):
+    return os.path.join(resilience.snapshot_dir, f'alerts-state-{resilience.safe_key(user_key)}.json')
+
+
+def load_rules(user_key):
+    """(rules, version) for the user; version changes whenever the rules file does"""
+    path = _rules_path(user_key)
+    try:
+        stat = os.stat(path)
+        with open(path) as f:
+            return json.load(f)['rules'], (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        return [], None
+    except Exception as e:
+        logger.error(f"Could not read alert rules: {e}")
+        return [], None
+
+
+def _write(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=resilience.snapshot_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _update_rules(user_key, change):
+    """Replace the user's rules with change(rules), locked against other workers"""
+    path = _rules_path(user_key)
+    os.makedirs(resilience.snapshot_dir, exist_ok=True)
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        rules = change(load_rules(user_key)[0])
+        _write(path, {'rules': rules})
+    return rules
+
+
+def _load_state(user_key):
+    """The user's alert queue and history shared by all workers"""
+    try:
+        with open(_state_path(user_key)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Could not read alert state: {e}")
+    return {'fired': {}, 'recent': [], 'pending': [], 'omitted': 0, 'queued_at': None, 'last_sent': None,
+            'sending': None}
+
+
+def _update_state(user_key, change):
+    """Apply change(state) to the user's alert state, locked against other workers; returns its result"""
+    path = _state_path(user_key)
+    os.makedirs(resilience.snapshot_dir, exist_ok=True)
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state = _load_state(user_key)
+        result = change(state)
+        _write(path, state)
+    return result
+
+
+def parse_rule(spec):
+    """Validate a rule dict into its stored form, with a new id"""
+    if not isinstance(spec, dict):
+        raise ValueError('Each alert rule must be an object')
+    kind = spec.get('type')
+    if kind not in RULE_TYPES:
+        raise ValueError(f"'type' must be one of {', '.join(RULE_TYPES)}")
+    try:
+        value = float(spec.get('value'))
+    except (TypeError, ValueError):
+        raise ValueError("'value' must be a number")
+    if not math.isfinite(value):
+        raise ValueError("'value' must be a number")
+
+    rule = {'id': uuid.uuid4().hex[:12], 'type': kind}
+    if kind == 'sector_weight':
+        if not spec.get('sector'):
+            raise ValueError("A sector_weight rule needs a 'sector'")
+        rule['sector'] = str(spec['sector'])
+    elif spec.get('symbol'):
+        rule['symbol'] = str(spec['symbol'])
+    elif kind == 'price':
+        raise ValueError("A price rule needs a 'symbol'")
+
+    op = spec.get('op')
+    if op is None and kind == 'pnl_percentage':
+        op = 'below' if value < 0 else 'above'
+    if op not in OPS:
+        raise ValueError("'op' must be 'above' or 'below'")
+    if kind == 'price' and value <= 0:
+        raise ValueError('Price levels must be positive')
+    if kind == 'pnl_percentage' and value <= -100:
+        raise ValueError('A P&L % level must be above -100')
+
+    rule.update(op=op, value=value)
+    return rule
+
+
+def add_rules(user_key, specs):
+    """Validate and store rule dicts; returns the stored rules"""
+    if not isinstance(specs, list) or not specs:
+        raise ValueError("'rules' must be a non-empty list")
+    created = [parse_rule(spec) for spec in specs]
+
+    def append(rules):
+        if len(rules) + len(created) > MAX_RULES:
+            raise ValueError(f"At most {MAX_RULES} alert rules per user")
+        return rules + created
+
+    _update_rules(user_key, append)
+    return created
+
+
+def delete_rule(user_key, rule_id):
+    """Remove one rule; False when the user has no rule with that id"""
+    found = []
+
+    def remove(rules):
+        kept = [rule for rule in rules if rule['id'] != rule_id]
+        found.append(len(kept) < len(rules))
+        return kept
+
+    _update_rules(user_key, remove)
+    return found[0]
+
+
+class LevelIndex:
+    """Alert levels on one instrument, sorted, and the last price seen (money units)"""
+    __slots__ = ('above', 'above_rules', 'below', 'below_rules', 'last')
+
+    def __init__(self, entries, last):
+        above = sorted((level, rule_id, row) for op, level, rule_id, row in entries if op == 'above')
+        below = sorted((level, rule_id, row) for op, level, rule_id, row in entries if op == 'below')
+        self.above = [level for level, _, _ in above]
+        self.above_rules = [(rule_id, row) for _, rule_id, row in above]
+        self.below = [level for level, _, _ in below]
+        self.below_rules = [(rule_id, row) for _, rule_id, row in below]
+        self.last = last
+
+    def cross(self, price):
+        """(rule id, holding row) of every level crossed moving from the last price to price"""
+        last, self.last = self.last, price
+        if price > last:
+            return self.above_rules[bisect.bisect_right(self.above, last):bisect.bisect_right(self.above, price)]
+        if price < last:
+            return self.below_rules[bisect.bisect_left(self.below, price):bisect.bisect_left(self.below, last)]
+        return ()
+
+
+class AlertBook:
+    """One user's rules compiled against a holdings list.
+
+    previous is the book these holdings or rules replace: its last prices
+    and sector weights carry over, so a crossing between the two is not lost
+    and unchanged prices do not fire new rules.
+    """
+
+    def __init__(self, rules, version, holdings, previous=None):
+        self.rules = {rule['id']: rule for rule in rules}
+        self.version = version
+        self.holdings = holdings
+        self._lock = threading.Lock()
+
+        _, last_price, self.average = money.holding_units(holdings)
+        tokens = records.values(holdings, 'instrument_token')
+        rows_by_symbol = {}
+        for row, symbol in enumerate(records.values(holdings, 'tradingsymbol')):
+            rows_by_symbol.setdefault(symbol, []).append(row)
+
+        entries = {}
+        for rule in rules:
+            if rule['type'] == 'price':
+                level = money.price_units(rule['value'])
+                rows = {tokens[row]: row for row in rows_by_symbol.get(rule['symbol'], ())}.values()
+            elif rule['type'] == 'pnl_percentage':
+                rows = rows_by_symbol.get(rule['symbol'], ()) if 'symbol' in rule else range(len(holdings))
+            else:
+                continue
+            for row in rows:
+                if rule['type'] == 'pnl_percentage':
+                    if self.average[row] <= 0:
+                        continue
+                    level = round(int(self.average[row]) * (100 + rule['value']) / 100)
+                entries.setdefault(tokens[row], []).append((rule['op'], level, rule['id'], row))
+
+        last_prices = previous.last_prices() if previous else {}
+        self.levels = {
+            token: LevelIndex(token_entries, last_prices.get(token, int(last_price[token_entries[0][3]])))
+            for token, token_entries in entries.items() if token is not None
+        }
+        self.sector_rules = [rule for rule in rules if rule['type'] == 'sector_weight']
+        self.weights = previous.weights if previous else {}
+
+    def last_prices(self):
+        with self._lock:
+            return {token: index.last for token, index in self.levels.items()}
+
+    def _alert(self, rule, **fields):
+        alert = {'id': rule['id'], 'type': rule['type'], 'op': rule['op'], 'value': rule['value']}
+        alert.update(fields, at=datetime.now().isoformat(timespec='seconds'))
+        return alert
+
+    def check_prices(self, prices):
+        """Alerts fired by (instrument_token, last_price) pairs, applied in order"""
+        fired = []
+        with self._lock:
+            for token, price in prices:
+                index = self.levels.get(token)
+                if index is None or price is None:
+                    continue
+                units = money.price_units(price)
+                for rule_id, row in index.cross(units):
+                    rule = self.rules[rule_id]
+                    fields = {'symbol': self.holdings[row].get('tradingsymbol'), 'price': money.to_rupees(units)}
+                    if rule['type'] == 'pnl_percentage':
+                        average = int(self.average[row])
+                        fields['pnl_percentage'] = (units - average) / average * 100
+                    fired.append(self._alert(rule, **fields))
+        return fired
+
+    def check_weights(self, sectors, total_value):
+        """Alerts fired by the sector weights of an analysis"""
+        fired = []
+        if not self.sector_rules or total_value <= 0:
+            return fired
+        weights = {name: data['value'] / total_value * 100 for name, data in sectors.items()}
+        with self._lock:
+            previous, self.weights = self.weights, weights
+            if not previous:
+                return fired
+            for rule in self.sector_rules:
+                before = previous.get(rule['sector'], 0.0)
+                now = weights.get(rule['sector'], 0.0)
+                level = rule['value']
+                if (before < level <= now) if rule['op'] == 'above' else (now <= level < before):
+                    fired.append(self._alert(rule, sector=rule['sector'], weight=now))
+        return fired
+
+
+def _book(user_key, holdings):
+    """The user's AlertBook for these holdings and their current rules (None without rules)"""
+    rules, version = load_rules(user_key)
+    with _books_lock:
+        book = _books.get(user_key)
+        if book is not None and book.holdings is holdings and book.version == version:
+            return book
+        if not rules:
+            _books.pop(user_key, None)
+            return None
+        book = _books[user_key] = AlertBook(rules, version, holdings, previous=book)
+        return book
+
+
+def check(user_key, holdings, analysis):
+    """Evaluate the user's rules against a freshly computed analysis.
+
+    With a live feed, prices are checked tick by tick (on_ticks) and only
+    sector weights are checked here. Without one, the holdings' last prices
+    are the price updates. Snapshot-served holdings are skipped.
+    """
+    if not enabled or not holdings or not analysis or isinstance(holdings, resilience.SnapshotHoldings):
+        return
+    try:
+        book = _book(user_key, holdings)
+        if book is None:
+            return
+        fired = []
+        if ticker.get_feed(user_key) is None:
+            fired += book.check_prices(zip(records.values(holdings, 'instrument_token'),
+                                           records.values(holdings, 'last_price')))
+        fired += book.check_weights(analysis['sectors'], analysis['total_value'])
+        _queue(user_key, fired)
+    except Exception as e:
+        logger.error(f"Could not check alerts: {e}")
+
+
+def on_ticks(user_key, ticks):
+    """Tick listener: check the user's price levels against a batch of ticks"""
+    book = _books.get(user_key)
+    if book is not None:
+        _queue(user_key, book.check_prices((t.get('instrument_token'), t.get('last_price')) for t in ticks))
+
+
+def recent_alerts(user_key):
+    """The user's most recently triggered alerts, newest first"""
+    return list(reversed(_load_state(user_key)['recent']))
+
+
+def _fire_key(alert):
+    return f"{alert['id']}:{alert.get('symbol', alert.get('sector'))}"
+
+
+def _due(state):
+    last_sent = state['last_sent'] if state['last_sent'] is not None else -math.inf
+    return max(state['queued_at'] + batch_seconds, last_sent + min_interval)
+
+
+def _queue(user_key, fired):
+    global _dispatcher
+    if not fired:
+        return
+
+    def enqueue(state):
+        now = time.time()
+        fired_at = {key: at for key, at in state['fired'].items() if at > now - REFIRE_SECONDS}
+        kept = []
+        for alert in fired:
+            key = _fire_key(alert)
+            if key not in fired_at:
+                fired_at[key] = now
+                kept.append(alert)
+        state['fired'] = fired_at
+        if not kept:
+            return kept, None
+        state['recent'] = (state['recent'] + kept)[-RECENT_ALERTS:]
+        room = max(MAX_PENDING - len(state['pending']), 0)
+        state['pending'] += kept[:room]
+        state['omitted'] += len(kept) - len(kept[:room])
+        if state['queued_at'] is None:
+            state['queued_at'] = now
+        return kept, _due(state)
+
+    kept, due = _update_state(user_key, enqueue)
+    if not kept:
+        return
+    record_alerts('triggered', len(kept))
+    with _dispatch:
+        _waiting[user_key] = min(_waiting.get(user_key, due), due)
+        if _dispatcher is None:
+            _dispatcher = threading.Thread(target=_dispatch_loop, name='alert-dispatch', daemon=True)
+            _dispatcher.start()
+        _dispatch.notify()
+
+
+def _requeue(state, alerts, omitted):
+    """Put a digest's alerts back in front of the queue"""
+    pending = alerts + state['pending']
+    state['pending'] = pending[:MAX_PENDING]
+    state['omitted'] += omitted + len(pending) - len(state['pending'])
+    state['queued_at'] = time.time()
+
+
+def _take_digest(user_key):
+    """Claim the user's digest once due: (claim, None), or (None, when due) and (None, None) when nothing is queued"""
+    def take(state):
+        now = time.time()
+        sending = state.get('sending')
+        if sending is not None:
+            if sending['claimed_at'] + SEND_TIMEOUT > now:
+                return None, sending['claimed_at'] + SEND_TIMEOUT
+            _requeue(state, sending['alerts'], sending['omitted'])
+            state['sending'] = None
+        if not state['pending'] and not state['omitted']:
+            return None, None
+        due = _due(state)
+        if due > now:
+            return None, due
+        claim = {'id': uuid.uuid4().hex, 'claimed_at': now, 'alerts': state['pending'], 'omitted': state['omitted']}
+        state.update(pending=[], omitted=0, queued_at=None, sending=claim)
+        return claim, None
+
+    return _update_state(user_key, take)
+
+
+def _finish_digest(user_key, claim, sent):
+    """Release a claimed digest: charge the rate limit if it was sent, requeue it if not.
+
+    Returns when the next digest is due, or None when nothing is queued.
+    """
+    def finish(state):
+        sending = state.get('sending')
+        if sending is None or sending['id'] != claim['id']:
+            # Taken over after SEND_TIMEOUT: the new claimant owns it now
+            return None
+        state['sending'] = None
+        if sent:
+            state['last_sent'] = time.time()
+        else:
+            _requeue(state, claim['alerts'], claim['omitted'])
+        return _due(state) if state['pending'] or state['omitted'] else None
+
+    return _update_state(user_key, finish)
+
+
+def _wait_for(user_key, due):
+    with _dispatch:
+        _waiting[user_key] = min(_waiting.get(user_key, due), due)
+
+
+def _dispatch_loop():
+    """Mail each user's pending alerts once their batch window and rate limit allow"""
+    while True:
+        with _dispatch:
+            now = time.time()
+            ready = [user_key for user_key, at in _waiting.items() if at <= now]
+            if not ready:
+                _dispatch.wait(min(_waiting.values()) - now if _waiting else None)
+                continue
+            for user_key in ready:
+                del _waiting[user_key]
+
+        for user_key in ready:
+            try:
+                claim, due = _take_digest(user_key)
+                if claim is not None:
+                    due = _finish_digest(user_key, claim, _deliver(user_key, claim['alerts'], claim['omitted']))
+            except Exception as e:
+                logger.error(f"Could not update alert queue: {e}")
+                # Try again after a batch window rather than dropping the user
+                due = time.time() + batch_seconds
+            if due is not None:
+                # Not due yet, another worker is sending, or more alerts queued meanwhile
+                _wait_for(user_key, due)
+
+
+def _deliver(user_key, pending, omitted):
+    """Mail one digest; False when it should be retried"""
+    if not resend_api_key or not recipient_email:
+        record_alerts('skipped')
+        logger.warning(f"{len(pending) + omitted} alerts for {user_key} not mailed: email is not configured")
+        return True
+    shown = pending[:DIGEST_ALERTS]
+    try:
+        send_alert_digest(shown, resend_api_key, recipient_email, omitted + len(pending) - len(shown))
+        record_alerts('sent')
+        return True
+    except Exception as e:
+        record_alerts('failed')
+        logger.error(f"Could not send alert digest, retrying in {batch_seconds:g}s: {e}")
+        return False
+
+
+def init_alerts(app):
+    """Configure alert batching and delivery, and listen to live ticks"""
+    global enabled, batch_seconds, min_interval, resend_api_key, recipient_email
+    enabled = str(app.config.get('ALERTS_ENABLED', 'true')).lower() in ('1', 'true', 'yes')
+    batch_seconds = float(app.config.get('ALERT_BATCH_SECONDS', 60))
+    min_interval = float(app.config.get('ALERT_MIN_INTERVAL', 900))
+    resend_api_key = app.config.get('RESEND_API_KEY')
+    recipient_email = app.config.get('RECIPIENT_EMAIL')
+    if enabled and on_ticks not in ticker.tick_listeners:
+        ticker.tick_listeners.append(on_ticks)
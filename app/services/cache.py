@@ -0,0 +1,167 @@
+"""Cache service - in-process TTL cache for holdings, analysis and charts
+
+With SHARED_CACHE_PATH set, holdings, analyses, returns and chart images
+also go to a SharedCache that every worker on the host reads (see
+app.services.shared_cache): a miss here is looked up there before being
+computed, and only one worker computes it.
+"""
+import logging
+import threading
+import time
+from app.services.metrics import record_cache
+from app.services.shared_cache import SharedCache
+
+logger = logging.getLogger(__name__)
+
+# Kinds worth sharing across workers; the others are live per-worker objects
+SHARED_KINDS = ('holdings', 'analysis', 'returns', 'chart')
+
+
+class TTLCache:
+    """Thread-safe key/value cache with per-entry expiry.
+
+    Keys are tuples whose first element is the user key, so everything
+    cached for one user can be dropped with a single invalidate() call.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.shared = None
+        self._data = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._purged_at = time.monotonic()
+
+    def _generation(self, key):
+        return self.shared.generation(key[0]) if self.shared is not None else 0
+
+    def get(self, key):
+        """Return the cached value, or None if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at, generation = entry
+            # An entry also goes when another worker invalidated its user
+            if expires_at < time.monotonic() or generation != self._generation(key):
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None, generation=None):
+        """Store a value for ttl seconds (defaults to the cache TTL)"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        if generation is None:
+            generation = self._generation(key)
+        with self._lock:
+            self._data[key] = (value, expires_at, generation)
+            # Expired entries otherwise stay until their key is asked for again,
+            # which for users who left (or yesterday's returns) is never
+            now = time.monotonic()
+            if now - self._purged_at > self.ttl:
+                self._purged_at = now
+                for stale_key in [k for k, entry in self._data.items() if entry[1] < now]:
+                    del self._data[stale_key]
+
+    def replace(self, key, expected, value):
+        """Swap in value only if key still holds `expected`; keeps the entry's expiry"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] is not expected or entry[1] < time.monotonic():
+                return False
+            self._data[key] = (value, entry[1], entry[2])
+
+        if self.shared is not None and key[1] in SHARED_KINDS:
+            # Other workers drop their copy and pick this one up
+            self.shared.invalidate(key)
+            generation = self.shared.generation(key[0])
+            self.shared.set(key, value, entry[1] - time.monotonic(), generation)
+            with self._lock:
+                if self._data.get(key, (None,))[0] is value:
+                    self._data[key] = (value, entry[1], generation)
+        return True
+
+    def get_or_set(self, key, compute, ttl=None):
+        """Return the cached value, computing it once for concurrent callers.
+
+        None results are not cached so a failed fetch is retried next time.
+        ttl may be a callable that picks the lifetime from the computed value.
+        """
+        value = self.get(key)
+        record_cache(key[1], value is not None)
+        if value is not None:
+            return value
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            value = self.get(key)
+            if value is None:
+                # Stamped before computing, so an invalidation meanwhile outdates the result
+                generation = self._generation(key)
+                if self.shared is not None and key[1] in SHARED_KINDS:
+                    value = self._get_or_fill_shared(key, compute, ttl, generation)
+                else:
+                    value = compute()
+                    if value is not None:
+                        self.set(key, value, ttl(value) if callable(ttl) else ttl, generation)
+
+        with self._lock:
+            self._key_locks.pop(key, None)
+        return value
+
+    def _get_or_fill_shared(self, key, compute, ttl, generation):
+        """Value from the shared tier, else computed here once for every worker"""
+        with self.shared.filling(key) as hit:
+            record_cache('shared', hit is not None)
+            if hit is not None:
+                value, left = hit
+                self.set(key, value, left, generation)
+                return value
+            value = compute()
+            if value is not None:
+                value_ttl = ttl(value) if callable(ttl) else ttl
+                value_ttl = self.ttl if value_ttl is None else value_ttl
+                self.set(key, value, value_ttl, generation)
+                self.shared.set(key, value, value_ttl, generation)
+            return value
+
+    def invalidate(self, *prefix):
+        """Drop every key whose leading elements match prefix (in every worker, when shared)"""
+        size = len(prefix)
+        with self._lock:
+            for key in [k for k in self._data if k[:size] == prefix]:
+                del self._data[key]
+        if self.shared is not None:
+            self.shared.invalidate(prefix)
+
+    def clear(self):
+        """Drop everything"""
+        self.clear_local()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def clear_local(self):
+        """Drop this worker's entries, keeping the shared tier"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+portfolio_cache = TTLCache()
+
+
+def init_cache(app):
+    """Configure the portfolio cache, and its cross-worker tier, from app config"""
+    portfolio_cache.ttl = int(app.config.get('CACHE_TTL', 60))
+    path = app.config.get('SHARED_CACHE_PATH')
+    if path and portfolio_cache.shared is None:
+        size = int(app.config.get('SHARED_CACHE_SIZE_MB', 64)) * 1024 * 1024
+        try:
+            portfolio_cache.shared = SharedCache(path, size)
+            logger.info(f"Shared cache at {path} ({size // (1024 * 1024)} MB)")
+        except OSError as e:
+            logger.error(f"Shared cache disabled, cannot open {path}: {e}")
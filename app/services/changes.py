@@ -0,0 +1,152 @@
+"""Change detection service - fingerprints holdings and diffs against the last sent report
+
+The scheduler compares a blake2b fingerprint of (symbol, quantity, average
+price, last price) with the one stored when the previous report went out.
+Identical books, or books whose value moved less than REPORT_CHANGE_THRESHOLD
+percent without any position changes, skip the full report. Full reports get
+day-over-day deltas against that stored baseline.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime
+import numpy as np
+from app.services import resilience, money, records
+from app.services.holdings import HoldingsTable
+
+logger = logging.getLogger(__name__)
+
+# Percent move in total value below which an unchanged book is "no change"
+change_threshold = 0.0
+# What to do on no change: 'skip', 'note' (compact email) or 'send' (full report)
+no_change_mode = 'skip'
+
+MOVERS = 5
+FINGERPRINT_FIELDS = ('quantity', 'average_price', 'last_price')
+
+
+def fingerprint(holdings):
+    """Cheap digest of positions and prices; equal digests mean nothing changed.
+
+    Hashes symbols plus the numeric columns as packed float64 arrays, in Kite's
+    (stable) order: a reordered response only costs one extra full report.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update('\n'.join(map(str, records.values(holdings, 'tradingsymbol'))).encode())
+    for field in FINGERPRINT_FIELDS:
+        column = np.array(records.values(holdings, field, 0), dtype=np.float64)
+        digest.update(column.tobytes())
+    return digest.hexdigest()
+
+
+def _positions(holdings):
+    return dict(zip(records.values(holdings, 'tradingsymbol'), records.values(holdings, 'quantity', 0)))
+
+
+def _state_path(user_key):
+    return os.path.join(resilience.snapshot_dir, f'report-{resilience.safe_key(user_key)}.json')
+
+
+def load_state(user_key):
+    """Baseline saved when the user's last full report was sent, or None"""
+    try:
+        with open(_state_path(user_key)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.error(f"Could not read report state: {e}")
+        return None
+
+
+def save_state(user_key, holdings, analysis):
+    """Record the book a full report was just sent for"""
+    state = {
+        'sent_at': datetime.now().isoformat(timespec='seconds'),
+        'fingerprint': fingerprint(holdings),
+        'positions': _positions(holdings),
+        'total_value': analysis['total_value'],
+        'total_pnl': analysis['total_pnl'],
+        'sectors': {name: data['value'] for name, data in analysis['sectors'].items()},
+        'holdings': {symbol: [value, pnl] for symbol, value, pnl in HoldingsTable(holdings).positions()}
+    }
+    try:
+        os.makedirs(resilience.snapshot_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=resilience.snapshot_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, _state_path(user_key))
+    except Exception as e:
+        logger.error(f"Could not save report state: {e}")
+
+
+def evaluate(user_key, holdings):
+    """Decide how to report on these holdings.
+
+    Returns (action, previous_state, change_pct) where action is 'full',
+    'skip' or 'note'.
+    """
+    previous = load_state(user_key)
+    if previous is None:
+        return 'full', None, None
+
+    if fingerprint(holdings) == previous['fingerprint']:
+        change_pct = 0.0
+    elif _positions(holdings) != previous['positions']:
+        return 'full', previous, None
+    else:
+        value = money.book_value(holdings)
+        base = previous['total_value']
+        change_pct = abs(value - base) / base * 100 if base else 0.0
+        if change_pct >= change_threshold:
+            return 'full', previous, change_pct
+
+    if no_change_mode in ('skip', 'note'):
+        return no_change_mode, previous, change_pct
+    return 'full', previous, change_pct
+
+
+def compute_deltas(previous, analysis, holdings):
+    """Day-over-day changes of an analysis against the previous report's baseline"""
+    if not previous:
+        return None
+
+    base_value = previous['total_value']
+    value_change = analysis['total_value'] - base_value
+    current = {symbol: value for symbol, value, _ in HoldingsTable(holdings).positions()}
+    before = previous['holdings']
+
+    movers = []
+    for symbol, value in current.items():
+        if symbol in before:
+            old_value = before[symbol][0]
+            change = value - old_value
+            movers.append({
+                'symbol': symbol,
+                'value_change': change,
+                'value_change_percentage': (change / old_value * 100) if old_value else 0
+            })
+    movers.sort(key=lambda m: abs(m['value_change']), reverse=True)
+
+    return {
+        'since': previous['sent_at'],
+        'value_change': value_change,
+        'value_change_percentage': (value_change / base_value * 100) if base_value else 0,
+        'pnl_change': analysis['total_pnl'] - previous['total_pnl'],
+        'sectors': {
+            name: data['value'] - previous['sectors'].get(name, 0)
+            for name, data in analysis['sectors'].items()
+        },
+        'movers': movers[:MOVERS],
+        'added': sorted(set(current) - set(before)),
+        'removed': sorted(set(before) - set(current))
+    }
+
+
+def init_changes(app):
+    """Configure report change detection from app config"""
+    global change_threshold, no_change_mode
+    change_threshold = float(app.config.get('REPORT_CHANGE_THRESHOLD', 0))
+    no_change_mode = app.config.get('REPORT_NO_CHANGE_MODE', 'skip').lower()
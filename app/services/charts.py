@@ -1,22 +1,53 @@
-"""Chart generation service - creates charts as base64 images"""
+"""Chart generation service - creates charts as base64 images
+
+Charts are drawn on bare matplotlib Figures rather than through pyplot,
+which keeps every figure in a global registry until it is closed, so a
+chart that raised halfway through stayed alive for the life of the worker.
+A Figure is freed as soon as the chart function returns, and live_figures()
+counts the ones not yet collected (exported on /metrics).
+"""
 import io
 import base64
+import logging
+import weakref
+from datetime import datetime
 import matplotlib
 matplotlib.use('Agg')  # Non-interactive backend for web
-import matplotlib.pyplot as plt
+import matplotlib.style
+from matplotlib.figure import Figure
+import numpy as np
 import seaborn as sns
+from app.services.cache import portfolio_cache
+from app.services.metrics import timed
+from app.services import history, correlation
+
+logger = logging.getLogger(__name__)
 
 # Set style
-plt.style.use('seaborn-v0_8')
+matplotlib.style.use('seaborn-v0_8')
 sns.set_palette("husl")
 
+_figures = weakref.WeakSet()
+
+
+def new_figure(figsize):
+    """A Figure outside pyplot's registry, with one Axes"""
+    fig = Figure(figsize=figsize)
+    _figures.add(fig)
+    return fig, fig.subplots()
+
+
+def live_figures():
+    """Figures created here that have not been garbage collected yet"""
+    return len(_figures)
+
 
 def fig_to_base64(fig):
     """Convert matplotlib figure to base64 string"""
-    buf = io.BytesIO()
-    fig.savefig(buf, format='png', dpi=150, bbox_inches='tight', facecolor='white')
-    buf.seek(0)
-    return base64.b64encode(buf.getvalue()).decode('utf-8')
+    with io.BytesIO() as buf:
+        fig.savefig(buf, format='png', dpi=150, bbox_inches='tight', facecolor='white')
+        # Encode straight from the buffer instead of copying the PNG out first
+        return base64.b64encode(buf.getbuffer()).decode('ascii')
 
 
 def create_sector_chart(analysis):
@@ -30,13 +61,11 @@ def create_sector_chart(analysis):
     if not sector_values or sum(sector_values) == 0:
         return None
 
-    fig, ax = plt.subplots(figsize=(8, 6))
+    fig, ax = new_figure((8, 6))
     ax.pie(sector_values, labels=sectors, autopct='%1.1f%%', startangle=90)
     ax.set_title('Sector Allocation')
 
-    result = fig_to_base64(fig)
-    plt.close(fig)
-    return result
+    return fig_to_base64(fig)
 
 
 def create_gainers_chart(analysis):
@@ -48,7 +77,7 @@ def create_gainers_chart(analysis):
     if not top_gainers:
         return None
 
-    fig, ax = plt.subplots(figsize=(8, 6))
+    fig, ax = new_figure((8, 6))
 
     symbols = [h['symbol'] for h in top_gainers]
     pnls = [h['pnl'] for h in top_gainers]
@@ -64,10 +93,8 @@ def create_gainers_chart(analysis):
         ax.text(bar.get_x() + bar.get_width()/2., height,
                 f'{pnl:,.0f}', ha='center', va='bottom', fontsize=9)
 
-    plt.tight_layout()
-    result = fig_to_base64(fig)
-    plt.close(fig)
-    return result
+    fig.tight_layout()
+    return fig_to_base64(fig)
 
 
 def create_losers_chart(analysis):
@@ -79,7 +106,7 @@ def create_losers_chart(analysis):
     if not top_losers:
         return None
 
-    fig, ax = plt.subplots(figsize=(8, 6))
+    fig, ax = new_figure((8, 6))
 
     symbols = [h['symbol'] for h in top_losers]
     pnls = [abs(h['pnl']) for h in top_losers]
@@ -95,16 +122,114 @@ def create_losers_chart(analysis):
         ax.text(bar.get_x() + bar.get_width()/2., height,
                 f'{pnl:,.0f}', ha='center', va='bottom', fontsize=9)
 
-    plt.tight_layout()
-    result = fig_to_base64(fig)
-    plt.close(fig)
-    return result
+    fig.tight_layout()
+    return fig_to_base64(fig)
+
+
+def create_value_chart(series):
+    """Create portfolio value-over-time line chart from history rows (ts, value, pnl)"""
+    if not series or len(series) < 2:
+        return None
+
+    dates = [datetime.fromtimestamp(ts) for ts, _, _ in series]
+    values = [value for _, value, _ in series]
+    invested = [value - pnl for _, value, pnl in series]
+
+    fig, ax = new_figure((8, 6))
+    ax.plot(dates, values, color='steelblue', linewidth=2, label='Value')
+    ax.plot(dates, invested, color='gray', linewidth=1, linestyle='--', label='Invested')
+    ax.set_title('Portfolio Value')
+    ax.set_ylabel('Value')
+    ax.legend()
+    fig.autofmt_xdate()
+
+    fig.tight_layout()
+    return fig_to_base64(fig)
+
+
+def create_correlation_heatmap(symbols, matrix):
+    """Create return-correlation heatmap from a (symbols x symbols) matrix"""
+    if matrix is None or len(symbols) < 2:
+        return None
+
+    fig, ax = new_figure((8, 7))
+    image = ax.imshow(np.ma.masked_invalid(matrix), cmap='coolwarm', vmin=-1, vmax=1)
+    ax.set_xticks(range(len(symbols)))
+    ax.set_yticks(range(len(symbols)))
+    fontsize = 8 if len(symbols) <= 20 else 5
+    ax.set_xticklabels(symbols, rotation=90, fontsize=fontsize)
+    ax.set_yticklabels(symbols, fontsize=fontsize)
+    ax.grid(False)
+    ax.set_title('Return Correlation')
+    fig.colorbar(image, ax=ax, shrink=0.8)
+
+    fig.tight_layout()
+    return fig_to_base64(fig)
+
+
+# Holdings shown on the correlation heatmap (clustered holdings first)
+HEATMAP_HOLDINGS = 40
+
+# Window and resolution of the value-over-time chart
+VALUE_CHART_DAYS = 90
+VALUE_CHART_POINTS = 200
+
+
+CHART_BUILDERS = {
+    'sector_pie': create_sector_chart,
+    'gainers': create_gainers_chart,
+    'losers': create_losers_chart
+}
 
 
 def create_all_charts(analysis):
     """Create all charts and return as dict of base64 strings"""
-    return {
-        'sector_pie': create_sector_chart(analysis),
-        'gainers': create_gainers_chart(analysis),
-        'losers': create_losers_chart(analysis)
-    }
+    charts = {}
+    for name, builder in CHART_BUILDERS.items():
+        with timed(f'chart_{name}'):
+            charts[name] = builder(analysis)
+    return charts
+
+
+def load_chart(user_key, name, analysis):
+    """Create a single chart, reusing the cached image while fresh"""
+    builder = CHART_BUILDERS[name]
+
+    def compute():
+        with timed(f'chart_{name}'):
+            return builder(analysis)
+
+    return portfolio_cache.get_or_set((user_key, 'chart', name), compute)
+
+
+def load_value_chart(user_key):
+    """Create the value-over-time chart from the history store, reusing the cached image"""
+    def compute():
+        with timed('chart_value_history'):
+            try:
+                series = history.portfolio_series(user_key, days=VALUE_CHART_DAYS,
+                                                  max_points=VALUE_CHART_POINTS)
+            except Exception as e:
+                logger.error(f"Could not read portfolio history: {e}")
+                return None
+            return create_value_chart(series)
+
+    return portfolio_cache.get_or_set((user_key, 'chart', 'value_history'), compute)
+
+
+def load_correlation_chart(user_key):
+    """Create the correlation heatmap from the correlation store, reusing the cached image"""
+    def compute():
+        with timed('chart_correlation'):
+            try:
+                loaded, _ = correlation.load_matrix(user_key)
+            except Exception as e:
+                logger.error(f"Could not read correlations: {e}")
+                return None
+            if loaded is None:
+                return None
+            symbols, matrix = loaded
+            order = correlation.heatmap_order(symbols, matrix, HEATMAP_HOLDINGS)
+            return create_correlation_heatmap([symbols[i] for i in order], matrix[np.ix_(order, order)])
+
+    return portfolio_cache.get_or_set((user_key, 'chart', 'correlation'), compute)
@@ -0,0 +1,444 @@
+"""Correlation service - pairwise return correlations kept up to date day by day
+
+Each user's store holds running sums over a sliding window of daily returns
+(CORRELATION_WINDOW days): shared-day counts N, sum(x*y), and sum(x) and
+sum(x^2) per pair, since two holdings only share the days both were held.
+A new day adds its outer products and the day leaving the window subtracts
+its own, so an update is O(holdings^2) however long the window. The sums are
+writer-only float64 matrices; they are re-derived from the stored return
+window every RESYNC_EVERY days to cancel float drift.
+
+A day is journaled before the arrays change: the meta file is written with
+the new window and the ring row being filled, next to the day's returns. A
+store opened with a journal left by a crash part-way through an update
+writes that row again and re-derives the sums, so a day is never counted
+twice or half.
+
+The published correlation matrix is a float32 packed upper triangle,
+memory-mapped by readers. Clusters are connected components (union-find)
+of pairs correlated at or above CORRELATION_CLUSTER_THRESHOLD.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from functools import lru_cache
+import numpy as np
+from app.services.metrics import timed
+from app.services import records, resilience
+
+logger = logging.getLogger(__name__)
+
+enabled = True
+data_dir = 'correlation'
+window = 250
+cluster_threshold = 0.8
+bootstrap_days = 0
+
+# Pairs need this many shared days before a correlation is published
+MIN_OBSERVATIONS = 20
+RESYNC_EVERY = 50
+CLUSTERS = 5
+INITIAL_CAPACITY = 64
+# Sums are (holdings x holdings) float64 matrices: 2000 holdings is 128 MB on disk
+MAX_HOLDINGS = 2000
+# Kite allows 3 historical-data requests a second
+HISTORICAL_INTERVAL = 0.35
+
+_writer_lock = threading.Lock()
+
+
+@lru_cache(maxsize=4)
+def _triu(capacity):
+    return np.triu_indices(capacity)
+
+
+def _write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+def _write_npy(path, array):
+    # A file object stops np.save appending '.npy' to the temporary name
+    with open(path, 'wb') as f:
+        np.save(f, array)
+
+
+def _write_atomic(path, write):
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+class CorrelationStore:
+    """One user's return window, running sums and published correlations on disk"""
+
+    SUMS = ('n', 'sxy', 'sx', 'sxx')
+
+    def __init__(self, directory, window_days=None):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.meta = self._read_meta() or {'symbols': [], 'held': [], 'days': [], 'head': 0,
+                                          'updates': 0, 'capacity': 0, 'window': window_days or window}
+        self.window = self.meta['window']
+        self.capacity = self.meta['capacity']
+        self.slot = {symbol: i for i, symbol in enumerate(self.meta['symbols'])}
+        self.arrays = {}
+        if self.capacity:
+            for name in ('ring',) + self.SUMS:
+                self.arrays[name] = np.load(self._path(name), mmap_mode='r+')
+        if self.meta.get('pending') is not None:
+            self._recover()
+
+    def _path(self, name):
+        return os.path.join(self.directory, f'{name}.npy')
+
+    def _read_meta(self):
+        try:
+            with open(os.path.join(self.directory, 'meta.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _shapes(self, capacity):
+        shapes = {name: ((capacity, capacity), np.float64) for name in self.SUMS}
+        shapes['ring'] = ((self.window, capacity), np.float32)
+        return shapes
+
+    def _grow(self, needed):
+        """Re-allocate every array for at least `needed` holdings, keeping contents"""
+        capacity = max(INITIAL_CAPACITY, self.capacity * 2, needed)
+        old = self.capacity
+        for name, (shape, dtype) in self._shapes(capacity).items():
+            grown = np.lib.format.open_memmap(self._path(name) + '.grow', mode='w+', dtype=dtype, shape=shape)
+            grown[:] = np.nan if name == 'ring' else 0
+            if old:
+                current = self.arrays[name]
+                if name == 'ring':
+                    grown[:, :old] = current
+                else:
+                    grown[:old, :old] = current
+            grown.flush()
+            del grown
+            os.replace(self._path(name) + '.grow', self._path(name))
+            self.arrays[name] = np.load(self._path(name), mmap_mode='r+')
+        self.capacity = capacity
+
+    def slots_for(self, symbols):
+        """Slot index per symbol, adding slots for symbols seen for the first time"""
+        new = [s for s in dict.fromkeys(symbols) if s not in self.slot]
+        if new:
+            if len(self.slot) + len(new) > self.capacity:
+                self._grow(len(self.slot) + len(new))
+            for symbol in new:
+                self.slot[symbol] = len(self.meta['symbols'])
+                self.meta['symbols'].append(symbol)
+        return np.array([self.slot[s] for s in symbols], dtype=np.intp)
+
+    def _apply(self, added, removed=None):
+        """Add one day's returns to the running sums, and remove another day's.
+
+        Both go in as one rank-2 update per sum.
+        """
+        days = np.array([added] if removed is None else [added, removed], dtype=np.float64)
+        present = ~np.isnan(days)
+        x = np.where(present, days, 0)
+        m = present.astype(np.float64)
+        signed_x, signed_m = x.copy(), m.copy()
+        signed_x[1:] *= -1
+        signed_m[1:] *= -1
+        a = self.arrays
+        a['n'] += signed_m.T @ m
+        a['sxy'] += signed_x.T @ x
+        a['sx'] += signed_x.T @ m
+        a['sxx'] += (signed_x * x).T @ m
+
+    def _journal(self, row, vector):
+        """Persist the window about to be written, and the returns for its ring row"""
+        _write_atomic(self._path('pending'), lambda path: _write_npy(path, vector))
+        self.meta['pending'] = row
+        self.meta['capacity'] = self.capacity
+        _write_atomic(os.path.join(self.directory, 'meta.json'), lambda path: _write_json(path, self.meta))
+
+    def _recover(self):
+        """Finish an update interrupted after _journal(): the sums may hold part of it"""
+        logger.warning(f"Correlation store {self.directory} was left mid-update; rebuilding its sums")
+        self.arrays['ring'][self.meta['pending']] = np.load(self._path('pending'))
+        self.resync()
+        self.save()
+
+    def _ring_rows(self):
+        return [(self.meta['head'] + k) % self.window for k in range(len(self.meta['days']))]
+
+    def last_vector(self):
+        if not self.meta['days']:
+            return None
+        return np.array(self.arrays['ring'][self._ring_rows()[-1]])
+
+    def add_day(self, day, symbols, returns):
+        """Record one day's returns ({symbols[i]: returns[i]}); a repeat day replaces it"""
+        slots = self.slots_for(symbols)
+        vector = np.full(self.capacity, np.nan, dtype=np.float32)
+        vector[slots] = returns
+        days = self.meta['days']
+
+        removed = None
+        if days and days[-1] == day:
+            row = self._ring_rows()[-1]
+            removed = np.array(self.arrays['ring'][row])
+        else:
+            if len(days) == self.window:
+                oldest = self.meta['head']
+                removed = np.array(self.arrays['ring'][oldest])
+                self.meta['head'] = (oldest + 1) % self.window
+                days.pop(0)
+            days.append(day)
+            row = self._ring_rows()[-1]
+
+        self._journal(row, vector)
+        self.arrays['ring'][row] = vector
+        self._apply(vector, removed)
+        self.meta['held'] = list(symbols)
+        self.meta['updates'] += 1
+        if self.meta['updates'] >= RESYNC_EVERY:
+            self.resync()
+
+    def load_days(self, days, symbols, matrix):
+        """Replace the window with (days x symbols) returns, e.g. from historical candles"""
+        slots = self.slots_for(symbols)
+        days, matrix = days[-self.window:], matrix[-self.window:]
+        ring = self.arrays['ring']
+        ring[:] = np.nan
+        ring[np.arange(len(days))[:, None], slots] = matrix
+        self.meta['days'] = list(days)
+        self.meta['held'] = list(symbols)
+        self.meta['head'] = 0
+        self.resync()
+
+    def resync(self):
+        """Recompute every running sum from the stored return window"""
+        ring = np.array(self.arrays['ring'][self._ring_rows()], dtype=np.float64)
+        present = ~np.isnan(ring)
+        x = np.where(present, ring, 0)
+        m = present.astype(np.float64)
+        a = self.arrays
+        a['n'][:] = m.T @ m
+        a['sxy'][:] = x.T @ x
+        a['sx'][:] = x.T @ m
+        a['sxx'][:] = (x * x).T @ m
+        self.meta['updates'] = 0
+
+    def correlations(self):
+        """Packed float32 upper triangle of correlations (NaN below MIN_OBSERVATIONS)"""
+        a = self.arrays
+        n, sx = np.asarray(a['n']), np.asarray(a['sx'])
+        with np.errstate(all='ignore'):
+            cov = n * a['sxy'] - sx * sx.T
+            var = n * a['sxx'] - sx * sx
+            corr = cov / np.sqrt(var * var.T)
+        corr[(n < MIN_OBSERVATIONS) | ~np.isfinite(corr)] = np.nan
+        np.clip(corr, -1, 1, out=corr)
+        return corr[_triu(self.capacity)].astype(np.float32)
+
+    def save(self):
+        """Publish correlations and metadata for readers"""
+        corr = self.correlations()
+        _write_atomic(self._path('corr'), lambda path: _write_npy(path, corr))
+        self.meta['capacity'] = self.capacity
+        self.meta.pop('pending', None)
+        _write_atomic(os.path.join(self.directory, 'meta.json'),
+                      lambda path: _write_json(path, self.meta))
+
+
+def _user_dir(user_key):
+    return os.path.join(data_dir, resilience.safe_key(user_key))
+
+
+def daily_returns(holdings):
+    """(symbols, returns) of last price against previous close, for holdings with a close"""
+    symbols, values = [], []
+    for holding in holdings:
+        close = holding.get('close_price') or 0
+        if close > 0:
+            symbols.append(holding.get('tradingsymbol'))
+            values.append(holding.get('last_price', 0) / close - 1)
+    return symbols, np.array(values, dtype=np.float32)
+
+
+def update(user_key, holdings, day=None):
+    """Fold the day's returns into the user's store.
+
+    Kite keeps reporting the last session's move over weekends and holidays,
+    so a vector identical to the previous day's is not recorded again.
+    """
+    if not enabled or not holdings or getattr(holdings, 'stale', False):
+        return False
+    symbols, values = daily_returns(holdings)
+    if not symbols:
+        return False
+
+    with _writer_lock, timed('correlation_update'):
+        store = CorrelationStore(_user_dir(user_key))
+        if len(store.slot.keys() | set(symbols)) > MAX_HOLDINGS:
+            logger.warning(f"Correlations not tracked above {MAX_HOLDINGS} holdings")
+            return False
+        last = store.last_vector()
+        if last is not None and all(s in store.slot for s in symbols):
+            if np.array_equal(last[[store.slot[s] for s in symbols]], values):
+                return False
+        store.add_day((day or date.today()).isoformat(), symbols, values)
+        store.save()
+    return True
+
+
+def bootstrap(user_key, kite, holdings, days=None):
+    """Fill an empty store from Kite daily candles (needs the historical data add-on)"""
+    days = days or bootstrap_days
+    if len(holdings) > MAX_HOLDINGS:
+        logger.warning(f"Correlations not tracked above {MAX_HOLDINGS} holdings")
+        return False
+    end = date.today()
+    start = end - timedelta(days=days)
+    closes = {}
+    for holding in holdings:
+        try:
+            candles = kite.historical_data(holding['instrument_token'], start, end, 'day')
+        except Exception as e:
+            logger.error(f"Could not fetch candles for {holding.get('tradingsymbol')}: {e}")
+            continue
+        closes[holding['tradingsymbol']] = {str(c['date'])[:10]: c['close'] for c in candles}
+        time.sleep(HISTORICAL_INTERVAL)
+    if not closes:
+        return False
+
+    symbols = list(closes)
+    all_days = sorted({day for by_day in closes.values() for day in by_day})
+    prices = np.full((len(all_days), len(symbols)), np.nan)
+    day_index = {day: i for i, day in enumerate(all_days)}
+    for col, symbol in enumerate(symbols):
+        for day, close in closes[symbol].items():
+            prices[day_index[day], col] = close
+    with np.errstate(all='ignore'):
+        matrix = (prices[1:] / prices[:-1] - 1).astype(np.float32)
+
+    with _writer_lock, timed('correlation_bootstrap'):
+        store = CorrelationStore(_user_dir(user_key))
+        store.load_days(all_days[1:], symbols, matrix)
+        store.save()
+    logger.info(f"Correlation store seeded with {len(all_days) - 1} days for {len(symbols)} holdings")
+    return True
+
+
+def heatmap_order(symbols, matrix, limit):
+    """Indexes of up to `limit` symbols, members of the same cluster side by side"""
+    order = [symbols.index(s) for cluster in find_clusters(symbols, matrix, limit=None)
+             for s in cluster['symbols']]
+    seen = set(order)
+    order += [i for i in range(len(symbols)) if i not in seen]
+    return order[:limit]
+
+
+def is_empty(user_key):
+    try:
+        with open(os.path.join(_user_dir(user_key), 'meta.json')) as f:
+            return not json.load(f)['days']
+    except FileNotFoundError:
+        return True
+
+
+def load_matrix(user_key, symbols=None):
+    """((symbols, matrix) or None, days in window) for the given symbols.
+
+    symbols defaults to the holdings of the last recorded day.
+    """
+    directory = _user_dir(user_key)
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        packed = np.load(os.path.join(directory, 'corr.npy'), mmap_mode='r')
+    except FileNotFoundError:
+        return None, 0
+
+    slot = {symbol: i for i, symbol in enumerate(meta['symbols'])}
+    known = [s for s in dict.fromkeys(meta['held'] if symbols is None else symbols) if s in slot]
+    if len(known) < 2:
+        return None, len(meta['days'])
+
+    # Pair (i <= j) sits at i*C - i*(i-1)/2 + (j - i) in the packed triangle
+    capacity = meta['capacity']
+    index = np.array([slot[s] for s in known])
+    i = np.minimum(index[:, None], index[None, :])
+    j = np.maximum(index[:, None], index[None, :])
+    matrix = np.asarray(packed[i * capacity - i * (i - 1) // 2 + (j - i)])
+    np.fill_diagonal(matrix, 1.0)
+    return (known, matrix), len(meta['days'])
+
+
+def find_clusters(symbols, matrix, threshold=None, limit=CLUSTERS):
+    """Groups of holdings linked by pairwise correlation >= threshold, largest first"""
+    threshold = cluster_threshold if threshold is None else threshold
+    parent = list(range(len(symbols)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    rows, cols = np.nonzero(np.triu(np.nan_to_num(matrix, nan=-1.0) >= threshold, k=1))
+    for i, j in zip(rows.tolist(), cols.tolist()):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[root_j] = root_i
+
+    groups = {}
+    for i in range(len(symbols)):
+        groups.setdefault(find(i), []).append(i)
+
+    clusters = []
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        block = matrix[np.ix_(members, members)]
+        average = float(np.nanmean(block[np.triu_indices(len(members), k=1)]))
+        clusters.append({
+            'symbols': [symbols[i] for i in members],
+            'size': len(members),
+            'average_correlation': average
+        })
+    clusters.sort(key=lambda c: (c['size'], c['average_correlation']), reverse=True)
+    return clusters[:limit]
+
+
+def load_clusters(user_key, holdings):
+    """Correlation block for the analysis: top clusters among current holdings, or None"""
+    if not enabled:
+        return None
+    try:
+        loaded, days = load_matrix(user_key, records.values(holdings, 'tradingsymbol'))
+    except Exception as e:
+        logger.error(f"Could not read correlations: {e}")
+        return None
+    if loaded is None:
+        return None
+    symbols, matrix = loaded
+    return {'days': days, 'threshold': cluster_threshold, 'clusters': find_clusters(symbols, matrix)}
+
+
+def init_correlation(app):
+    """Configure the correlation store from app config"""
+    global enabled, data_dir, window, cluster_threshold, bootstrap_days
+    enabled = str(app.config.get('CORRELATION_ENABLED', 'true')).lower() in ('1', 'true', 'yes')
+    data_dir = app.config.get('CORRELATION_DIR') or data_dir
+    window = int(app.config.get('CORRELATION_WINDOW', window))
+    cluster_threshold = float(app.config.get('CORRELATION_CLUSTER_THRESHOLD', cluster_threshold))
+    bootstrap_days = int(app.config.get('CORRELATION_BOOTSTRAP_DAYS', bootstrap_days))
@@ -1,12 +1,171 @@
 """Email service - sends portfolio reports via email"""
+import base64
 import os
 import logging
 from datetime import datetime
 import resend
+from markupsafe import escape
+from app.services.metrics import timed
+from app.services.fragments import fragment_cache, digest, summary_slice, holding_rows, sector_rows, TABLE_ROWS
 
 logger = logging.getLogger(__name__)
 
 
+def stale_banner(analysis):
+    """Warning shown when the report was built from the last-known-good snapshot"""
+    if not analysis.get('stale'):
+        return ''
+    return f"""
+        <div class="stale">
+            <strong>Kite was unavailable.</strong> Figures below are from the last
+            successful fetch at {escape(analysis.get('as_of', 'an earlier time'))}.
+        </div>
+    """
+
+
+def deltas_section(analysis):
+    """Day-over-day changes since the previous report, when the scheduler attached them"""
+    deltas = analysis.get('deltas')
+    if not deltas:
+        return ''
+
+    value_class = 'positive' if deltas['value_change'] >= 0 else 'negative'
+    pnl_class = 'positive' if deltas['pnl_change'] >= 0 else 'negative'
+    html = f"""
+        <div class="section">
+            <h2>Since Last Report ({deltas['since'][:10]})</h2>
+            <p><strong>Value:</strong>
+                <span class="{value_class}">{deltas['value_change']:+,.2f}
+                ({deltas['value_change_percentage']:+.2f}%)</span></p>
+            <p><strong>P&L:</strong> <span class="{pnl_class}">{deltas['pnl_change']:+,.2f}</span></p>
+    """
+
+    if deltas['added'] or deltas['removed']:
+        html += f"""
+            <p><strong>New positions:</strong> {escape(', '.join(deltas['added'])) or 'none'}<br>
+               <strong>Closed positions:</strong> {escape(', '.join(deltas['removed'])) or 'none'}</p>
+        """
+
+    if deltas['movers']:
+        html += """
+            <table>
+                <tr><th>Biggest Movers</th><th>Value Change</th><th>Change %</th></tr>
+        """
+        for mover in deltas['movers']:
+            mover_class = 'positive' if mover['value_change'] >= 0 else 'negative'
+            html += f"""
+                <tr>
+                    <td>{escape(mover['symbol'])}</td>
+                    <td class="{mover_class}">{mover['value_change']:+,.2f}</td>
+                    <td class="{mover_class}">{mover['value_change_percentage']:+.2f}%</td>
+                </tr>
+            """
+        html += """
+            </table>
+        """
+
+    sectors = sorted(((name, change) for name, change in deltas['sectors'].items() if round(change, 2)),
+                     key=lambda item: abs(item[1]), reverse=True)
+    if sectors:
+        html += """
+            <table>
+                <tr><th>Sector</th><th>Value Change</th></tr>
+        """
+        for name, change in sectors:
+            html += f"""
+                <tr>
+                    <td>{escape(name)}</td>
+                    <td class="{'positive' if change >= 0 else 'negative'}">{change:+,.2f}</td>
+                </tr>
+            """
+        html += """
+            </table>
+        """
+
+    return html + """
+        </div>
+    """
+
+
+def returns_summary(analysis):
+    """XIRR / time-weighted return lines when a tradebook is configured"""
+    returns = analysis.get('returns')
+    if not returns:
+        return ''
+
+    def pct(value):
+        return f"{value:+.2f}%" if value is not None else "n/a"
+
+    since = f" (since {returns['twr_since']})" if returns.get('twr_since') else ""
+    return f"""
+            <p><strong>XIRR:</strong> {pct(returns['xirr'])}</p>
+            <p><strong>Time-Weighted Return:</strong> {pct(returns['twr'])}{since}</p>
+    """
+
+
+def generate_no_change_content(holdings_value, change_pct, since):
+    """Compact HTML note sent instead of a full report on an idle day"""
+    return f"""
+    <html>
+    <body style="font-family: Arial, sans-serif; margin: 20px;">
+        <p>No significant change in your portfolio since the report of {since[:10]}.</p>
+        <p><strong>Total Portfolio Value:</strong> {holdings_value:,.2f}
+           ({change_pct:.2f}% move)</p>
+        <p><em>This note was generated by Portfolio Reporter.</em></p>
+    </body>
+    </html>
+    """
+
+
+def alert_line(alert):
+    """One triggered alert as a sentence"""
+    if alert['type'] == 'sector_weight':
+        return (f"{alert['sector']} weight crossed {alert['op']} {alert['value']:.2f}% "
+                f"(now {alert['weight']:.2f}%)")
+    if alert['type'] == 'pnl_percentage':
+        return (f"{alert['symbol']} P&L crossed {alert['op']} {alert['value']:+.2f}% "
+                f"(now {alert['pnl_percentage']:+.2f}% at {alert['price']:,.2f})")
+    return f"{alert['symbol']} crossed {alert['op']} {alert['value']:,.2f} (now {alert['price']:,.2f})"
+
+
+def generate_alert_content(alerts, omitted=0):
+    """HTML digest of triggered alerts, oldest first"""
+    # Symbols and sectors come from Kite and user rules: escaped like the dashboard's
+    rows = ''.join(f"""
+            <tr><td>{escape(alert['at'][11:19])}</td><td>{escape(alert_line(alert))}</td></tr>""" for alert in alerts)
+    more = f"<p>...and {omitted} more.</p>" if omitted else ""
+    return f"""
+    <html>
+    <body style="font-family: Arial, sans-serif; margin: 20px;">
+        <h2>Portfolio Alerts</h2>
+        <table style="border-collapse: collapse;">
+            <tr><th align="left">Time</th><th align="left">Alert</th></tr>{rows}
+        </table>
+        {more}
+        <p><em>These alerts were sent by Portfolio Reporter.</em></p>
+    </body>
+    </html>
+    """
+
+
+def summary_section(analysis):
+    """Portfolio summary block, rendered once per distinct set of figures"""
+    return fragment_cache.get_or_render(('email_summary', digest(summary_slice(analysis))), lambda: f"""
+        <div class="summary">
+            <h2>Portfolio Summary</h2>
+            <p><strong>Total Portfolio Value:</strong> {analysis['total_value']:,.2f}</p>
+            <p><strong>Total P&L:</strong>
+                <span class="{'positive' if analysis['total_pnl'] >= 0 else 'negative'}">
+                    {analysis['total_pnl']:,.2f} ({analysis['total_pnl_percentage']:+.2f}%)
+                </span>
+            </p>
+            <p><strong>Number of Holdings:</strong> {analysis['holdings_count']}</p>
+            <p><strong>Sectors Covered:</strong> {len(analysis['sectors'])}</p>
+            {returns_summary(analysis)}
+        </div>
+    """)
+
+
 def generate_email_content(analysis):
     """Generate HTML email content with portfolio analysis"""
     if not analysis:
@@ -25,6 +184,7 @@ def generate_email_content(analysis):
             table {{ border-collapse: collapse; width: 100%; }}
             th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
             th {{ background-color: #f2f2f2; }}
+            .stale {{ background-color: #fff3cd; padding: 15px; border-radius: 8px; margin: 20px 0; }}
         </style>
     </head>
     <body>
@@ -32,36 +192,16 @@ def generate_email_content(analysis):
             <h1>Portfolio Analysis Report</h1>
             <p>Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
         </div>
+        {stale_banner(analysis)}
+        {deltas_section(analysis)}
 
-        <div class="summary">
-            <h2>Portfolio Summary</h2>
-            <p><strong>Total Portfolio Value:</strong> {analysis['total_value']:,.2f}</p>
-            <p><strong>Total P&L:</strong>
-                <span class="{'positive' if analysis['total_pnl'] >= 0 else 'negative'}">
-                    {analysis['total_pnl']:,.2f} ({analysis['total_pnl_percentage']:+.2f}%)
-                </span>
-            </p>
-            <p><strong>Number of Holdings:</strong> {analysis['holdings_count']}</p>
-            <p><strong>Sectors Covered:</strong> {len(analysis['sectors'])}</p>
-        </div>
+        {summary_section(analysis)}
 
         <div class="section">
             <h2>Top Gainers</h2>
             <table>
                 <tr><th>Symbol</th><th>P&L</th><th>P&L %</th><th>Current Value</th></tr>
-    """
-
-    for gainer in analysis['top_gainers'][:5]:
-        html_content += f"""
-                <tr>
-                    <td>{gainer['symbol']}</td>
-                    <td class="positive">{gainer['pnl']:,.2f}</td>
-                    <td class="positive">+{gainer['pnl_percentage']:.2f}%</td>
-                    <td>{gainer['current_value']:,.2f}</td>
-                </tr>
-        """
-
-    html_content += """
+                {holding_rows(analysis['top_gainers'][:TABLE_ROWS], True)}
             </table>
         </div>
 
@@ -69,19 +209,7 @@ def generate_email_content(analysis):
             <h2>Top Losers</h2>
             <table>
                 <tr><th>Symbol</th><th>P&L</th><th>P&L %</th><th>Current Value</th></tr>
-    """
-
-    for loser in analysis['top_losers'][:5]:
-        html_content += f"""
-                <tr>
-                    <td>{loser['symbol']}</td>
-                    <td class="negative">{loser['pnl']:,.2f}</td>
-                    <td class="negative">{loser['pnl_percentage']:.2f}%</td>
-                    <td>{loser['current_value']:,.2f}</td>
-                </tr>
-        """
-
-    html_content += """
+                {holding_rows(analysis['top_losers'][:TABLE_ROWS], False)}
             </table>
         </div>
 
@@ -89,20 +217,7 @@ def generate_email_content(analysis):
             <h2>Sector Analysis</h2>
             <table>
                 <tr><th>Sector</th><th>Value</th><th>P&L</th><th>Holdings</th></tr>
-    """
-
-    for sector, data in analysis['sectors'].items():
-        pnl_class = 'positive' if data['pnl'] >= 0 else 'negative'
-        html_content += f"""
-                <tr>
-                    <td>{sector}</td>
-                    <td>{data['value']:,.2f}</td>
-                    <td class="{pnl_class}">{data['pnl']:,.2f}</td>
-                    <td>{data['count']}</td>
-                </tr>
-        """
-
-    html_content += """
+                {sector_rows(analysis['sectors'])}
             </table>
         </div>
 
@@ -116,8 +231,8 @@ def generate_email_content(analysis):
     return html_content
 
 
-def send_report(analysis, sender_email, resend_api_key, recipient_email):
-    """Send portfolio report via email using Resend API"""
+def deliver(subject, html_content, resend_api_key, recipient_email, attachments=None):
+    """Send one email through Resend; raises ValueError on failure"""
     try:
         # Validate credentials
         if not resend_api_key:
@@ -125,19 +240,48 @@ def send_report(analysis, sender_email, resend_api_key, recipient_email):
             raise ValueError("RESEND_API_KEY not configured in Railway variables")
 
         resend.api_key = resend_api_key
-        html_content = generate_email_content(analysis)
 
         params = {
             "from": "Portfolio Reporter <portfolio@tejaskashyap.com>",
             "to": [recipient_email],
-            "subject": f"Portfolio Analysis Report - {datetime.now().strftime('%Y-%m-%d')}",
+            "subject": subject,
             "html": html_content
         }
+        if attachments:
+            params["attachments"] = attachments
 
-        email = resend.Emails.send(params)
-        logger.info(f"Email report sent successfully to {recipient_email}, id: {email['id']}")
+        with timed('email_send'):
+            email = resend.Emails.send(params)
+        logger.info(f"Email sent successfully to {recipient_email}, id: {email['id']}")
         return True
 
     except Exception as e:
         logger.error(f"Error sending email: {e}")
         raise ValueError(f"Email error: {str(e)}")
+
+
+def send_report(analysis, sender_email, resend_api_key, recipient_email, value_chart=None, exports=()):
+    """Send portfolio report via email using Resend API.
+
+    value_chart is an optional base64 PNG attached as portfolio-value.png;
+    exports are (filename, bytes) pairs attached as they are.
+    """
+    subject = (f"Portfolio Analysis Report - {datetime.now().strftime('%Y-%m-%d')}"
+               + (" (stale data)" if analysis and analysis.get('stale') else ""))
+    attachments = [{"filename": "portfolio-value.png", "content": value_chart}] if value_chart else []
+    attachments += [{"filename": name, "content": base64.b64encode(data).decode()} for name, data in exports]
+    return deliver(subject, generate_email_content(analysis), resend_api_key, recipient_email, attachments or None)
+
+
+def send_no_change_note(holdings_value, change_pct, since, resend_api_key, recipient_email):
+    """Send the compact no-change note instead of a full report"""
+    subject = f"Portfolio Update - {datetime.now().strftime('%Y-%m-%d')} (no significant change)"
+    return deliver(subject, generate_no_change_content(holdings_value, change_pct, since),
+                   resend_api_key, recipient_email)
+
+
+def send_alert_digest(alerts, resend_api_key, recipient_email, omitted=0):
+    """Send one batched email for a user's triggered alerts"""
+    count = len(alerts) + omitted
+    subject = f"Portfolio Alerts - {count} triggered ({datetime.now().strftime('%Y-%m-%d %H:%M')})"
+    return deliver(subject, generate_alert_content(alerts, omitted), resend_api_key, recipient_email)
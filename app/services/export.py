@@ -0,0 +1,197 @@
+"""Export service - holdings as CSV, Parquet or XLSX files, streamed
+
+An export takes the same filters, sort and field projection as
+/api/holdings (see app.services.holdings.parse_query), without paging. It
+reads the HoldingsTable columns CHUNK_ROWS rows at a time, so memory stays
+flat whatever the size of the book:
+  - CSV is written and sent chunk by chunk;
+  - Parquet gets one row group per chunk (pyarrow), each sent as soon as it
+    is written; only the footer waits for the end;
+  - XLSX goes through openpyxl's write-only mode, which spools rows to a
+    temporary file, and the finished workbook is sent from there. It is
+    much the slowest (seconds per 100k rows; install lxml to speed it up).
+
+pyarrow and openpyxl are in requirements.txt, but a trimmed install may lack
+them: those formats are then refused with a ValueError and left out of
+available_formats, which the dashboard offers. REPORT_ATTACH_EXPORT lists formats the scheduled report
+attaches (for example 'xlsx' or 'csv,parquet').
+"""
+import csv
+import importlib
+import io
+import logging
+import tempfile
+import time
+from datetime import date
+from app.services.holdings import parse_query, parse_sort, FIELDS, TEXT_COLUMNS, DEFAULT_SORT
+
+logger = logging.getLogger(__name__)
+
+# Rows read from the table and written per step (and per Parquet row group)
+CHUNK_ROWS = 10000
+# Bytes per piece when sending a finished XLSX file
+READ_SIZE = 1 << 16
+
+# format -> (MIME type, module it needs or None)
+FORMATS = {
+    'csv': ('text/csv', None),
+    'parquet': ('application/vnd.apache.parquet', 'pyarrow'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'openpyxl')
+}
+
+# Formats attached to the scheduled report
+attach_formats = ()
+# Formats whose writer can be imported here (set by init_export)
+available_formats = tuple(FORMATS)
+
+
+def parse_format(fmt):
+    fmt = (fmt or 'csv').lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}; use one of {', '.join(FORMATS)}")
+    module = FORMATS[fmt][1]
+    if module:
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            raise ValueError(f"{fmt} export needs {module}, which is not available: {e}")
+    return fmt
+
+
+def parse_export(args):
+    """(format, query) from request args; the query is parse_query's without paging"""
+    fmt = parse_format(args.get('format'))
+    query = parse_query(args)
+    for key in ('limit', 'offset', 'cursor'):
+        del query[key]
+    return fmt, query
+
+
+def mimetype(fmt):
+    return FORMATS[fmt][0]
+
+
+def filename(fmt):
+    return f'holdings-{date.today().isoformat()}.{fmt}'
+
+
+def _chunks(table, rows, fields):
+    for start in range(0, len(rows), CHUNK_ROWS):
+        yield table.chunk(rows[start:start + CHUNK_ROWS], fields)
+        # Under gevent this lets other requests run between chunks
+        time.sleep(0)
+
+
+def _csv(table, rows, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for columns in _chunks(table, rows, fields):
+        writer.writerows(zip(*columns))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # A header-only file when nothing matched
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class _Spool:
+    """Write-only file whose contents are taken out as they arrive"""
+
+    def __init__(self):
+        self._parts = []
+        self._size = 0
+        self.closed = False
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._size
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _parquet(table, rows, fields):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(field, pa.string() if field in TEXT_COLUMNS else
+                         pa.int64() if field == 'quantity' else pa.float64()) for field in fields])
+    spool = _Spool()
+    with pq.ParquetWriter(spool, schema) as writer:
+        for columns in _chunks(table, rows, fields):
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=type_) for column, type_ in zip(columns, schema.types)], schema=schema))
+            yield spool.drain()
+    yield spool.drain()
+
+
+def _xlsx(table, rows, fields):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Holdings')
+    sheet.append(fields)
+    for columns in _chunks(table, rows, fields):
+        for row in zip(*columns):
+            sheet.append(row)
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while data := f.read(READ_SIZE):
+            yield data
+
+
+WRITERS = {'csv': _csv, 'parquet': _parquet, 'xlsx': _xlsx}
+
+
+def stream(table, fmt, q=None, sector=None, exchange=None, side=None, sort=DEFAULT_SORT, fields=FIELDS):
+    """Matching holdings as an iterator of file pieces (str for CSV, bytes otherwise).
+
+    Filters and sort are checked before anything is produced, so a bad
+    query raises ValueError here rather than midway through a response.
+    """
+    rows = table.select(parse_sort(sort), q=q, sector=sector, exchange=exchange, side=side)
+    return WRITERS[parse_format(fmt)](table, rows, fields)
+
+
+def export_bytes(table, fmt, **query):
+    """A whole export in memory, for attaching to an email"""
+    pieces = stream(table, fmt, **query)
+    return ''.join(pieces).encode() if fmt == 'csv' else b''.join(pieces)
+
+
+def init_export(app):
+    """Find which export formats work here and which the scheduled report attaches"""
+    global attach_formats, available_formats
+    available = []
+    for fmt in FORMATS:
+        try:
+            available.append(parse_format(fmt))
+        except ValueError as e:
+            logger.warning(f"{fmt} export disabled: {e}")
+    available_formats = tuple(available)
+
+    formats = []
+    for fmt in (app.config.get('REPORT_ATTACH_EXPORT') or '').split(','):
+        fmt = fmt.strip().lower()
+        if not fmt or fmt in formats:
+            continue
+        try:
+            formats.append(parse_format(fmt))
+        except ValueError as e:
+            logger.warning(f"Ignoring REPORT_ATTACH_EXPORT entry {fmt!r}: {e}")
+    attach_formats = tuple(formats)
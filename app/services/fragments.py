@@ -0,0 +1,136 @@
+"""Fragments service - rendered HTML cached by the analysis data it shows
+
+Each dashboard section and each table body depends on a small slice of the
+analysis (the summary figures, the shown gainers, the sectors...). The slice
+is serialized and hashed with blake2b and the rendered HTML is kept under
+(name, digest), so an unchanged slice is never rendered twice, whichever
+request, analysis object or user it comes from. A live update that only
+moved the losers re-renders the losers and nothing else.
+
+Table rows are rendered from templates/partials by a standalone Jinja
+environment rather than Flask's, so the dashboard tables and the email
+report share the same cached rows, and batch mode (which has no app) can
+render them too.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from markupsafe import Markup
+from app.services.metrics import record_cache
+
+# Rendered fragments kept; the least recently used go first
+cache_size = 512
+
+# Rows shown in the gainer and loser tables
+TABLE_ROWS = 5
+
+env = Environment(loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), '..', 'templates')),
+                  autoescape=select_autoescape(['html']))
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered HTML"""
+
+    def __init__(self):
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        """Cached HTML for key, or render() stored under it"""
+        with self._lock:
+            html = self._data.get(key)
+            if html is not None:
+                self._data.move_to_end(key)
+        record_cache('fragment', html is not None)
+        if html is not None:
+            return html
+
+        # Concurrent misses may both render; the results are identical
+        html = render()
+        with self._lock:
+            self._data[key] = html
+            while len(self._data) > cache_size:
+                self._data.popitem(last=False)
+        return html
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+fragment_cache = FragmentCache()
+
+
+def digest(data):
+    """Stable hash of JSON-serializable data"""
+    encoded = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str).encode()
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+def shown_xirr(analysis, rows):
+    """{symbol: XIRR} for the rows a table shows, or None without returns"""
+    returns = analysis.get('returns')
+    if not returns:
+        return None
+    return {row['symbol']: returns['holdings'].get(row['symbol']) for row in rows}
+
+
+def holding_rows(rows, positive, xirr=None):
+    """Table rows for gainers (positive) or losers, with an XIRR column when xirr is given"""
+    context = {'rows': rows, 'positive': positive, 'xirr': xirr}
+    return Markup(fragment_cache.get_or_render(
+        ('holding_rows', digest(context)),
+        lambda: env.get_template('partials/holding_rows.html').render(context)))
+
+
+def sector_rows(sectors):
+    """Table rows for the sector rollup"""
+    return Markup(fragment_cache.get_or_render(
+        ('sector_rows', digest(sectors)),
+        lambda: env.get_template('partials/sector_rows.html').render(sectors=sectors)))
+
+
+def summary_slice(analysis):
+    """Figures the summary cards (and the email summary) show"""
+    returns = analysis.get('returns') or {}
+    return [analysis.get(field) for field in
+            ('total_value', 'total_pnl', 'total_pnl_percentage', 'holdings_count', 'stale', 'as_of')
+            ] + [len(analysis['sectors']), [returns.get(field) for field in ('xirr', 'twr', 'twr_since')]]
+
+
+def _table_slice(side):
+    def slice_(analysis):
+        rows = analysis[side][:TABLE_ROWS]
+        return [rows, shown_xirr(analysis, rows)]
+    return slice_
+
+
+# What each dashboard section reads from the analysis
+SECTION_SLICES = {
+    'summary': summary_slice,
+    'gainers': _table_slice('top_gainers'),
+    'losers': _table_slice('top_losers'),
+    'sectors': lambda analysis: [analysis['sectors'], analysis.get('correlation')],
+    'groups': lambda analysis: analysis.get('groups')
+}
+
+
+def section(name, analysis, render):
+    """A dashboard section's HTML, rendered by render() only when its slice changed"""
+    if not analysis or name not in SECTION_SLICES:
+        return render()
+    return fragment_cache.get_or_render(('section', name, digest(SECTION_SLICES[name](analysis))), render)
+
+
+def init_fragments(app):
+    """Size the fragment cache and expose the row partials to the app's templates"""
+    global cache_size
+    cache_size = int(app.config.get('FRAGMENT_CACHE_SIZE', cache_size))
+    app.jinja_env.globals.update(holding_rows=holding_rows, sector_rows=sector_rows,
+                                 shown_xirr=shown_xirr, table_rows=TABLE_ROWS)
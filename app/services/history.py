@@ -0,0 +1,205 @@
+"""History service - local SQLite time series of computed analyses
+
+Every analysis is appended (at most once per HISTORY_MIN_INTERVAL per user) as
+portfolio totals, per-sector rows and per-holding rows. Tables are WITHOUT
+ROWID and clustered on (user, ts), so a "last N days" query is a single range
+scan of the primary key. Long ranges are downsampled with one key seek per
+bucket (the last sample in it), independent of how many rows the range spans.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app.services.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+enabled = True
+db_path = 'history.db'
+# Seconds between two recorded analyses of the same user
+min_interval = 300
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS portfolio_history (
+    user TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    total_value REAL NOT NULL,
+    total_pnl REAL NOT NULL,
+    holdings_count INTEGER NOT NULL,
+    PRIMARY KEY (user, ts)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS sector_history (
+    user TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    sector TEXT NOT NULL,
+    value REAL NOT NULL,
+    pnl REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (user, ts, sector)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS holding_history (
+    user TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    symbol TEXT NOT NULL,
+    value REAL NOT NULL,
+    pnl REAL NOT NULL,
+    PRIMARY KEY (user, ts, symbol)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS holding_history_symbol ON holding_history (user, symbol, ts);
+"""
+
+_local = threading.local()
+_last_recorded = {}
+_last_recorded_lock = threading.Lock()
+# One writer thread: keeps inserts off the request path and serializes them
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history')
+
+
+def get_connection():
+    """Per-thread connection to the history database"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'path', None) != db_path:
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=5)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        _local.conn, _local.path = conn, db_path
+    return conn
+
+
+def write(user_key, analysis, ts=None, positions=()):
+    """Insert one analysis synchronously; positions are (symbol, value, P&L) per holding"""
+    ts = int(time.time() if ts is None else ts)
+    conn = get_connection()
+    with timed('history_write'), conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO portfolio_history VALUES (?, ?, ?, ?, ?)',
+            (user_key, ts, analysis['total_value'], analysis['total_pnl'], analysis['holdings_count'])
+        )
+        conn.executemany(
+            'INSERT OR REPLACE INTO sector_history VALUES (?, ?, ?, ?, ?, ?)',
+            [(user_key, ts, name, data['value'], data['pnl'], data['count'])
+             for name, data in analysis['sectors'].items()]
+        )
+        conn.executemany(
+            'INSERT OR REPLACE INTO holding_history VALUES (?, ?, ?, ?, ?)',
+            [(user_key, ts, symbol, value, pnl) for symbol, value, pnl in positions]
+        )
+
+
+def _last_ts(user_key):
+    row = get_connection().execute(
+        'SELECT MAX(ts) FROM portfolio_history WHERE user = ?', (user_key,)
+    ).fetchone()
+    return row[0] or 0
+
+
+def record(user_key, analysis, positions=None):
+    """Queue an analysis for the store unless one was recorded recently.
+
+    positions is a callable returning (symbol, value, P&L) per holding; it
+    only runs when the analysis is written. Stale (snapshot-served)
+    analyses are skipped: they repeat old figures.
+    """
+    if not enabled or not analysis or analysis.get('stale') or user_key is None:
+        return
+
+    now = time.time()
+    with _last_recorded_lock:
+        if now - _last_recorded.get(user_key, 0) < min_interval:
+            return
+        _last_recorded[user_key] = now
+
+    def run():
+        try:
+            # Another worker process may have recorded it already
+            if now - _last_ts(user_key) >= min_interval:
+                write(user_key, analysis, now, positions() if positions else ())
+        except Exception as e:
+            logger.error(f"Could not record analysis history: {e}")
+
+    _writer.submit(run)
+
+
+def _range(days, until):
+    until = int(time.time() if until is None else until)
+    return until - int(days * 86400), until
+
+
+def _sample_timestamps(conn, user_key, since, until, max_points):
+    """The last recorded ts in each of max_points equal buckets of [since, until].
+
+    Each bucket is one MAX(ts) seek on the (user, ts) primary key, so the
+    cost depends on max_points, not on how many rows the range holds.
+    """
+    bucket = max(1, -(-(until - since + 1) // max_points))
+    count = -(-(until - since + 1) // bucket)
+    rows = conn.execute(
+        'WITH RECURSIVE bucket(k) AS (SELECT 0 UNION ALL SELECT k + 1 FROM bucket WHERE k + 1 < ?) '
+        'SELECT (SELECT MAX(ts) FROM portfolio_history WHERE user = ? '
+        'AND ts >= ? + k * ? AND ts < ? + (k + 1) * ? AND ts <= ?) FROM bucket',
+        (count, user_key, since, bucket, since, bucket, until)
+    )
+    return [ts for ts, in rows if ts is not None]
+
+
+def _select(conn, columns, table, user_key, since, until, max_points, extra='', extra_params=()):
+    """Rows of `table` in [since, until], or only at the sampled timestamps"""
+    where = f'user = ? {extra}'
+    if not max_points:
+        return conn.execute(
+            f'SELECT {columns} FROM {table} WHERE {where} AND ts BETWEEN ? AND ? ORDER BY ts',
+            (user_key, *extra_params, since, until)
+        )
+    stamps = _sample_timestamps(conn, user_key, since, until, max_points)
+    placeholders = ','.join('?' * len(stamps))
+    return conn.execute(
+        f'SELECT {columns} FROM {table} WHERE {where} AND ts IN ({placeholders}) ORDER BY ts',
+        (user_key, *extra_params, *stamps)
+    )
+
+
+def portfolio_series(user_key, days=30, until=None, max_points=None):
+    """[(ts, total_value, total_pnl)] for the last `days`, oldest first.
+
+    With max_points the range is split into equal time buckets and the last
+    sample of each bucket is returned.
+    """
+    since, until = _range(days, until)
+    rows = _select(get_connection(), 'ts, total_value, total_pnl', 'portfolio_history',
+                   user_key, since, until, max_points)
+    return [tuple(row) for row in rows]
+
+
+def sector_series(user_key, days=30, until=None, max_points=None):
+    """{sector: [(ts, value, pnl)]} for the last `days`, oldest first"""
+    since, until = _range(days, until)
+    series = {}
+    for sector, ts, value, pnl in _select(get_connection(), 'sector, ts, value, pnl', 'sector_history',
+                                          user_key, since, until, max_points):
+        series.setdefault(sector, []).append((ts, value, pnl))
+    return series
+
+
+def holding_series(user_key, symbol, days=30, until=None, max_points=None):
+    """[(ts, value, pnl)] for one holding over the last `days`, oldest first"""
+    since, until = _range(days, until)
+    rows = _select(get_connection(), 'ts, value, pnl', 'holding_history',
+                   user_key, since, until, max_points, 'AND symbol = ?', (symbol,))
+    return [tuple(row) for row in rows]
+
+
+def init_history(app):
+    """Configure the history store from app config"""
+    global enabled, db_path, min_interval
+    enabled = str(app.config.get('HISTORY_ENABLED', 'true')).lower() in ('1', 'true', 'yes')
+    db_path = app.config.get('HISTORY_DB') or db_path
+    min_interval = int(app.config.get('HISTORY_MIN_INTERVAL', min_interval))
@@ -0,0 +1,300 @@
+"""Holdings service - every holding as a table to filter, sort and page through
+
+A HoldingsTable keeps the holdings as columns (money in exact units, see
+app.services.money). The orderings it needs are computed once per table
+with a stable lexsort and cached:
+  - one order per sort spec, with its rank array;
+  - one row list per filter and sort combination;
+  - a sorted, upper-cased symbol list for prefix search.
+A page then costs a slice (offset) or a binary search on the sort keys
+(cursor), O(log n + page). A symbol prefix narrows the rows with two
+bisects before anything else is looked at.
+"""
+import base64
+import binascii
+import bisect
+import json
+import threading
+import numpy as np
+import pandas as pd
+from app.services import money, records
+
+SORT_COLUMNS = ('symbol', 'exchange', 'sector', 'quantity', 'current_value', 'pnl', 'pnl_percentage')
+TEXT_COLUMNS = ('symbol', 'exchange', 'sector')
+# Fields of a returned row, in order
+FIELDS = SORT_COLUMNS + ('weight',)
+# Appended to every sort so that the order (and a cursor) is total
+TIEBREAK = (('symbol', False), ('exchange', False))
+SIDES = ('gainers', 'losers')
+DEFAULT_SORT = '-current_value'
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+MAX_SORT_KEYS = 4
+# Filter and sort combinations kept per table
+CACHED_RESULTS = 32
+
+
+def parse_sort(sort):
+    """'sector,-pnl' -> (('sector', False), ('pnl', True))"""
+    keys = []
+    for part in (sort or DEFAULT_SORT).split(','):
+        part = part.strip()
+        column = part.lstrip('-')
+        if column not in SORT_COLUMNS:
+            raise ValueError(f"Cannot sort by {column!r}; use one of {', '.join(SORT_COLUMNS)}")
+        keys.append((column, part.startswith('-')))
+    if len(keys) > MAX_SORT_KEYS:
+        raise ValueError(f"At most {MAX_SORT_KEYS} sort keys")
+    return tuple(keys)
+
+
+def parse_fields(fields):
+    """'symbol,pnl' -> ('symbol', 'pnl'); every field when empty"""
+    names = tuple(dict.fromkeys(part.strip() for part in (fields or '').split(',') if part.strip()))
+    for name in names:
+        if name not in FIELDS:
+            raise ValueError(f"Unknown field {name!r}; use any of {', '.join(FIELDS)}")
+    return names or FIELDS
+
+
+def parse_query(args):
+    """Query keyword arguments from request args (q, sector, exchange, side, sort, fields, limit, offset, cursor)"""
+    side = args.get('side') or None
+    if side is not None and side not in SIDES:
+        raise ValueError("'side' must be 'gainers' or 'losers'")
+    try:
+        limit = int(args.get('limit', DEFAULT_LIMIT))
+        offset = int(args.get('offset', 0))
+    except (TypeError, ValueError):
+        raise ValueError("'limit' and 'offset' must be integers")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f"'limit' must be between 1 and {MAX_LIMIT}")
+    if offset < 0:
+        raise ValueError("'offset' cannot be negative")
+    return {
+        'q': (args.get('q') or '').strip() or None,
+        'sector': args.get('sector') or None,
+        'exchange': args.get('exchange') or None,
+        'side': side,
+        'sort': args.get('sort') or DEFAULT_SORT,
+        'fields': parse_fields(args.get('fields')),
+        'limit': limit,
+        'offset': offset,
+        'cursor': args.get('cursor') or None
+    }
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, length):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, binascii.Error):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def _text_column(holdings, field):
+    """One text field of every holding; missing values read as 'Unknown'"""
+    return records.values(holdings, field, 'Unknown')
+
+
+class HoldingsTable:
+    """All holdings as columns, queryable by filter, multi-key sort and page.
+
+    book is the user's IncrementalAnalysis when prices come from the live
+    feed; its values then replace the holdings' REST prices.
+    """
+
+    def __init__(self, holdings, book=None):
+        self.stale = getattr(holdings, 'stale', False)
+        self.as_of = getattr(holdings, 'as_of', None)
+        self.size = len(holdings)
+        self.columns = {
+            'symbol': _text_column(holdings, 'tradingsymbol'),
+            'exchange': _text_column(holdings, 'exchange'),
+            'sector': _text_column(holdings, 'sector')
+        }
+
+        quantity, last_price, average_price = money.holding_units(holdings)
+        if book is not None:
+            value = np.array(book.value, dtype=np.int64)
+            pnl = np.array(book.pnl, dtype=np.int64)
+        else:
+            value = quantity * last_price
+            pnl = value - quantity * average_price
+        invested = value - pnl
+        pnl_percentage = np.zeros(self.size)
+        np.divide(pnl, invested, out=pnl_percentage, where=invested > 0)
+        self.columns.update(quantity=quantity, current_value=value, pnl=pnl, pnl_percentage=pnl_percentage * 100)
+        self.total_value = int(value.sum())
+
+        self._lock = threading.Lock()
+        self._codes = {}
+        self._orders = {}
+        self._results = {}
+        self._prefix = None
+
+    def _text_codes(self, column):
+        """(codes, sorted labels) with codes in sorted label order"""
+        if column not in self._codes:
+            # factorize(sort=True) sorts object arrays slowly; sort the labels in Python instead
+            codes, labels = pd.factorize(np.array(self.columns[column], dtype=object))
+            labels = labels.tolist()
+            order = sorted(range(len(labels)), key=labels.__getitem__)
+            rank = np.empty(len(labels), dtype=np.intp)
+            rank[order] = np.arange(len(labels))
+            self._codes[column] = (rank[codes], [labels[i] for i in order])
+        return self._codes[column]
+
+    def _code(self, column, label):
+        """Code of a label in a text column, or -1 when no holding has it"""
+        codes, labels = self._text_codes(column)
+        i = bisect.bisect_left(labels, label)
+        return i if i < len(labels) and labels[i] == label else -1
+
+    def _order(self, keys):
+        """(order, rank) of all rows under sort keys (with the tiebreak keys)"""
+        if keys not in self._orders:
+            sort_values = []
+            for column, descending in keys + TIEBREAK:
+                values = self._text_codes(column)[0] if column in TEXT_COLUMNS else self.columns[column]
+                sort_values.append(-values if descending else values)
+            # lexsort's primary key is the last one
+            order = np.lexsort(sort_values[::-1]) if self.size else np.zeros(0, dtype=np.intp)
+            rank = np.empty(self.size, dtype=np.intp)
+            rank[order] = np.arange(self.size)
+            self._orders[keys] = (order, rank)
+        return self._orders[keys]
+
+    def _prefix_rows(self, q):
+        """Rows whose symbol starts with q (case-insensitive), in symbol order"""
+        if self._prefix is None:
+            upper = np.array([symbol.upper() for symbol in self.columns['symbol']], dtype=object)
+            rows = np.argsort(upper, kind='stable')
+            self._prefix = (upper[rows].tolist(), rows)
+        symbols, rows = self._prefix
+        q = q.upper()
+        lo = bisect.bisect_left(symbols, q)
+        hi = bisect.bisect_left(symbols, q[:-1] + chr(ord(q[-1]) + 1))
+        return rows[lo:hi]
+
+    def select(self, keys, q=None, sector=None, exchange=None, side=None):
+        """Rows matching the filters, in sort order"""
+        cache_key = (keys, q, sector, exchange, side)
+        with self._lock:
+            rows = self._results.get(cache_key)
+            if rows is not None:
+                return rows
+
+            order, rank = self._order(keys)
+            mask = None
+            for column, label in (('sector', sector), ('exchange', exchange)):
+                if label is None:
+                    continue
+                matches = self._text_codes(column)[0] == self._code(column, label)
+                mask = matches if mask is None else mask & matches
+            if side is not None:
+                pnl = self.columns['pnl']
+                matches = pnl > 0 if side == 'gainers' else pnl <= 0
+                mask = matches if mask is None else mask & matches
+
+            if q:
+                rows = self._prefix_rows(q)
+                if mask is not None:
+                    rows = rows[mask[rows]]
+                rows = rows[np.argsort(rank[rows])]
+            elif mask is not None:
+                rows = order[mask[order]]
+            else:
+                rows = order
+
+            if len(self._results) >= CACHED_RESULTS:
+                self._results.clear()
+            self._results[cache_key] = rows
+            return rows
+
+    def _value(self, column, row):
+        value = self.columns[column][row]
+        return value if column in TEXT_COLUMNS else value.item()
+
+    def _sort_key(self, keys, row):
+        return [self._value(column, row) for column, _ in keys + TIEBREAK]
+
+    def _after(self, keys, row, cursor):
+        for (column, descending), value in zip(keys + TIEBREAK, cursor):
+            current = self._value(column, row)
+            if current != value:
+                return current < value if descending else current > value
+        return False
+
+    def _seek(self, rows, keys, cursor):
+        """Position of the first row sorting after the cursor's key (binary search)"""
+        lo, hi = 0, len(rows)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._after(keys, rows[mid], cursor):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def row(self, i, fields=FIELDS):
+        value = self.columns['current_value'][i]
+        row = {
+            'symbol': self.columns['symbol'][i],
+            'exchange': self.columns['exchange'][i],
+            'sector': self.columns['sector'][i],
+            'quantity': int(self.columns['quantity'][i]),
+            'current_value': money.to_rupees(int(value)),
+            'pnl': money.to_rupees(int(self.columns['pnl'][i])),
+            'pnl_percentage': float(self.columns['pnl_percentage'][i]),
+            'weight': float(value / self.total_value * 100) if self.total_value > 0 else 0
+        }
+        return row if fields == FIELDS else {field: row[field] for field in fields}
+
+    def chunk(self, rows, fields=FIELDS):
+        """Columns of fields for rows, as lists in row() units (a columnar row())"""
+        columns = []
+        for field in fields:
+            if field in TEXT_COLUMNS:
+                columns.append(list(map(self.columns[field].__getitem__, rows.tolist())))
+            elif field in ('current_value', 'pnl'):
+                columns.append(money.to_rupees(self.columns[field][rows]).tolist())
+            elif field == 'weight':
+                value = self.columns['current_value'][rows]
+                weight = value / self.total_value * 100 if self.total_value > 0 else np.zeros(len(rows))
+                columns.append(weight.tolist())
+            else:
+                columns.append(self.columns[field][rows].tolist())
+        return columns
+
+    def query(self, q=None, sector=None, exchange=None, side=None, sort=DEFAULT_SORT, fields=FIELDS,
+              limit=DEFAULT_LIMIT, offset=0, cursor=None):
+        """One page of matching holdings, each row limited to fields.
+
+        A cursor (the previous page's next_cursor) takes precedence over
+        offset and stays valid when prices move between pages.
+        """
+        keys = parse_sort(sort)
+        rows = self.select(keys, q=q, sector=sector, exchange=exchange, side=side)
+        if cursor:
+            offset = self._seek(rows, keys, decode_cursor(cursor, len(keys + TIEBREAK)))
+        page = rows[offset:offset + limit].tolist()
+        more = offset + len(page) < len(rows)
+        return {
+            'total': len(rows),
+            'offset': offset,
+            'rows': [self.row(i, fields) for i in page],
+            'next_cursor': encode_cursor(self._sort_key(keys, page[-1])) if page and more else None
+        }
+
+    def positions(self):
+        """[(symbol, current value, P&L)] in rupees for every holding"""
+        return list(zip(self.columns['symbol'],
+                        money.to_rupees(self.columns['current_value']).tolist(),
+                        money.to_rupees(self.columns['pnl']).tolist()))
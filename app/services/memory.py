@@ -0,0 +1,186 @@
+"""Memory service - memory gauges, per-stage allocation sampling and a watchdog
+
+Long-running workers are watched three ways:
+  - /metrics always exports resident memory, live matplotlib figures and
+    the number of cached entries;
+  - with MEMORY_PROFILE on, tracemalloc runs and every timed() stage
+    records the traced memory it left behind. Once per MEMORY_SAMPLE_SECONDS
+    a stage run is also bracketed by two snapshots, and the allocation sites
+    that grew the most are exported per stage;
+  - with MEMORY_CEILING_MB set, a watchdog checks RSS every
+    MEMORY_CHECK_SECONDS. Over the ceiling it first sheds this worker's
+    caches and returns freed memory to the OS. If that is not enough, it
+    asks gunicorn to recycle the worker with SIGTERM, so in-flight requests
+    finish and the master starts a fresh worker.
+"""
+import ctypes
+import ctypes.util
+import gc
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from app.services import metrics, charts
+from app.services.cache import portfolio_cache
+from app.services.fragments import fragment_cache
+
+logger = logging.getLogger(__name__)
+
+profile = False
+# Seconds between snapshot pairs for one stage
+sample_seconds = 60
+# Allocation sites kept per stage
+TOP_SITES = 5
+ceiling_bytes = None
+check_seconds = 30
+
+_watchdog = None
+
+
+def rss_bytes():
+    """Resident memory of this process"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Not Linux: the peak is the best available (KiB, but bytes on macOS)
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _site(frame):
+    # The last two path components are enough to find the line
+    return f"{'/'.join(frame.filename.split(os.sep)[-2:])}:{frame.lineno}"
+
+
+class StageSampler:
+    """Traced memory retained per stage, and the top growing sites from sampled runs"""
+
+    def __init__(self):
+        self.retained = {}
+        self.top = {}
+        self._sampled_at = {}
+        self._sampling = False
+        self._lock = threading.Lock()
+
+    def enter(self, stage):
+        now = time.monotonic()
+        with self._lock:
+            # One snapshot pair at a time: they are slow on a large heap
+            take = not self._sampling and now - self._sampled_at.get(stage, float('-inf')) >= sample_seconds
+            if take:
+                self._sampling = True
+                self._sampled_at[stage] = now
+        snapshot = tracemalloc.take_snapshot() if take else None
+        return tracemalloc.get_traced_memory()[0], snapshot
+
+    def exit(self, stage, sample):
+        before, snapshot = sample
+        # Concurrent requests share the heap, so this is a per-run estimate
+        self.retained[stage] = tracemalloc.get_traced_memory()[0] - before
+        if snapshot is None:
+            return
+        try:
+            ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+            stats = tracemalloc.take_snapshot().filter_traces(ignore).compare_to(snapshot.filter_traces(ignore),
+                                                                                'lineno')
+            self.top[stage] = [(_site(stat.traceback[0]), stat.size_diff) for stat in stats[:TOP_SITES]]
+        finally:
+            with self._lock:
+                self._sampling = False
+
+
+sampler = StageSampler()
+
+
+GAUGES = [
+    metrics.Gauge('portfolio_process_rss_bytes', 'Resident memory of this worker',
+                  lambda: {(): rss_bytes()}),
+    metrics.Gauge('portfolio_live_figures', 'Matplotlib figures not yet garbage collected',
+                  lambda: {(): charts.live_figures()}),
+    metrics.Gauge('portfolio_cached_entries', 'Entries held by the in-process caches',
+                  lambda: {('portfolio',): len(portfolio_cache), ('fragment',): len(fragment_cache)},
+                  labels=('cache',)),
+    metrics.Gauge('portfolio_memory_ceiling_bytes', 'RSS at which the watchdog recycles the worker',
+                  lambda: {(): ceiling_bytes} if ceiling_bytes else {}),
+    metrics.Gauge('portfolio_traced_memory_bytes', 'Python allocations traced by tracemalloc (MEMORY_PROFILE)',
+                  lambda: {(): tracemalloc.get_traced_memory()[0]} if tracemalloc.is_tracing() else {}),
+    metrics.Gauge('portfolio_stage_retained_bytes', 'Traced memory left behind by the last run of each stage',
+                  lambda: {(stage,): size for stage, size in sampler.retained.items()}, labels=('stage',)),
+    metrics.Gauge('portfolio_stage_alloc_bytes', 'Allocation growth of the top sites in a sampled stage run',
+                  lambda: {(stage, site): size for stage, sites in sampler.top.items() for site, size in sites},
+                  labels=('stage', 'site'))
+]
+
+
+def _release_memory():
+    """Collect garbage and hand freed heap pages back to the OS (glibc only)"""
+    gc.collect()
+    libc = ctypes.util.find_library('c')
+    if libc:
+        try:
+            ctypes.CDLL(libc).malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+
+
+class Watchdog(threading.Thread):
+    """Sheds caches, then recycles the worker, once RSS passes the ceiling"""
+
+    def __init__(self):
+        super().__init__(name='memory-watchdog', daemon=True)
+
+    def run(self):
+        # Outside gunicorn nothing can recycle the process: after one failed
+        # shed, wait until memory is back under the ceiling before shedding again
+        armed = True
+        while True:
+            time.sleep(check_seconds)
+            if rss_bytes() < ceiling_bytes:
+                armed = True
+                continue
+            if not armed:
+                continue
+
+            logger.warning(f"RSS {rss_bytes() // 2 ** 20} MB over the {ceiling_bytes // 2 ** 20} MB ceiling, "
+                           f"shedding caches")
+            portfolio_cache.clear_local()
+            fragment_cache.clear()
+            _release_memory()
+            rss = rss_bytes()
+            if rss < ceiling_bytes:
+                continue
+
+            if os.environ.get('GUNICORN_WORKER'):
+                logger.warning(f"RSS still {rss // 2 ** 20} MB, recycling worker {os.getpid()}")
+                os.kill(os.getpid(), signal.SIGTERM)
+                return
+            logger.error(f"RSS still {rss // 2 ** 20} MB and not under gunicorn; not recycling")
+            armed = False
+
+
+def init_memory(app):
+    """Export memory gauges, and start profiling and the watchdog when configured"""
+    global profile, sample_seconds, ceiling_bytes, check_seconds, _watchdog
+    for gauge in GAUGES:
+        if gauge not in metrics.REGISTRY:
+            metrics.REGISTRY.append(gauge)
+
+    profile = str(app.config.get('MEMORY_PROFILE', 'false')).lower() in ('1', 'true', 'yes')
+    sample_seconds = float(app.config.get('MEMORY_SAMPLE_SECONDS', sample_seconds))
+    if profile:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        metrics.memory_sampler = sampler
+
+    ceiling_mb = app.config.get('MEMORY_CEILING_MB')
+    ceiling_bytes = int(float(ceiling_mb) * 2 ** 20) if ceiling_mb else None
+    check_seconds = float(app.config.get('MEMORY_CHECK_SECONDS', check_seconds))
+    if ceiling_bytes and _watchdog is None:
+        _watchdog = Watchdog()
+        _watchdog.start()
+        logger.info(f"Memory watchdog: ceiling {ceiling_bytes // 2 ** 20} MB, checked every {check_seconds:g}s")
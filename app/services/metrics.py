@@ -0,0 +1,226 @@
+"""Metrics service - per-stage timings, Server-Timing headers and Prometheus export
+
+Metrics are kept per process; with several gunicorn workers each worker
+exposes its own counters and Prometheus sums them across scrape targets.
+"""
+import bisect
+import threading
+import time
+from flask import g, has_request_context, request
+
+# Histogram buckets in seconds, from template renders up to slow Kite calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+enabled = True
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    body = ','.join(f'{name}="{value}"' for name, value in pairs)
+    return '{' + body + '}'
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self.values.items())
+        for label_values, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    """Bucketed latency histogram with a fixed set of label names"""
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self.series.items())
+        for label_values, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, label_values, ('le', bound))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {total:.6f}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Gauge:
+    """Point-in-time values read from a callback when the metrics are rendered.
+
+    collect() returns {label values tuple: value}.
+    """
+
+    def __init__(self, name, help_text, collect, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.collect = collect
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge']
+        for label_values, value in sorted(self.collect().items()):
+            lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+STAGE_SECONDS = Histogram('portfolio_stage_seconds',
+                          'Time spent in each pipeline stage', labels=('stage',))
+REQUEST_SECONDS = Histogram('portfolio_request_seconds',
+                            'End-to-end request latency', labels=('endpoint',))
+CACHE_REQUESTS = Counter('portfolio_cache_requests_total',
+                         'Portfolio cache lookups', labels=('kind', 'result'))
+KITE_CALLS = Counter('portfolio_kite_calls_total',
+                     'Calls made to the Kite API', labels=('endpoint', 'outcome'))
+STREAM_UPDATES = Counter('portfolio_stream_updates_total',
+                         'Analysis deltas pushed to dashboards', labels=('outcome',))
+ALERTS = Counter('portfolio_alerts_total',
+                 'Alert rules triggered and alert digests delivered', labels=('outcome',))
+
+REGISTRY = [STAGE_SECONDS, REQUEST_SECONDS, CACHE_REQUESTS, KITE_CALLS, STREAM_UPDATES, ALERTS]
+
+# Set by app.services.memory when MEMORY_PROFILE is on: sees every stage start and end
+memory_sampler = None
+
+
+class timed:
+    """Time a block, record it in the stage histogram and the Server-Timing header.
+
+    A plain class rather than @contextmanager: this sits on every request
+    path and the generator machinery would double its overhead.
+    """
+    __slots__ = ('stage', 'start', 'sample')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.sample = memory_sampler.enter(self.stage) if memory_sampler is not None else None
+        self.start = time.perf_counter() if enabled else None
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.sample is not None:
+            memory_sampler.exit(self.stage, self.sample)
+        if self.start is None:
+            return False
+        elapsed = time.perf_counter() - self.start
+        STAGE_SECONDS.observe(elapsed, self.stage)
+        if has_request_context():
+            timings = g.get('stage_timings')
+            if timings is None:
+                timings = g.stage_timings = []
+            timings.append((self.stage, elapsed))
+        return False
+
+
+def record_cache(kind, hit):
+    """Count a cache lookup for the hit-rate metrics"""
+    if enabled:
+        CACHE_REQUESTS.inc(kind, 'hit' if hit else 'miss')
+
+
+def record_kite_call(endpoint, ok):
+    """Count a Kite API call"""
+    if enabled:
+        KITE_CALLS.inc(endpoint, 'ok' if ok else 'error')
+
+
+def record_stream_update(sent):
+    """Count a delta either written to a client or merged away for a slow one"""
+    if enabled:
+        STREAM_UPDATES.inc('sent' if sent else 'dropped')
+
+
+def record_alerts(outcome, count=1):
+    """Count alerts 'triggered', or digests 'sent', 'failed' or 'skipped'"""
+    if enabled:
+        ALERTS.inc(outcome, amount=count)
+
+
+def cache_hit_ratio_lines():
+    """Derived per-kind cache hit ratio gauge"""
+    totals = {}
+    with CACHE_REQUESTS._lock:
+        for (kind, result), value in CACHE_REQUESTS.values.items():
+            hits, lookups = totals.get(kind, (0, 0))
+            totals[kind] = (hits + (value if result == 'hit' else 0), lookups + value)
+
+    lines = ['# HELP portfolio_cache_hit_ratio Share of cache lookups served from cache',
+             '# TYPE portfolio_cache_hit_ratio gauge']
+    for kind, (hits, lookups) in sorted(totals.items()):
+        lines.append(f'portfolio_cache_hit_ratio{{kind="{kind}"}} {hits / lookups:.4f}')
+    return lines
+
+
+def render_prometheus():
+    """Render every metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    lines.extend(cache_hit_ratio_lines())
+    return '\n'.join(lines) + '\n'
+
+
+def init_metrics(app):
+    """Enable timing hooks and the Server-Timing response header"""
+    global enabled
+    enabled = str(app.config.get('METRICS_ENABLED', 'true')).lower() in ('1', 'true', 'yes')
+    if not enabled:
+        return
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def add_server_timing(response):
+        start = g.get('request_start')
+        if start is not None and request.endpoint:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, request.endpoint)
+
+        timings = g.get('stage_timings')
+        if timings:
+            response.headers['Server-Timing'] = ', '.join(
+                f'{stage};dur={elapsed * 1000:.1f}' for stage, elapsed in timings
+            )
+        return response
@@ -0,0 +1,44 @@
+"""Money - exact fixed-point amounts as int64 units
+
+Prices are converted once, on the way in, to integer units of 1/MONEY_SCALE
+rupee. Holdings are whole shares, so values, P&L and every sum over them are
+then exact integers and the same book always adds up to the same paise,
+whatever order or path (full analysis, live updates) produced it. Amounts
+become floats only when they are presented.
+"""
+import numpy as np
+from app.services.records import values
+
+# Units per rupee: hundredths of a paisa, so averaged cost prices keep four decimals
+MONEY_SCALE = 10000
+
+
+def price_units(price):
+    """A rupee price as integer units"""
+    return int(round(price * MONEY_SCALE))
+
+
+def to_units(prices):
+    """Float rupee prices (any sequence) as an int64 array of units"""
+    return np.rint(np.asarray(prices, dtype=np.float64) * MONEY_SCALE).astype(np.int64)
+
+
+def to_rupees(units):
+    """Units (an int or an int array) as float rupees"""
+    return units / MONEY_SCALE
+
+
+def _column(holdings, field):
+    return np.array(values(holdings, field, 0), dtype=np.float64)
+
+
+def holding_units(holdings):
+    """(quantity, last price units, average price units) int64 arrays for holdings"""
+    quantity = _column(holdings, 'quantity').astype(np.int64)
+    return quantity, to_units(_column(holdings, 'last_price')), to_units(_column(holdings, 'average_price'))
+
+
+def book_value(holdings):
+    """Exact current value of holdings in rupees"""
+    quantity, last, _ = holding_units(holdings)
+    return to_rupees(int(quantity @ last))
@@ -1,82 +1,695 @@
 """Portfolio service - fetches and analyzes portfolio data"""
+import bisect
+import json
 import logging
+import os
+import threading
+from array import array
+import numpy as np
+import pandas as pd
+import requests
 from kiteconnect import KiteConnect
+from app.services.cache import portfolio_cache
+from app.services.metrics import timed, record_kite_call
+from app.services import ticker, resilience, history, returns, correlation, money, alerts, records
+from app.services.holdings import HoldingsTable
+from app.services.resilience import (kite_breaker, call_with_budget, CircuitOpenError,
+                                     save_snapshot, load_snapshot)
 
 logger = logging.getLogger(__name__)
 
+# Connections kept open to api.kite.trade per process
+KITE_POOL_SIZE = 32
+
+# Seconds holdings stay cached; None uses the cache TTL. With live prices
+# holdings only change on trades, so this can be much longer than the TTL.
+holdings_ttl = None
+
+_kite_session = None
+_kite_session_lock = threading.Lock()
+
+# Rollups added to every analysis as analysis['groups'] besides sectors;
+# 'sector/exchange' nests exchange within sector
+group_by = (('exchange',), ('product',), ('market_cap',), ('asset_class',), ('tag',))
+# JSON {symbol or ISIN: {"tags": [...], "market_cap": <Rs crore>, "asset_class": ...}}
+holding_tags_path = None
+_holding_tags = {'key': None, 'tags': {}}
+_holding_tags_lock = threading.Lock()
+
+# Gainers and losers kept in each analysis; every holding is browsable
+# through the holdings table (load_holdings_table)
+analysis_top_n = 10
+# Books up to this size are analyzed in plain Python ints: numpy's per-call
+# overhead costs more than the arithmetic (analyze_sectors_only vs _indexed)
+SMALL_BOOK = 128
+
+# Rs crore cut-offs, largest first, roughly AMFI's large/mid/small-cap lines
+MARKET_CAP_BUCKETS = ((100000, 'Large Cap'), (30000, 'Mid Cap'), (0, 'Small Cap'))
+
+
+def get_kite_session():
+    """Shared HTTP session so Kite calls reuse pooled keep-alive connections"""
+    global _kite_session
+    with _kite_session_lock:
+        if _kite_session is None:
+            _kite_session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=KITE_POOL_SIZE)
+            _kite_session.mount('https://', adapter)
+            _kite_session.mount('http://', adapter)
+        return _kite_session
+
+
+def load_holding_tags():
+    """Per-holding attributes from HOLDING_TAGS_PATH, re-read only when the file changes"""
+    if not holding_tags_path or not os.path.exists(holding_tags_path):
+        return {}
+    key = os.path.getmtime(holding_tags_path)
+    with _holding_tags_lock:
+        if _holding_tags['key'] != key:
+            with open(holding_tags_path) as f:
+                _holding_tags['tags'] = json.load(f)
+            _holding_tags['key'] = key
+        return _holding_tags['tags']
+
+
+def market_cap_bucket(info):
+    if info.get('market_cap_bucket'):
+        return info['market_cap_bucket']
+    market_cap = info.get('market_cap')
+    if market_cap is None:
+        return 'Unclassified'
+    for floor, label in MARKET_CAP_BUCKETS:
+        if market_cap >= floor:
+            return label
+    return MARKET_CAP_BUCKETS[-1][1]
+
+
+# Dimensions read off the Kite holding itself ('Unknown' when missing)
+HOLDING_FIELDS = ('sector', 'exchange', 'product')
+# Dimensions that come from the HOLDING_TAGS_PATH entry
+TAG_FIELDS = ('market_cap', 'asset_class', 'tag')
+DIMENSIONS = HOLDING_FIELDS + TAG_FIELDS
+# A holding counts once under each of its values
+MULTI_VALUED = {'tag'}
+
+
+def tag_label(dimension, holding, info):
+    """Label of a holding with a HOLDING_TAGS_PATH entry for a tag-derived dimension"""
+    if dimension == 'market_cap':
+        return market_cap_bucket(info)
+    if dimension == 'asset_class':
+        return info.get('asset_class') or ('ETF' if holding.get('sector') == 'ETF' else 'Equity')
+    return info.get('tags') or ['Untagged']
+
+
+def holding_field(holdings, field, default='Unknown'):
+    """One field of every holding, read in C when every holding has it"""
+    return records.values(holdings, field, default)
+
+
+class GroupIndex:
+    """Holdings factorized once per dimension, ready to roll up any value column.
+
+    Every grouping (a tuple of dimensions, nested left to right) maps each
+    holding to an integer group id. Entries are also kept sorted by group,
+    so rollup() is one gather and reduceat per column and grouping, exact for
+    int64 money units. Groups keep the order their first holding appears in.
+    """
+
+    def __init__(self, holdings, groupings, tags=None):
+        self.size = len(holdings)
+        # Tags only make sense with a tags file
+        self.groupings = [g for g in groupings if tags or 'tag' not in g]
+        tagged = self._tagged(holdings, tags)
+
+        factorized = {}
+        for dimension in dict.fromkeys(d for g in self.groupings for d in g):
+            labels = self._labels(dimension, holdings, tagged)
+            rows = None
+            if dimension in MULTI_VALUED:
+                rows = np.repeat(np.arange(self.size), [len(values) for values in labels])
+                labels = [value for values in labels for value in values]
+            codes, uniques = pd.factorize(np.array(labels, dtype=object), sort=False)
+            factorized[dimension] = (rows, codes, list(uniques))
+
+        # name -> (holding row per entry or None for one entry per holding, group ids, labels, counts)
+        self.groups = {}
+        # name -> (holding row of each entry in group order, first entry of each group)
+        self.layout = {}
+        for grouping in self.groupings:
+            multi = [d for d in grouping if factorized[d][0] is not None]
+            if len(multi) > 1:
+                raise ValueError(f"Grouping {'/'.join(grouping)} has more than one multi-valued dimension")
+            rows = factorized[multi[0]][0] if multi else None
+
+            if len(grouping) == 1:
+                ids, keys = factorized[grouping[0]][1], range(len(factorized[grouping[0]][2]))
+            else:
+                combined = np.zeros(self.size if rows is None else len(rows), dtype=np.int64)
+                for dimension in grouping:
+                    d_rows, codes, uniques = factorized[dimension]
+                    combined = combined * len(uniques) + (codes if d_rows is not None or rows is None else codes[rows])
+                ids, keys = pd.factorize(combined, sort=False)
+                keys = keys.tolist()
+
+            labels = []
+            for key in keys:
+                parts = []
+                for dimension in reversed(grouping):
+                    uniques = factorized[dimension][2]
+                    key, code = divmod(key, len(uniques))
+                    parts.append(str(uniques[code]))
+                labels.append(' / '.join(reversed(parts)))
+            counts = np.bincount(ids, minlength=len(labels))
+            order = np.argsort(ids, kind='stable')
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1])) if len(labels) else counts
+            name = '/'.join(grouping)
+            self.groups[name] = (rows, ids, labels, counts)
+            self.layout[name] = (order if rows is None else rows[order], starts)
+
+    @staticmethod
+    def _tagged(holdings, tags):
+        """(row, HOLDING_TAGS_PATH entry) of every holding that has one"""
+        tagged = []
+        if tags:
+            for row, holding in enumerate(holdings):
+                info = tags.get(holding.get('tradingsymbol')) or tags.get(holding.get('isin'))
+                if info:
+                    tagged.append((row, info))
+        return tagged
+
+    @classmethod
+    def small_analysis_groups(cls, holdings, groupings, tags, value, pnl):
+        """analysis_groups(rollup(value, pnl)) in plain Python, for lists of ints.
+
+        The same groups in the same order (first appearance) as the indexed
+        path, without factorizing: for books of a few dozen holdings.
+        """
+        groupings = [g for g in groupings if tags or 'tag' not in g]
+        tagged = cls._tagged(holdings, tags)
+        labels = {dimension: cls._labels(dimension, holdings, tagged)
+                  for dimension in dict.fromkeys(d for g in groupings for d in g)}
+
+        groups = {}
+        for grouping in groupings:
+            columns = [labels[dimension] for dimension in grouping]
+            multi = [i for i, dimension in enumerate(grouping) if dimension in MULTI_VALUED]
+            if multi:
+                entries = []
+                for row, parts in enumerate(zip(*columns)):
+                    parts = list(parts)
+                    for part in parts[multi[0]]:
+                        parts[multi[0]] = part
+                        entries.append((' / '.join(map(str, parts)), row))
+            elif len(grouping) == 1:
+                entries = zip(map(str, columns[0]), range(len(holdings)))
+            else:
+                entries = zip((' / '.join(map(str, parts)) for parts in zip(*columns)), range(len(holdings)))
+            sums = {}
+            for label, row in entries:
+                entry = sums.get(label)
+                if entry is None:
+                    sums[label] = [value[row], pnl[row], 1]
+                else:
+                    entry[0] += value[row]
+                    entry[1] += pnl[row]
+                    entry[2] += 1
+            scale = money.MONEY_SCALE
+            groups['/'.join(grouping)] = {
+                label: {'value': v / scale, 'pnl': p / scale, 'count': c} for label, (v, p, c) in sums.items()
+            }
+        return groups.pop('sector'), groups
+
+    @staticmethod
+    def _labels(dimension, holdings, tagged):
+        if dimension in HOLDING_FIELDS:
+            return holding_field(holdings, dimension)
+        if dimension == 'market_cap':
+            labels = ['Unclassified'] * len(holdings)
+        elif dimension == 'asset_class':
+            labels = ['ETF' if sector == 'ETF' else 'Equity' for sector in holding_field(holdings, 'sector', None)]
+        else:
+            labels = [['Untagged']] * len(holdings)
+        for row, info in tagged:
+            labels[row] = tag_label(dimension, holdings[row], info)
+        return labels
+
+    def rollup(self, *columns):
+        """{grouping: [per-group sum of each column]} for per-holding arrays"""
+        sums = {}
+        for name, (gather, starts) in self.layout.items():
+            if not len(starts):
+                sums[name] = [np.zeros(0, dtype=column.dtype) for column in columns]
+                continue
+            sums[name] = [np.add.reduceat(column[gather], starts) for column in columns]
+        return sums
+
+    def memberships(self):
+        """[(grouping, group ids, offsets)] for incremental updates.
+
+        Holding i is in group ids[i], or in ids[offsets[i]:offsets[i + 1]]
+        for a multi-valued grouping.
+        """
+        members = []
+        for name, (rows, ids, _, _) in self.groups.items():
+            offsets = None
+            if rows is not None:
+                offsets = array('q', np.searchsorted(rows, np.arange(self.size + 1)).astype(np.int64).tobytes())
+            members.append((name, array('q', ids.astype(np.int64).tobytes()), offsets))
+        return members
+
+    def to_dicts(self, name, value, pnl):
+        """One grouping in the analysis['sectors'] shape, from value and P&L units"""
+        _, _, labels, counts = self.groups[name]
+        return {
+            label: {'value': v, 'pnl': p, 'count': c}
+            for label, v, p, c in zip(labels, money.to_rupees(value).tolist(),
+                                      money.to_rupees(pnl).tolist(), counts.tolist())
+        }
+
+    def analysis_groups(self, sums):
+        """(sectors, groups) for an analysis from rollup() sums of value and P&L units"""
+        groups = {name: self.to_dicts(name, *sums[name]) for name in self.groups}
+        return groups.pop('sector'), groups
+
+
+def top_rows(rows, keys, n):
+    """The n rows with the smallest keys, sorted, as the first n of a stable sort.
+
+    Partitions first, so only the n winners are sorted: O(len + n log n).
+    """
+    if len(rows) > n:
+        kth = np.partition(keys, n - 1)[n - 1]
+        below = keys < kth
+        # Ties at the cut-off: the earliest rows, as a stable sort would keep
+        ties = keys == kth
+        keep = below | (ties & (np.cumsum(ties) <= n - np.count_nonzero(below)))
+        rows, keys = rows[keep], keys[keep]
+    return rows[np.argsort(keys, kind='stable')]
+
+
+def analysis_groupings():
+    return [('sector',)] + [g for g in group_by if g != ('sector',)]
+
 
 class PortfolioService:
+    # Kite API root; None uses api.kite.trade (overridden to point at a stand-in)
+    kite_root = None
+
     def __init__(self, api_key, access_token):
-        self.kite = KiteConnect(api_key=api_key)
+        self.kite = KiteConnect(api_key=api_key, root=self.kite_root, timeout=resilience.kite_timeout)
+        self.kite.reqsession = get_kite_session()
         self.kite.set_access_token(access_token)
 
+    def fetch_holdings(self):
+        """Fetch holdings through the Kite circuit breaker, within the request budget.
+
+        Raises on upstream errors, budget overruns and an open circuit.
+        """
+        try:
+            with timed('get_holdings'):
+                holdings = kite_breaker.call(call_with_budget, self.kite.holdings)
+        except CircuitOpenError:
+            raise
+        except Exception:
+            record_kite_call('holdings', False)
+            raise
+        record_kite_call('holdings', True)
+        logger.info(f"Successfully fetched {len(holdings)} holdings")
+        return records.to_records(holdings)
+
     def get_holdings(self):
-        """Fetch current portfolio holdings from Kite"""
+        """Fetch current portfolio holdings from Kite ([] on any failure)"""
         try:
-            holdings = self.kite.holdings()
-            logger.info(f"Successfully fetched {len(holdings)} holdings")
-            return holdings
+            return self.fetch_holdings()
         except Exception as e:
             logger.error(f"Error fetching portfolio holdings: {e}")
             return []
 
-    def analyze(self, holdings):
-        """Analyze portfolio performance and generate insights"""
+    @staticmethod
+    def analyze(holdings, top_n=None):
+        """Analyze portfolio performance and generate insights.
+
+        top_n limits the gainer/loser lists (default: ANALYSIS_TOP_N).
+        """
         if not holdings:
             return None
 
-        analysis = {
-            'total_value': 0,
-            'total_pnl': 0,
-            'sectors': {},
-            'top_gainers': [],
-            'top_losers': [],
-            'holdings_count': len(holdings)
+        with timed('analyze'):
+            if len(holdings) <= SMALL_BOOK:
+                return PortfolioService._analyze_small(holdings, top_n or analysis_top_n)
+            return PortfolioService._analyze(holdings, top_n or analysis_top_n)
+
+    @staticmethod
+    def _analyze_small(holdings, top_n):
+        """_analyze() with Python ints instead of int64 arrays; the same result, exactly"""
+        scale = money.MONEY_SCALE
+        # Units rounded half to even like money.to_units; whole shares truncated
+        quantity = list(map(int, records.values(holdings, 'quantity', 0)))
+        value = [q * round(p * scale) for q, p in zip(quantity, records.values(holdings, 'last_price', 0))]
+        invested = [q * round(p * scale) for q, p in zip(quantity, records.values(holdings, 'average_price', 0))]
+        pnl = [v - i for v, i in zip(value, invested)]
+        total_value = sum(value)
+        total_pnl = sum(pnl)
+
+        # Ties keep holdings order (sorted() is stable, reversed too)
+        rows = range(len(holdings))
+        gainers = sorted([row for row in rows if pnl[row] > 0], key=pnl.__getitem__, reverse=True)[:top_n]
+        losers = sorted([row for row in rows if pnl[row] <= 0], key=pnl.__getitem__)[:top_n]
+
+        symbols = holding_field(holdings, 'tradingsymbol')
+
+        def holding_infos(rows):
+            return [
+                {'symbol': symbols[row], 'pnl': pnl[row] / scale,
+                 'pnl_percentage': float(pnl[row]) / invested[row] * 100 if invested[row] > 0 else 0.0,
+                 'current_value': value[row] / scale}
+                for row in rows
+            ]
+
+        sectors, groups = GroupIndex.small_analysis_groups(holdings, analysis_groupings(), load_holding_tags(),
+                                                           value, pnl)
+        total_invested = total_value - total_pnl
+
+        return {
+            'total_value': money.to_rupees(total_value),
+            'total_pnl': money.to_rupees(total_pnl),
+            'sectors': sectors,
+            'top_gainers': holding_infos(gainers),
+            'top_losers': holding_infos(losers),
+            'holdings_count': len(holdings),
+            'groups': groups,
+            'total_pnl_percentage': (total_pnl / total_invested * 100) if total_invested > 0 else 0
+        }
+
+    @staticmethod
+    def _analyze(holdings, top_n):
+        # Money as exact int64 units (see app.services.money); floats only on output
+        quantity, last_price, average_price = money.holding_units(holdings)
+        value = quantity * last_price
+        invested = quantity * average_price
+        pnl = value - invested
+        total_value = int(value.sum())
+        total_pnl = int(pnl.sum())
+
+        pnl_percentage = np.zeros(len(holdings))
+        np.divide(pnl, invested, out=pnl_percentage, where=invested > 0)
+        pnl_percentage *= 100
+
+        # Top gainers and losers; ties keep holdings order
+        gainers = np.flatnonzero(pnl > 0)
+        gainers = top_rows(gainers, -pnl[gainers], top_n)
+        losers = np.flatnonzero(pnl <= 0)
+        losers = top_rows(losers, pnl[losers], top_n)
+
+        symbols = np.array(holding_field(holdings, 'tradingsymbol'), dtype=object)
+        value_rupees = money.to_rupees(value)
+        pnl_rupees = money.to_rupees(pnl)
+
+        def holding_infos(rows):
+            return [
+                {'symbol': symbol, 'pnl': p, 'pnl_percentage': percentage, 'current_value': v}
+                for symbol, p, percentage, v in zip(symbols[rows].tolist(), pnl_rupees[rows].tolist(),
+                                                    pnl_percentage[rows].tolist(), value_rupees[rows].tolist())
+            ]
+
+        # Sector and other rollups in one pass over the factorized holdings
+        index = GroupIndex(holdings, analysis_groupings(), load_holding_tags())
+        sectors, groups = index.analysis_groups(index.rollup(value, pnl))
+
+        # Overall PnL percentage
+        total_invested = total_value - total_pnl
+
+        return {
+            'total_value': money.to_rupees(total_value),
+            'total_pnl': money.to_rupees(total_pnl),
+            'sectors': sectors,
+            'top_gainers': holding_infos(gainers),
+            'top_losers': holding_infos(losers),
+            'holdings_count': len(holdings),
+            'groups': groups,
+            'total_pnl_percentage': (total_pnl / total_invested * 100) if total_invested > 0 else 0
+        }
+
+
+class IncrementalAnalysis:
+    """Portfolio analysis kept current under price updates.
+
+    Built once from holdings, then update_prices() adjusts totals, sector and
+    group aggregates and the gainer/loser rankings for the instruments that moved
+    only: each change is a bisect out of and back into a sorted ranking,
+    O(changed * log n) comparisons. Money is held in exact integer units, so
+    the running totals never drift and to_analysis() returns exactly what
+    PortfolioService.analyze() would for the current prices.
+
+    Per-holding units are int64 arrays (array('q'): 8 bytes a holding,
+    read back as Python ints), a ranking entry is one int, key * n + index,
+    and holdings are found by token with a binary search.
+    """
+
+    def __init__(self, holdings):
+        self.holdings = holdings
+        # Last PriceTable sequence number applied, and the table it counts in
+        self.seq = 0
+        self.prices = None
+        self._lock = threading.Lock()
+
+        quantity, last_price, average_price = money.holding_units(holdings)
+        value = quantity * last_price
+        invested = quantity * average_price
+        pnl = value - invested
+
+        # Per-holding money units
+        self.symbols = holding_field(holdings, 'tradingsymbol')
+        self.quantity = array('q', quantity.tobytes())
+        self.invested = array('q', invested.tobytes())
+        self.value = array('q', value.tobytes())
+        self.pnl = array('q', pnl.tobytes())
+        # Holdings by instrument token: rows in token order, searched per update
+        tokens = np.array(holding_field(holdings, 'instrument_token', -1), dtype=np.int64)
+        self.token_rows = np.argsort(tokens, kind='stable')
+        self.tokens = tokens[self.token_rows]
+
+        # Sector and group sums, adjusted in place per changed holding
+        self.groups = GroupIndex(holdings, analysis_groupings(), load_holding_tags())
+        self.members = self.groups.memberships()
+        self.group_sums = self.groups.rollup(value, pnl)
+
+        self.total_value = int(value.sum())
+        self.total_pnl = int(pnl.sum())
+
+        # Rankings hold sort key * n + index, so ties keep holdings order
+        self.n = n = max(len(holdings), 1)
+        self.gainers = sorted(-p * n + i for i, p in enumerate(self.pnl) if p > 0)
+        self.losers = sorted(p * n + i for i, p in enumerate(self.pnl) if p <= 0)
+
+    def _key(self, i):
+        pnl = self.pnl[i]
+        return (self.gainers, -pnl * self.n + i) if pnl > 0 else (self.losers, pnl * self.n + i)
+
+    def _unrank(self, i):
+        ranking, key = self._key(i)
+        del ranking[bisect.bisect_left(ranking, key)]
+
+    def _rank(self, i):
+        ranking, key = self._key(i)
+        bisect.insort(ranking, key)
+
+    def update_prices(self, prices):
+        """Apply {instrument_token: last_price}; returns indexes of holdings that changed"""
+        changed = []
+        if not prices:
+            return changed
+        tokens = np.fromiter(prices, dtype=np.int64, count=len(prices))
+        starts = np.searchsorted(self.tokens, tokens).tolist()
+        ends = np.searchsorted(self.tokens, tokens, side='right').tolist()
+        with self._lock:
+            for price, start, end in zip(prices.values(), starts, ends):
+                units = money.price_units(price)
+                for i in self.token_rows[start:end].tolist():
+                    new_value = self.quantity[i] * units
+                    delta = new_value - self.value[i]
+                    if delta == 0:
+                        continue
+
+                    self._unrank(i)
+                    self.value[i] = new_value
+                    self.pnl[i] = new_value - self.invested[i]
+                    self._rank(i)
+
+                    for name, ids, offsets in self.members:
+                        value, pnl = self.group_sums[name]
+                        for group in ([ids[i]] if offsets is None else ids[offsets[i]:offsets[i + 1]]):
+                            value[group] += delta
+                            pnl[group] += delta
+                    self.total_value += delta
+                    self.total_pnl += delta
+                    changed.append(i)
+        return changed
+
+    def holding_info(self, i):
+        invested_value = self.invested[i]
+        pnl = self.pnl[i]
+        return {
+            'symbol': self.symbols[i],
+            'pnl': money.to_rupees(pnl),
+            'pnl_percentage': (pnl / invested_value * 100) if invested_value > 0 else 0,
+            'current_value': money.to_rupees(self.value[i])
         }
 
-        for holding in holdings:
-            quantity = holding.get('quantity', 0)
-            avg_price = holding.get('average_price', 0)
-            ltp = holding.get('last_price', 0)
-
-            current_value = quantity * ltp
-            invested_value = quantity * avg_price
-            pnl = current_value - invested_value
-            pnl_percentage = (pnl / invested_value * 100) if invested_value > 0 else 0
-
-            analysis['total_value'] += current_value
-            analysis['total_pnl'] += pnl
-
-            # Sector analysis
-            sector = holding.get('sector', 'Unknown')
-            if sector not in analysis['sectors']:
-                analysis['sectors'][sector] = {'value': 0, 'pnl': 0, 'count': 0}
-
-            analysis['sectors'][sector]['value'] += current_value
-            analysis['sectors'][sector]['pnl'] += pnl
-            analysis['sectors'][sector]['count'] += 1
-
-            # Track top gainers and losers
-            holding_info = {
-                'symbol': holding.get('tradingsymbol', 'Unknown'),
-                'pnl': pnl,
-                'pnl_percentage': pnl_percentage,
-                'current_value': current_value
+    def to_analysis(self, top_n=None):
+        """Current state in the PortfolioService.analyze() shape.
+
+        top_n limits the gainer/loser lists, which are otherwise complete.
+        """
+        with self._lock:
+            gainers = self.gainers if top_n is None else self.gainers[:top_n]
+            losers = self.losers if top_n is None else self.losers[:top_n]
+            total_invested = self.total_value - self.total_pnl
+            sectors, groups = self.groups.analysis_groups(self.group_sums)
+            return {
+                'total_value': money.to_rupees(self.total_value),
+                'total_pnl': money.to_rupees(self.total_pnl),
+                'sectors': sectors,
+                'top_gainers': [self.holding_info(key % self.n) for key in gainers],
+                'top_losers': [self.holding_info(key % self.n) for key in losers],
+                'holdings_count': len(self.holdings),
+                'groups': groups,
+                'total_pnl_percentage': (
+                    (self.total_pnl / total_invested * 100) if total_invested > 0 else 0
+                )
             }
 
-            if pnl > 0:
-                analysis['top_gainers'].append(holding_info)
-            else:
-                analysis['top_losers'].append(holding_info)
 
-        # Sort top gainers and losers
-        analysis['top_gainers'].sort(key=lambda x: x['pnl'], reverse=True)
-        analysis['top_losers'].sort(key=lambda x: x['pnl'])
+def is_stale(value):
+    """True for holdings or an analysis served from the last-known-good snapshot"""
+    if isinstance(value, dict):
+        return value.get('stale', False)
+    return getattr(value, 'stale', False)
+
+
+def _ttl(fresh_ttl):
+    """Cache lifetime picker: snapshot-served results are retried sooner"""
+    return lambda value: resilience.stale_ttl if is_stale(value) else fresh_ttl
+
+
+def load_holdings(api_key, access_token, user_key):
+    """Fetch holdings for a user, reusing the cached copy while fresh.
+
+    When Kite fails, times out or its circuit is open, the user's
+    last-known-good snapshot is served instead (a SnapshotHoldings with
+    stale=True and as_of).
+    """
+    def fetch():
+        try:
+            holdings = PortfolioService(api_key, access_token).fetch_holdings()
+        except Exception as e:
+            logger.error(f"Error fetching portfolio holdings: {e}")
+            snapshot = load_snapshot(user_key)
+            if snapshot:
+                logger.warning(f"Serving holdings snapshot from {snapshot.as_of}")
+            return snapshot
+
+        if holdings:
+            save_snapshot(user_key, holdings)
+            ticker.ensure_feed(user_key, api_key, access_token, holdings)
+        return holdings or None
+
+    holdings = portfolio_cache.get_or_set((user_key, 'holdings'), fetch, ttl=_ttl(holdings_ttl))
+    if holdings and ticker.enabled and not is_stale(holdings) and ticker.get_feed(user_key) is None:
+        # Fetched by another worker (shared cache): this worker still needs its own feed
+        ticker.ensure_feed(user_key, api_key, access_token, holdings)
+    return holdings
 
-        # Calculate overall PnL percentage
-        total_invested = analysis['total_value'] - analysis['total_pnl']
-        analysis['total_pnl_percentage'] = (
-            (analysis['total_pnl'] / total_invested * 100) if total_invested > 0 else 0
-        )
 
+def load_analysis(api_key, access_token, user_key):
+    """Analyze a user's holdings, reusing the cached analysis while fresh.
+
+    With live prices enabled, the user's IncrementalAnalysis is advanced by
+    the prices that moved since its last refresh and the result is only
+    cached for TICKER_REFRESH_SECONDS.
+    """
+    def compute():
+        holdings = load_holdings(api_key, access_token, user_key)
+        feed = ticker.get_feed(user_key)
+        if holdings and feed:
+            book = load_book(user_key, holdings, feed)
+            analysis = book.to_analysis(top_n=analysis_top_n)
+        else:
+            book = None
+            analysis = PortfolioService.analyze(holdings)
+        if analysis and is_stale(holdings):
+            analysis['stale'] = True
+            analysis['as_of'] = holdings.as_of
+        if analysis and returns.tradebook_path:
+            analysis['returns'] = returns.load_returns(user_key, holdings)
+        clusters = correlation.load_clusters(user_key, holdings) if analysis else None
+        if clusters:
+            analysis['correlation'] = clusters
+        alerts.check(user_key, holdings, analysis)
+        history.record(user_key, analysis, lambda: HoldingsTable(holdings, book).positions())
         return analysis
+
+    ttl = ticker.refresh_seconds if ticker.enabled else None
+    return portfolio_cache.get_or_set((user_key, 'analysis'), compute, ttl=_ttl(ttl))
+
+
+def load_holdings_table(api_key, access_token, user_key):
+    """Every holding as a HoldingsTable for filtered, sorted, paged queries.
+
+    Cached like the analysis, so repeated pages reuse its sort orders.
+    """
+    def compute():
+        holdings = load_holdings(api_key, access_token, user_key)
+        feed = ticker.get_feed(user_key)
+        book = load_book(user_key, holdings, feed) if holdings and feed else None
+        return HoldingsTable(holdings or [], book)
+
+    ttl = ticker.refresh_seconds if ticker.enabled else None
+    return portfolio_cache.get_or_set((user_key, 'table'), compute, ttl=_ttl(ttl))
+
+
+def load_book(user_key, holdings, feed):
+    """The user's IncrementalAnalysis, advanced to the feed's latest prices"""
+    book = portfolio_cache.get((user_key, 'book'))
+    if book is None or book.holdings is not holdings:
+        book = IncrementalAnalysis(holdings)
+        portfolio_cache.set((user_key, 'book'), book, ttl=holdings_ttl)
+    if book.prices is not feed.prices:
+        # A restarted feed numbers its updates from 0 again: replay all of them
+        book.prices, book.seq = feed.prices, 0
+
+    changed, seq = feed.prices.changed_since(book.seq)
+    with timed('analyze_incremental'):
+        book.update_prices(changed)
+    book.seq = seq
+    return book
+
+
+def parse_group_by(value):
+    """'exchange,sector/exchange' -> (('exchange',), ('sector', 'exchange'))"""
+    groupings = []
+    for part in value.split(','):
+        grouping = tuple(d.strip() for d in part.split('/') if d.strip())
+        if not grouping:
+            continue
+        unknown = [d for d in grouping if d not in DIMENSIONS]
+        if unknown:
+            logger.warning(f"Ignoring GROUP_BY entry {part!r}: unknown dimension {unknown[0]!r}")
+            continue
+        if len(set(grouping)) < len(grouping) or sum(d in MULTI_VALUED for d in grouping) > 1:
+            logger.warning(f"Ignoring GROUP_BY entry {part!r}: repeated or multi-valued dimensions")
+            continue
+        groupings.append(grouping)
+    return tuple(groupings)
+
+
+def init_portfolio(app):
+    """Point Kite clients at the configured API root and set up rollups"""
+    global holdings_ttl, group_by, holding_tags_path, analysis_top_n
+    PortfolioService.kite_root = app.config.get('KITE_API_ROOT') or None
+    holdings_ttl = int(app.config['HOLDINGS_TTL']) if app.config.get('HOLDINGS_TTL') else None
+    if app.config.get('GROUP_BY') is not None:
+        group_by = parse_group_by(app.config['GROUP_BY'])
+    holding_tags_path = app.config.get('HOLDING_TAGS_PATH') or None
+    analysis_top_n = max(1, int(app.config.get('ANALYSIS_TOP_N', 10)))
@@ -0,0 +1,145 @@
+"""Postback service - applies Kite order postbacks to the cached holdings
+
+Kite POSTs every order update to the app's postback URL. Completed delivery
+(CNC) orders on an instrument we already hold are patched into the cached
+holdings in place; anything we cannot patch precisely drops the user's cache
+so the next load refetches. Derived entries (analysis, charts, incremental
+book) are always dropped, which lets holdings use a long HOLDINGS_TTL.
+
+Kite retries a postback it got no answer for, and the retry may reach
+another worker. The last PROCESSED_ORDERS order ids applied for each user
+are kept in SNAPSHOT_DIR and checked under a file lock, so a redelivered
+fill is never applied twice.
+"""
+import fcntl
+import hashlib
+import hmac
+import json
+import logging
+import os
+import tempfile
+from app.services import resilience
+from app.services.cache import portfolio_cache
+from app.services.records import HoldingRecord
+
+logger = logging.getLogger(__name__)
+
+# Cached entries computed from holdings
+DERIVED_KINDS = ('analysis', 'chart', 'book', 'table')
+# Order ids remembered per user for spotting redelivered postbacks
+PROCESSED_ORDERS = 1000
+
+
+def compute_checksum(order_id, order_timestamp, api_secret):
+    """SHA-256 of order_id + order_timestamp + api_secret, as Kite signs postbacks"""
+    return hashlib.sha256(f'{order_id}{order_timestamp}{api_secret}'.encode()).hexdigest()
+
+
+def verify_checksum(payload, api_secret):
+    """True if the postback was signed with our API secret"""
+    if not api_secret:
+        return False
+    expected = compute_checksum(payload.get('order_id', ''), payload.get('order_timestamp', ''), api_secret)
+    return hmac.compare_digest(expected, str(payload.get('checksum', '')))
+
+
+def _processed_path(user_key):
+    return os.path.join(resilience.snapshot_dir, f'postbacks-{resilience.safe_key(user_key)}.json')
+
+
+def claim_order(user_key, order_id):
+    """Record order_id as applied for the user; False if it already was"""
+    path = _processed_path(user_key)
+    os.makedirs(resilience.snapshot_dir, exist_ok=True)
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(path) as f:
+                processed = json.load(f)
+        except FileNotFoundError:
+            processed = []
+        if order_id in processed:
+            return False
+        processed = (processed + [order_id])[-PROCESSED_ORDERS:]
+        fd, tmp_path = tempfile.mkstemp(dir=resilience.snapshot_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(processed, f)
+        os.replace(tmp_path, path)
+    return True
+
+
+def _patched(holding, order):
+    """Copy of the holding after the fill, or None when the position is closed"""
+    filled = order.get('filled_quantity') or 0
+    fill_price = order.get('average_price') or 0
+    quantity = holding.get('quantity', 0)
+    patched = dict(holding)
+
+    if order.get('transaction_type') == 'BUY':
+        new_quantity = quantity + filled
+        patched['average_price'] = (quantity * holding.get('average_price', 0) + filled * fill_price) / new_quantity
+    else:
+        new_quantity = quantity - filled
+        if new_quantity <= 0:
+            return None
+
+    patched['quantity'] = new_quantity
+    patched['last_price'] = fill_price or holding.get('last_price', 0)
+    patched['pnl'] = (patched['last_price'] - patched['average_price']) * new_quantity
+    return HoldingRecord.from_row(patched)
+
+
+def patch_holdings(user_key, order):
+    """Apply a completed fill to the cached holdings; False if it could not be patched"""
+    key = (user_key, 'holdings')
+    holdings = portfolio_cache.get(key)
+    if not holdings or getattr(holdings, 'stale', False):
+        return False
+
+    token = order.get('instrument_token')
+    index = next((i for i, h in enumerate(holdings) if h.get('instrument_token') == token), None)
+    if index is None:
+        # A new position: only Kite knows its sector/ISIN details, refetch
+        return False
+
+    patched = _patched(holdings[index], order)
+    updated = holdings[:index] + ([patched] if patched else []) + holdings[index + 1:]
+    if not updated:
+        return False
+    # A new list object also makes load_book() rebuild its IncrementalAnalysis
+    return portfolio_cache.replace(key, holdings, updated)
+
+
+def apply_postback(order):
+    """Update the cache for one postback; returns the action taken"""
+    user_key = order.get('user_id')
+    status = order.get('status')
+    filled = order.get('filled_quantity') or 0
+
+    if not user_key or not filled or status not in ('COMPLETE', 'CANCELLED'):
+        return 'ignored'
+    if order.get('product') != 'CNC':
+        # Intraday and F&O orders never touch delivery holdings
+        return 'ignored'
+    if order.get('order_id') and not claim_order(user_key, str(order['order_id'])):
+        logger.info(f"Postback {order.get('order_id')} {status} already applied")
+        return 'duplicate'
+
+    try:
+        patched = status == 'COMPLETE' and patch_holdings(user_key, order)
+    except Exception:
+        # The order is claimed, so a retry will not patch it: refetch instead
+        portfolio_cache.invalidate(user_key)
+        raise
+    if patched:
+        action = 'patched'
+    else:
+        # Partially filled then cancelled, new instrument, or nothing cached
+        portfolio_cache.invalidate(user_key, 'holdings')
+        action = 'invalidated'
+
+    for kind in DERIVED_KINDS:
+        portfolio_cache.invalidate(user_key, kind)
+
+    logger.info(f"Postback {order.get('order_id')} {order.get('tradingsymbol')} {status}: {action}")
+    return action
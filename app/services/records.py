@@ -0,0 +1,101 @@
+"""Records - compact holding records in place of Kite's per-holding dicts
+
+Kite returns each holding as a dict of a few dozen fields, and a large book
+spends most of its memory on those dicts' hash tables. Holdings are
+converted once, where they enter the app (a Kite fetch, a snapshot, a
+postback fill), to HoldingRecords. These keep only the fields the app reads,
+in __slots__, with the repeated exchange/product/sector strings interned.
+
+A record reads like the dict it replaces: record['tradingsymbol'],
+record.get('sector', 'Unknown'), `in`, keys() and dict(record). A field set
+to None reads as missing, so code written against Kite's dicts, and plain
+dicts in the benchmarks and tools, work with either. values() reads one
+field of every holding in C for both.
+"""
+import sys
+from dataclasses import dataclass, fields
+from operator import attrgetter, itemgetter
+
+
+@dataclass(slots=True)
+class HoldingRecord:
+    tradingsymbol: str = None
+    exchange: str = None
+    instrument_token: int = None
+    isin: str = None
+    product: str = None
+    sector: str = None
+    quantity: int = None
+    average_price: float = None
+    last_price: float = None
+    close_price: float = None
+    pnl: float = None
+
+    @classmethod
+    def from_row(cls, row):
+        """Record of a Kite holding dict (or a record); fields the app does not read are dropped"""
+        if isinstance(row, cls):
+            return row
+        record = cls(*map(row.get, FIELDS))
+        for field in INTERNED:
+            value = getattr(record, field)
+            if type(value) is str:
+                setattr(record, field, sys.intern(value))
+        return record
+
+    def __getitem__(self, field):
+        value = getattr(self, field, None) if type(field) is str else None
+        if value is None:
+            raise KeyError(field)
+        return value
+
+    def get(self, field, default=None):
+        value = getattr(self, field, None) if type(field) is str else None
+        return default if value is None else value
+
+    def __contains__(self, field):
+        return self.get(field) is not None
+
+    def keys(self):
+        return [field for field in FIELDS if getattr(self, field) is not None]
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in self.keys()]
+
+    def to_dict(self):
+        return dict(self.items())
+
+
+FIELDS = tuple(f.name for f in fields(HoldingRecord))
+# The same few values across a whole book
+INTERNED = ('exchange', 'product', 'sector')
+
+
+def to_records(holdings):
+    """Convert holdings to records in place and return the list.
+
+    Each dict is released as soon as its record replaces it, so converting a
+    large book never holds both copies.
+    """
+    for i, row in enumerate(holdings):
+        holdings[i] = HoldingRecord.from_row(row)
+    return holdings
+
+
+def values(holdings, field, default=None):
+    """One field of every holding (records or dicts); missing values read as default"""
+    try:
+        if holdings and type(holdings[0]) is HoldingRecord:
+            column = list(map(attrgetter(field), holdings))
+            if None in column:
+                column = [default if value is None else value for value in column]
+            return column
+        return list(map(itemgetter(field), holdings))
+    except (KeyError, AttributeError):
+        # Dicts missing the field, or a mix of dicts and records
+        return [h.get(field, default) for h in holdings]
+
+
+def as_json(value):
+    """json.dump default: records as dicts, anything else as str"""
+    return value.to_dict() if isinstance(value, HoldingRecord) else str(value)
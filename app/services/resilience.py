@@ -0,0 +1,168 @@
+"""Resilience service - timeouts, circuit breaking and last-known-good snapshots for Kite calls"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from datetime import datetime
+from app.services.records import to_records, as_json
+
+logger = logging.getLogger(__name__)
+
+# Seconds each Kite HTTP call may block on connect/read
+kite_timeout = 5.0
+# Total seconds a request waits for Kite before falling back to the snapshot
+kite_budget = 8.0
+# How long a snapshot-served result is cached before Kite is tried again
+stale_ttl = 15
+snapshot_dir = 'snapshots'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream that is failing"""
+
+
+class BudgetExceededError(Exception):
+    """Raised when an upstream call does not finish within the request budget"""
+
+
+class CircuitBreaker:
+    """Fail fast after repeated upstream errors.
+
+    closed: calls go through; `failure_threshold` consecutive failures open it.
+    open: calls raise CircuitOpenError until `reset_timeout` has passed.
+    half-open: one trial call is let through; success closes, failure reopens.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return 'open'
+        return 'half-open'
+
+    def call(self, fn, *args, **kwargs):
+        with self._lock:
+            state = self.state
+            if state == 'open' or (state == 'half-open' and self._trial_running):
+                raise CircuitOpenError(f'{self.name} circuit open after {self.failures} failures')
+            if state == 'half-open':
+                self._trial_running = True
+
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self._record(False)
+            raise
+        self._record(True)
+        return result
+
+    def _record(self, ok):
+        with self._lock:
+            self._trial_running = False
+            if ok:
+                if self.opened_at is not None:
+                    logger.info(f"{self.name} circuit closed")
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f"{self.name} circuit opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+
+kite_breaker = CircuitBreaker('kite')
+
+
+def call_with_budget(fn, budget=None):
+    """Run fn, giving up after `budget` seconds (the call itself finishes in the background).
+
+    Each call gets its own thread. With a pool, calls abandoned to a slow Kite
+    would hold every worker, and later calls would time out queued behind them
+    without reaching Kite. An abandoned call ends within kite_timeout, and the
+    breaker opens after a few of them, so the extra threads stay few.
+    """
+    budget = kite_budget if budget is None else budget
+    future = Future()
+
+    def run():
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(fn())
+        except Exception as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name='kite-call', daemon=True).start()
+    try:
+        return future.result(timeout=budget)
+    except FutureTimeout:
+        raise BudgetExceededError(f'no response within {budget:.1f}s')
+
+
+class SnapshotHoldings(list):
+    """Holdings served from the last-known-good snapshot instead of Kite"""
+    stale = True
+
+    def __init__(self, rows, as_of):
+        super().__init__(rows)
+        self.as_of = as_of
+
+
+def safe_key(user_key):
+    """The user key as a file name part: anything but letters, digits, '-' and '_' becomes '_'"""
+    return ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(user_key))
+
+
+def _snapshot_path(user_key):
+    return os.path.join(snapshot_dir, f'holdings-{safe_key(user_key)}.json')
+
+
+def save_snapshot(user_key, holdings):
+    """Persist holdings as the user's last-known-good snapshot (atomic replace)"""
+    try:
+        os.makedirs(snapshot_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=snapshot_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'as_of': datetime.now().isoformat(timespec='seconds'), 'holdings': holdings},
+                      f, default=as_json)
+        os.replace(tmp_path, _snapshot_path(user_key))
+    except Exception as e:
+        logger.error(f"Could not save holdings snapshot: {e}")
+
+
+def load_snapshot(user_key):
+    """The user's last-known-good holdings, or None"""
+    try:
+        with open(_snapshot_path(user_key)) as f:
+            data = json.load(f)
+        return SnapshotHoldings(to_records(data['holdings']), data['as_of'])
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.error(f"Could not read holdings snapshot: {e}")
+        return None
+
+
+def init_resilience(app):
+    """Configure Kite timeouts, budget, breaker and snapshot location from app config"""
+    global kite_timeout, kite_budget, stale_ttl, snapshot_dir
+    kite_timeout = float(app.config.get('KITE_TIMEOUT', kite_timeout))
+    kite_budget = float(app.config.get('KITE_BUDGET', kite_budget))
+    stale_ttl = int(app.config.get('STALE_TTL', stale_ttl))
+    snapshot_dir = app.config.get('SNAPSHOT_DIR') or snapshot_dir
+    kite_breaker.failure_threshold = int(app.config.get('KITE_BREAKER_FAILURES', kite_breaker.failure_threshold))
+    kite_breaker.reset_timeout = float(app.config.get('KITE_BREAKER_RESET', kite_breaker.reset_timeout))
@@ -0,0 +1,242 @@
+"""Returns service - XIRR and time-weighted returns from the tradebook
+
+Cash flows come from a Kite Console tradebook export (CSV with symbol,
+trade_date, trade_type, quantity, price). Every holding's flows are padded
+into one (holdings x flow dates) matrix and XIRR is solved for all rows at
+once: vectorized Newton steps, with a vectorized bisection for rows Newton
+does not settle. Time-weighted return chains daily sub-period returns from
+the history store, net of the day's buys and sells.
+"""
+import csv
+import glob
+import logging
+import math
+import os
+import threading
+from datetime import date, datetime, timedelta
+import numpy as np
+from app.services.cache import portfolio_cache
+from app.services.metrics import timed
+from app.services import history
+
+logger = logging.getLogger(__name__)
+
+tradebook_path = None
+twr_days = 365
+
+# Rates are searched in (-99.99%, 100000%) a year
+RATE_FLOOR = -0.9999
+RATE_CEILING = 1000.0
+
+_tradebook = {'key': None, 'flows': None}
+_tradebook_lock = threading.Lock()
+
+
+def _tradebook_files():
+    if not tradebook_path:
+        return []
+    if os.path.isdir(tradebook_path):
+        return sorted(glob.glob(os.path.join(tradebook_path, '*.csv')))
+    return [tradebook_path] if os.path.exists(tradebook_path) else []
+
+
+def parse_tradebook(paths):
+    """{symbol: {date: net cash flow}} from tradebook CSVs (buys negative, sells positive)"""
+    flows = {}
+    for path in paths:
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                symbol = row.get('symbol') or row.get('tradingsymbol')
+                trade_type = (row.get('trade_type') or '').lower()
+                if not symbol or trade_type not in ('buy', 'sell'):
+                    continue
+                day = date.fromisoformat(row['trade_date'][:10])
+                amount = float(row['quantity']) * float(row['price'])
+                by_day = flows.setdefault(symbol, {})
+                by_day[day] = by_day.get(day, 0.0) + (-amount if trade_type == 'buy' else amount)
+    return flows
+
+
+def load_tradebook():
+    """Parsed tradebook flows, re-read only when the files change"""
+    paths = _tradebook_files()
+    if not paths:
+        return None
+    key = tuple((p, os.path.getmtime(p)) for p in paths)
+    with _tradebook_lock:
+        if _tradebook['key'] != key:
+            _tradebook['flows'] = parse_tradebook(paths)
+            _tradebook['key'] = key
+        return _tradebook['flows']
+
+
+def pad_flows(series):
+    """Ragged [(dates, amounts)] -> (amounts, years) matrices, zero padded.
+
+    Times are in years from each row's first flow, so padding (amount 0)
+    contributes nothing to the NPV sums.
+    """
+    width = max((len(dates) for dates, _ in series), default=0)
+    amounts = np.zeros((len(series), width))
+    years = np.zeros((len(series), width))
+    for row, (dates, values) in enumerate(series):
+        first = dates[0]
+        amounts[row, :len(values)] = values
+        years[row, :len(dates)] = [(d - first).days / 365.0 for d in dates]
+    return amounts, years
+
+
+def _npv(amounts, years, rates):
+    return (amounts * np.exp(-years * np.log1p(rates)[:, None])).sum(axis=1)
+
+
+def xirr_batch(amounts, years, tol=1e-9, max_iter=50, bisect_iter=100):
+    """Annualized IRR for every row of padded cash-flow matrices (NaN where undefined)"""
+    rows = amounts.shape[0]
+    if rows == 0:
+        return np.zeros(0)
+
+    rates = np.full(rows, 0.1)
+    done = np.zeros(rows, dtype=bool)
+    with np.errstate(all='ignore'):
+        for _ in range(max_iter):
+            discount = np.exp(-years * np.log1p(rates)[:, None])
+            npv = (amounts * discount).sum(axis=1)
+            slope = -(years * amounts * discount).sum(axis=1) / (1 + rates)
+            step = np.where(slope != 0, npv / slope, 0.0)
+            updated = np.clip(rates - step, RATE_FLOOR, RATE_CEILING)
+            rates = np.where(done, rates, updated)
+            done |= np.abs(step) < tol
+            if done.all():
+                break
+
+        # Rows Newton did not settle: bisect, where the bracket has a sign change
+        npv = _npv(amounts, years, rates)
+        scale = np.abs(amounts).sum(axis=1)
+        unsettled = ~done | ~np.isfinite(rates) | (np.abs(npv) > 1e-6 * np.maximum(scale, 1))
+        if unsettled.any():
+            lo = np.full(rows, RATE_FLOOR)
+            hi = np.full(rows, RATE_CEILING)
+            f_lo = _npv(amounts, years, lo)
+            bracketed = np.sign(f_lo) != np.sign(_npv(amounts, years, hi))
+            for _ in range(bisect_iter):
+                mid = (lo + hi) / 2
+                f_mid = _npv(amounts, years, mid)
+                left = np.sign(f_mid) == np.sign(f_lo)
+                lo = np.where(left, mid, lo)
+                f_lo = np.where(left, f_mid, f_lo)
+                hi = np.where(left, hi, mid)
+            rates = np.where(unsettled, np.where(bracketed, (lo + hi) / 2, np.nan), rates)
+
+    return rates
+
+
+def _series(by_day, terminal_value, today):
+    flows = dict(by_day)
+    flows[today] = flows.get(today, 0.0) + terminal_value
+    dates = sorted(flows)
+    return dates, [flows[d] for d in dates]
+
+
+def compute_xirr(holdings, flows, today=None):
+    """({symbol: xirr}, portfolio xirr) from current holdings and tradebook flows.
+
+    Each holding's current value is its terminal inflow today. Closed
+    positions in the tradebook still count towards the portfolio figure.
+    """
+    today = today or date.today()
+    values = {}
+    for holding in holdings:
+        symbol = holding.get('tradingsymbol')
+        values[symbol] = values.get(symbol, 0.0) + holding.get('quantity', 0) * holding.get('last_price', 0)
+
+    symbols = [s for s in values if s in flows]
+    series = [_series(flows[s], values[s], today) for s in symbols]
+    per_holding = xirr_batch(*pad_flows(series)) if series else np.zeros(0)
+
+    combined = {}
+    for by_day in flows.values():
+        for day, amount in by_day.items():
+            combined[day] = combined.get(day, 0.0) + amount
+    portfolio = np.nan
+    if combined:
+        terminal = math.fsum(values[s] for s in symbols)
+        portfolio = xirr_batch(*pad_flows([_series(combined, terminal, today)]))[0]
+
+    return {s: _rate(r) for s, r in zip(symbols, per_holding)}, _rate(portfolio)
+
+
+def _rate(value):
+    return None if not np.isfinite(value) else float(value) * 100
+
+
+def compute_twr(user_key, flows, days=None):
+    """Time-weighted return (%) over the recorded history, or None.
+
+    Chains daily sub-period returns (V_t - net_buys_t) / V_{t-1} - 1 using the
+    last recorded value of each day.
+    """
+    series = history.portfolio_series(user_key, days=days or twr_days)
+    daily = {}
+    for ts, value, _ in series:
+        daily[datetime.fromtimestamp(ts).date()] = value
+    if len(daily) < 2:
+        return None, None
+
+    net_buys = {}
+    for by_day in flows.values():
+        for day, amount in by_day.items():
+            net_buys[day] = net_buys.get(day, 0.0) - amount
+
+    days_sorted = sorted(daily)
+    growth = 1.0
+    for previous, current in zip(days_sorted, days_sorted[1:]):
+        base = daily[previous]
+        if base <= 0:
+            continue
+        # Trades between the two samples count as flows of the later one
+        contributed = math.fsum(amount for day, amount in net_buys.items() if previous < day <= current)
+        growth *= (daily[current] - contributed) / base
+    return (growth - 1) * 100, days_sorted[0].isoformat()
+
+
+def compute_returns(user_key, holdings):
+    """Returns block attached to an analysis, or None without a tradebook"""
+    flows = load_tradebook()
+    if not flows:
+        return None
+
+    with timed('returns'):
+        per_holding, portfolio_xirr = compute_xirr(holdings, flows)
+        try:
+            twr, twr_since = compute_twr(user_key, flows)
+        except Exception as e:
+            logger.error(f"Could not compute time-weighted return: {e}")
+            twr, twr_since = None, None
+
+    return {
+        'xirr': portfolio_xirr,
+        'twr': twr,
+        'twr_since': twr_since,
+        'holdings': per_holding
+    }
+
+
+def load_returns(user_key, holdings):
+    """Returns for the user, computed once per day"""
+    if not tradebook_path:
+        return None
+    now = datetime.now()
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return portfolio_cache.get_or_set(
+        (user_key, 'returns', now.date().isoformat()),
+        lambda: compute_returns(user_key, holdings),
+        ttl=(midnight - now).total_seconds()
+    )
+
+
+def init_returns(app):
+    """Configure the tradebook location from app config"""
+    global tradebook_path, twr_days
+    tradebook_path = app.config.get('TRADEBOOK_PATH') or None
+    twr_days = int(app.config.get('RETURNS_TWR_DAYS', twr_days))
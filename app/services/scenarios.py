@@ -0,0 +1,204 @@
+"""Scenario service - what-if price shocks and rebalances evaluated in bulk
+
+A scenario sets a price move (percent) per holding: a market-wide move,
+overridden by sector moves, overridden by symbol moves. It may also resize
+positions ("rebalance": percent of the position bought or sold at today's
+price). All scenarios become one (scenarios x holdings) growth matrix G, and
+G @ (value x sector one-hot) yields every scenario's sector values in a
+single matrix multiply. The matrix is built and multiplied in chunks of
+CHUNK_ROWS scenarios to keep memory flat.
+"""
+import logging
+import numpy as np
+from app.services.metrics import timed
+from app.services import records
+
+logger = logging.getLogger(__name__)
+
+MAX_SCENARIOS = 10000
+CHUNK_ROWS = 1024
+DEFAULT_LIMIT = 50
+
+
+class ScenarioBook:
+    """Holding values and sector membership as the arrays scenarios run against"""
+
+    def __init__(self, holdings):
+        self.symbols = records.values(holdings, 'tradingsymbol', 'Unknown')
+        sectors = records.values(holdings, 'sector', 'Unknown')
+        self.sector_names = list(dict.fromkeys(sectors))
+        sector_index = {name: i for i, name in enumerate(self.sector_names)}
+
+        self.values = (np.array(records.values(holdings, 'quantity', 0), dtype=np.float64)
+                       * np.array(records.values(holdings, 'last_price', 0), dtype=np.float64))
+        self.sector_of = np.fromiter((sector_index[s] for s in sectors), dtype=np.intp, count=len(sectors))
+        self.total_value = float(self.values.sum())
+
+        # (holdings x sectors) values: growth rows @ this = scenario sector values
+        self.sector_values = np.zeros((len(holdings), len(self.sector_names)))
+        self.sector_values[np.arange(len(holdings)), self.sector_of] = self.values
+        self.base_sectors = self.sector_values.sum(axis=0)
+
+        self.by_symbol = {}
+        for i, symbol in enumerate(self.symbols):
+            self.by_symbol.setdefault(symbol, []).append(i)
+        self.sector_index = sector_index
+
+
+def _percent(value, field):
+    try:
+        return float(value) / 100
+    except (TypeError, ValueError):
+        raise ValueError(f"'{field}' values must be numbers (percent)")
+
+
+class CompiledScenarios:
+    """Scenario shocks as flat (scenario row, column, value) arrays, sorted by row"""
+
+    def __init__(self, names, market, sectors, symbols, trades):
+        self.names = names
+        self.market = np.array(market, dtype=np.float64)
+        self.sectors = [np.array(column) for column in zip(*sectors)] if sectors else None
+        self.symbols = [np.array(column) for column in zip(*symbols)] if symbols else None
+        self.trades = [np.array(column) for column in zip(*trades)] if trades else None
+
+    def __len__(self):
+        return len(self.names)
+
+    @staticmethod
+    def rows(entries, start, stop):
+        """Entries of scenarios [start, stop) with rows made chunk-relative"""
+        if entries is None:
+            return None
+        rows, columns, values = entries
+        lo, hi = np.searchsorted(rows, (start, stop))
+        return rows[lo:hi] - start, columns[lo:hi], values[lo:hi]
+
+
+def compile_scenarios(book, specs):
+    """Validate scenario dicts into a CompiledScenarios.
+
+    Returns (compiled, unmatched) where unmatched lists sector and symbol
+    names that are not in the book (they are ignored).
+    """
+    if not isinstance(specs, list) or not specs:
+        raise ValueError("'scenarios' must be a non-empty list")
+    if len(specs) > MAX_SCENARIOS:
+        raise ValueError(f"At most {MAX_SCENARIOS} scenarios per request")
+
+    names, market, sectors, symbols, trades = [], [], [], [], []
+    unmatched = set()
+    for row, spec in enumerate(specs):
+        if not isinstance(spec, dict):
+            raise ValueError('Each scenario must be an object')
+        names.append(str(spec.get('name') or f'Scenario {row + 1}'))
+        market.append(_percent(spec.get('market', 0), 'market'))
+
+        for name, move in (spec.get('sectors') or {}).items():
+            if name in book.sector_index:
+                sectors.append((row, book.sector_index[name], _percent(move, 'sectors')))
+            else:
+                unmatched.add(name)
+
+        for field, target in (('symbols', symbols), ('rebalance', trades)):
+            for symbol, move in (spec.get(field) or {}).items():
+                indexes = book.by_symbol.get(symbol)
+                if indexes is None:
+                    unmatched.add(symbol)
+                    continue
+                move = _percent(move, field)
+                if field == 'rebalance' and move < -1:
+                    raise ValueError('A rebalance cannot sell more than 100% of a position')
+                target.extend((row, i, move) for i in indexes)
+
+    return CompiledScenarios(names, market, sectors, symbols, trades), sorted(unmatched)
+
+
+def _growth_matrix(book, compiled, start, stop):
+    """(stop - start x holdings) value multipliers, and each scenario's traded value"""
+    rows = stop - start
+    sector_moves = np.repeat(compiled.market[start:stop, None], len(book.sector_names), axis=1)
+    entries = compiled.rows(compiled.sectors, start, stop)
+    if entries:
+        row, sector, move = entries
+        sector_moves[row, sector] = move
+
+    growth = sector_moves[:, book.sector_of]
+    growth += 1
+    entries = compiled.rows(compiled.symbols, start, stop)
+    if entries:
+        row, holding, move = entries
+        growth[row, holding] = 1 + move
+
+    traded = np.zeros(rows)
+    entries = compiled.rows(compiled.trades, start, stop)
+    if entries:
+        row, holding, change = entries
+        growth[row, holding] *= 1 + change
+        traded += np.bincount(row, weights=change * book.values[holding], minlength=rows)
+    return growth, traded
+
+
+def evaluate(book, compiled):
+    """(sector values (scenarios x sectors), traded value per scenario) for all scenarios"""
+    sector_values = np.empty((len(compiled), len(book.sector_names)))
+    traded = np.empty(len(compiled))
+    for start in range(0, len(compiled), CHUNK_ROWS):
+        stop = min(start + CHUNK_ROWS, len(compiled))
+        growth, traded[start:stop] = _growth_matrix(book, compiled, start, stop)
+        sector_values[start:stop] = growth @ book.sector_values
+    return sector_values, traded
+
+
+def _allocation(names, values, total):
+    return {
+        name: {'value': float(values[i]), 'weight': float(values[i] / total * 100) if total > 0 else 0}
+        for i, name in enumerate(names)
+    }
+
+
+def run_scenarios(holdings, specs, limit=DEFAULT_LIMIT, order='worst'):
+    """Evaluate scenario dicts against holdings; ranked by P&L.
+
+    order is 'worst' (largest loss first) or 'best'. P&L is the price effect
+    on the post-rebalance book; 'cash' is what the rebalance frees (+) or
+    costs (-) at today's prices.
+    """
+    if not holdings:
+        raise ValueError('No holdings found')
+    if order not in ('worst', 'best'):
+        raise ValueError("'order' must be 'worst' or 'best'")
+
+    with timed('scenarios'):
+        book = ScenarioBook(holdings)
+        compiled, unmatched = compile_scenarios(book, specs)
+        sector_values, traded = evaluate(book, compiled)
+
+        totals = sector_values.sum(axis=1)
+        rebalanced = book.total_value + traded
+        pnl = totals - rebalanced
+        # Stable both ways, so tied scenarios keep their input order
+        ranking = np.argsort(pnl if order == 'worst' else -pnl, kind='stable')
+
+    scenarios = []
+    for rank, row in enumerate(ranking[:max(0, int(limit))], start=1):
+        total = totals[row]
+        scenarios.append({
+            'rank': rank,
+            'name': compiled.names[row],
+            'pnl': float(pnl[row]),
+            'pnl_percentage': float(pnl[row] / rebalanced[row] * 100) if rebalanced[row] > 0 else 0,
+            'total_value': float(total),
+            'cash': float(-traded[row]),
+            'sectors': _allocation(book.sector_names, sector_values[row], total)
+        })
+
+    return {
+        'count': len(compiled),
+        'base': {
+            'total_value': book.total_value,
+            'sectors': _allocation(book.sector_names, book.base_sectors, book.total_value)
+        },
+        'scenarios': scenarios,
+        'unmatched': unmatched
+    }
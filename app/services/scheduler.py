@@ -1,18 +1,90 @@
 """Scheduler service - handles scheduled email reports"""
+import fcntl
 import logging
+import os
+import tempfile
+import threading
+from datetime import datetime
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
-from app.services.portfolio import PortfolioService
-from app.services.email import send_report
+from app.services.portfolio import PortfolioService, load_holdings, load_analysis, load_holdings_table, is_stale
+from app.services import changes, correlation, money, export
+from app.services.cache import portfolio_cache
+from app.services.email import send_report, send_no_change_note
+from app.services.charts import load_value_chart
 from app.services.token_manager import load_token
+from app.services.metrics import timed
 
 logger = logging.getLogger(__name__)
 scheduler = BackgroundScheduler()
 
+# Shared by every worker on the host; SCHEDULER_LOCK_FILE overrides it
+lock_file = os.path.join(tempfile.gettempdir(), 'portfolio-reporter-scheduler.lock')
+_lock_handle = None
+
+
+def acquire_scheduler_lock():
+    """Elect one process per host to run scheduled jobs.
+
+    Every gunicorn worker calls create_app(), so without this each worker
+    would send its own copy of the daily report.
+    """
+    global _lock_handle
+    if _lock_handle is not None:
+        return True
+
+    handle = open(lock_file, 'w')
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return False
+
+    _lock_handle = handle
+    return True
+
+
+def get_next_run_time(job_id):
+    """Next fire time of a job, even in workers that do not run the scheduler"""
+    job = scheduler.get_job(job_id)
+    if not job:
+        return None
+    if scheduler.running:
+        return job.next_run_time
+    return job.trigger.get_next_fire_time(None, datetime.now(job.trigger.timezone))
+
+
+def update_correlations(api_key, access_token, user_key, holdings):
+    """Fold today's returns into the correlation store (seeding it first if configured)"""
+    try:
+        if correlation.bootstrap_days and correlation.is_empty(user_key):
+            # Hundreds of rate-limited candle requests: keep them off the report path
+            kite = PortfolioService(api_key, access_token).kite
+            threading.Thread(target=correlation.bootstrap, args=(user_key, kite, list(holdings)),
+                             name='correlation-bootstrap', daemon=True).start()
+        else:
+            correlation.update(user_key, holdings)
+    except Exception as e:
+        logger.error(f"Could not update correlations: {e}")
+
+
+def report_exports(api_key, access_token, user_key):
+    """(filename, bytes) for each REPORT_ATTACH_EXPORT format; a failed export is left out"""
+    if not export.attach_formats:
+        return []
+    table = load_holdings_table(api_key, access_token, user_key)
+    exports = []
+    for fmt in export.attach_formats:
+        try:
+            exports.append((export.filename(fmt), export.export_bytes(table, fmt)))
+        except Exception as e:
+            logger.error(f"Could not export holdings as {fmt}: {e}")
+    return exports
+
 
 def send_scheduled_report(app):
     """Send scheduled portfolio report"""
-    with app.app_context():
+    with app.app_context(), timed('scheduled_report'):
         try:
             logger.info("Running scheduled portfolio report...")
 
@@ -31,20 +103,48 @@ def send_scheduled_report(app):
                 logger.error("Missing configuration for scheduled report")
                 return
 
-            # Fetch and analyze portfolio
-            portfolio_service = PortfolioService(api_key, access_token)
-            holdings = portfolio_service.get_holdings()
+            # Fetch fresh holdings; falls back to the last-known-good snapshot
+            user_key = token_data['user_id']
+            portfolio_cache.invalidate(user_key)
+            holdings = load_holdings(api_key, access_token, user_key)
 
             if not holdings:
-                logger.warning("No holdings found for scheduled report")
+                logger.error("No holdings available for scheduled report (Kite down and no snapshot)")
+                return
+
+            update_correlations(api_key, access_token, user_key, holdings)
+
+            # Skip analysis, charts and sending when nothing moved since the last report.
+            # A snapshot always matches the report it was taken for, so it is never
+            # "no change": it goes out in full with its stale banner.
+            if is_stale(holdings):
+                logger.warning(f"Kite unavailable - sending full report from snapshot of {holdings.as_of}")
+                action, previous, change_pct = 'full', changes.load_state(user_key), None
+            else:
+                action, previous, change_pct = changes.evaluate(user_key, holdings)
+            if action == 'skip':
+                logger.info(f"No change since report of {previous['sent_at']} - skipping")
+                return
+            if action == 'note':
+                value = money.book_value(holdings)
+                send_no_change_note(value, change_pct, previous['sent_at'], resend_api_key, recipient_email)
+                logger.info("No-change note sent")
                 return
 
-            analysis = portfolio_service.analyze(holdings)
+            analysis = load_analysis(api_key, access_token, user_key)
+            if analysis.get('stale'):
+                logger.warning(f"Scheduled report uses snapshot from {analysis['as_of']}")
+            analysis = dict(analysis, deltas=changes.compute_deltas(previous, analysis, holdings))
 
             # Send report
-            success = send_report(analysis, None, resend_api_key, recipient_email)
+            success = send_report(analysis, None, resend_api_key, recipient_email,
+                                  value_chart=load_value_chart(user_key),
+                                  exports=report_exports(api_key, access_token, user_key))
 
             if success:
+                # The baseline stays the last report of live data
+                if not is_stale(holdings):
+                    changes.save_state(user_key, holdings, analysis)
                 logger.info("Scheduled report sent successfully!")
             else:
                 logger.error("Failed to send scheduled report")
@@ -55,6 +155,8 @@ def send_scheduled_report(app):
 
 def init_scheduler(app):
     """Initialize the scheduler with daily report job"""
+    global lock_file
+    lock_file = app.config.get('SCHEDULER_LOCK_FILE') or lock_file
     # Get schedule time from config (default: 9:00 AM IST)
     schedule_hour = int(app.config.get('REPORT_HOUR', 9))
     schedule_minute = int(app.config.get('REPORT_MINUTE', 0))
@@ -69,8 +171,11 @@ def init_scheduler(app):
         replace_existing=True
     )
 
-    # Start scheduler
+    # Start scheduler (jobs stay registered but paused in non-owner workers)
     if not scheduler.running:
+        if not acquire_scheduler_lock():
+            logger.info("Scheduler owned by another worker - not starting here")
+            return
         scheduler.start()
         logger.info(f"Scheduler started - Daily report at {schedule_hour:02d}:{schedule_minute:02d}")
 
@@ -0,0 +1,218 @@
+"""Shared cache service - a cache tier shared by every worker on the host
+
+Each gunicorn worker has its own TTLCache, so without this tier every worker
+fetches the same holdings from Kite, runs the same analysis and draws the
+same charts. SharedCache keeps pickled results in one memory-mapped file
+(SHARED_CACHE_PATH; put it on /dev/shm so it stays in RAM):
+
+    header | user generations | fill-lock bytes | index | arena
+
+- The arena is a ring buffer. Entries are appended at an ever-growing
+  absolute head position, and the entry at position p is intact while
+  head <= p + arena size, so eviction is implicit and oldest-first.
+- The index is a fixed open-addressed table of (key hash, user hash, kind
+  hash, position, length, expiry) slots, used through a numpy view of the
+  mapping.
+- Writers hold an exclusive fcntl lock on the header and readers a shared
+  one while they unpickle straight out of the mapping, so the stored bytes
+  are never copied out first.
+- Every user has a generation number that invalidate() bumps. Workers stamp
+  their in-process entries with it and drop them once it moves, so a
+  postback or refresh handled by one worker reaches all of them.
+- A miss takes a per-key fill lock (a byte-range lock, polled without
+  blocking so a gevent worker keeps serving), so one worker computes while
+  the others wait for its result.
+"""
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PRSHARE1'
+# magic, index slots, arena bytes, head (absolute write position)
+HEADER = struct.Struct('<8sQQQ')
+HEADER_SIZE = 64
+GENERATIONS = 1024
+FILL_LOCKS = 4096
+# Index slots probed per key
+PROBE = 8
+# Entries larger than this share of the arena are kept in-process only
+MAX_ENTRY_SHARE = 4
+# How long a worker waits for another worker's fill before computing itself
+FILL_WAIT = 15.0
+FILL_POLL = 0.02
+
+SLOT = np.dtype([('key', '<u8'), ('user', '<u8'), ('kind', '<u8'),
+                 ('pos', '<u8'), ('length', '<u8'), ('expires', '<f8')])
+
+
+@lru_cache(maxsize=65536)
+def key_hash(key):
+    """64-bit hash of a cache key (or key prefix), the same in every process"""
+    return int.from_bytes(hashlib.blake2b(repr(key).encode(), digest_size=8).digest(), 'little')
+
+
+def _align(offset, boundary):
+    return -(-offset // boundary) * boundary
+
+
+class SharedCache:
+    """Pickled values in a memory-mapped file shared by every process that opens it"""
+
+    def __init__(self, path, size):
+        self.path = path
+        self.slots = max(1024, size // 16384)
+        self.generations_offset = HEADER_SIZE
+        self.locks_offset = self.generations_offset + GENERATIONS * 8
+        self.index_offset = _align(self.locks_offset + FILL_LOCKS, 64)
+        self.arena_offset = _align(self.index_offset + self.slots * SLOT.itemsize, mmap.PAGESIZE)
+        self.arena = max(size - self.arena_offset, mmap.PAGESIZE)
+        total = self.arena_offset + self.arena
+
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, 0)
+        try:
+            header = os.pread(self._fd, HEADER.size, 0)
+            if (len(header) < HEADER.size or os.fstat(self._fd).st_size != total
+                    or HEADER.unpack(header)[:3] != (MAGIC, self.slots, self.arena)):
+                # New file, or one laid out for another size: start empty
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, total)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, self.slots, self.arena, 0), 0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 0)
+
+        self._map = mmap.mmap(self._fd, total)
+        self._head = np.ndarray(1, '<u8', buffer=self._map, offset=24)
+        self._generations = np.ndarray(GENERATIONS, '<u8', buffer=self._map, offset=self.generations_offset)
+        self._index = np.ndarray(self.slots, SLOT, buffer=self._map, offset=self.index_offset)
+        self._probe = np.arange(PROBE)
+
+    @contextmanager
+    def _locked(self, exclusive):
+        # POSIX locks belong to the process, so threads of one worker also
+        # need the in-process lock to keep out of each other's way
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH, 1, 0)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 0)
+
+    def generation(self, user_key):
+        """Current generation of a user's entries (an aligned 8-byte read, no lock)"""
+        return int(self._generations[key_hash((user_key,)) % GENERATIONS])
+
+    def _find(self, h):
+        rows = (h % self.slots + self._probe) % self.slots
+        match = rows[self._index['key'][rows] == h]
+        return int(match[0]) if len(match) else None
+
+    def _intact(self, slot, head):
+        return slot['length'] > 0 and head <= slot['pos'] + self.arena
+
+    def get(self, key):
+        """(value, seconds left) for key, or None if missing, expired or evicted"""
+        with self._locked(exclusive=False):
+            row = self._find(key_hash(key))
+            if row is None:
+                return None
+            slot = self._index[row]
+            left = float(slot['expires']) - time.time()
+            if left <= 0 or not self._intact(slot, int(self._head[0])):
+                return None
+            start = self.arena_offset + int(slot['pos']) % self.arena
+            with memoryview(self._map)[start:start + int(slot['length'])] as data:
+                stored_key, value = pickle.loads(data)
+        # The full key is stored with the value, so a hash collision is a miss
+        return (value, left) if stored_key == key else None
+
+    def set(self, key, value, ttl, generation=None):
+        """Store value for ttl seconds; skipped if the user was invalidated since `generation`"""
+        try:
+            payload = pickle.dumps((key, value), protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            logger.warning(f"Not sharing {key!r}: {e}")
+            return False
+        length = len(payload)
+        if length > self.arena // MAX_ENTRY_SHARE:
+            return False
+
+        h = key_hash(key)
+        with self._locked(exclusive=True):
+            if generation is not None and self.generation(key[0]) != generation:
+                return False
+            head = int(self._head[0])
+            pos = head
+            if pos % self.arena + length > self.arena:
+                # Never wrap an entry: skip to the start of the ring
+                pos += self.arena - pos % self.arena
+            start = self.arena_offset + pos % self.arena
+            self._map[start:start + length] = payload
+            self._head[0] = pos + length
+
+            row = self._find(h)
+            if row is None:
+                rows = (h % self.slots + self._probe) % self.slots
+                candidates = self._index[rows]
+                free = (candidates['length'] == 0) | (candidates['expires'] < time.time()) | \
+                    (pos + length > candidates['pos'] + self.arena)
+                row = int(rows[np.argmax(free)] if free.any() else rows[np.argmin(candidates['pos'])])
+            self._index[row] = (h, key_hash(key[:1]), key_hash(key[:2]), pos, length, time.time() + ttl)
+        return True
+
+    def invalidate(self, prefix):
+        """Drop the entries under a key prefix and bump the user's generation"""
+        with self._locked(exclusive=True):
+            if not prefix:
+                self._index['length'] = 0
+                self._generations += 1
+                return
+            column = ('user', 'kind', 'key')[min(len(prefix), 3) - 1]
+            self._index['length'][self._index[column] == key_hash(prefix)] = 0
+            self._generations[key_hash(prefix[:1]) % GENERATIONS] += 1
+
+    def clear(self):
+        self.invalidate(())
+
+    @contextmanager
+    def filling(self, key):
+        """Hold the key's fill lock while computing it; yields a value another worker stored meanwhile.
+
+        Yields (value, seconds left) if the value turned up while waiting,
+        else None with the lock held (or, after FILL_WAIT, without it).
+        """
+        offset = self.locks_offset + key_hash(key) % FILL_LOCKS
+        deadline = time.monotonic() + FILL_WAIT
+        locked = False
+        while True:
+            hit = self.get(key)
+            if hit is not None:
+                break
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, offset)
+                locked = True
+            except OSError:
+                if time.monotonic() < deadline:
+                    time.sleep(FILL_POLL)
+                    continue
+                logger.warning(f"Gave up waiting for another worker to fill {key!r}")
+            # Filled between the last miss and taking the lock?
+            hit = self.get(key)
+            break
+        try:
+            yield hit
+        finally:
+            if locked:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, offset)
@@ -0,0 +1,245 @@
+"""Stream service - fans analysis deltas out to open dashboards over Server-Sent Events
+
+One Broadcaster per user polls the (cached / incremental) analysis, diffs it
+against the previous state once, and hands the delta to every subscriber.
+Subscribers hold a single pending slot: if a client has not drained the last
+delta when the next one arrives, the two are merged and the intermediate frame
+is dropped, so a slow browser never queues unbounded updates.
+"""
+import json
+import logging
+import threading
+from app.services.metrics import record_stream_update
+
+logger = logging.getLogger(__name__)
+
+enabled = False
+interval = 1.0
+TOP_N = 5
+
+_broadcasters = {}
+_broadcasters_lock = threading.Lock()
+
+
+def _row(holding):
+    return {
+        'symbol': holding['symbol'],
+        'pnl': round(holding['pnl'], 2),
+        'pnl_percentage': round(holding['pnl_percentage'], 2),
+        'current_value': round(holding['current_value'], 2)
+    }
+
+
+def snapshot(analysis):
+    """The compact slice of an analysis that open dashboards display"""
+    if not analysis:
+        return None
+    return {
+        'totals': {
+            'total_value': round(analysis['total_value'], 2),
+            'total_pnl': round(analysis['total_pnl'], 2),
+            'total_pnl_percentage': round(analysis['total_pnl_percentage'], 2),
+            'holdings_count': analysis['holdings_count'],
+            'sectors_count': len(analysis['sectors'])
+        },
+        'sectors': {
+            name: {'value': round(data['value'], 2), 'pnl': round(data['pnl'], 2), 'count': data['count']}
+            for name, data in analysis['sectors'].items()
+        },
+        'top_gainers': [_row(h) for h in analysis['top_gainers'][:TOP_N]],
+        'top_losers': [_row(h) for h in analysis['top_losers'][:TOP_N]]
+    }
+
+
+def diff(previous, current):
+    """Delta that turns snapshot `previous` into `current` (None when equal)"""
+    if previous is None or current is None:
+        return {'snapshot': current} if previous != current else None
+
+    delta = {}
+    totals = {k: v for k, v in current['totals'].items() if previous['totals'].get(k) != v}
+    if totals:
+        delta['totals'] = totals
+
+    sectors = {k: v for k, v in current['sectors'].items() if previous['sectors'].get(k) != v}
+    sectors.update({k: None for k in previous['sectors'] if k not in current['sectors']})
+    if sectors:
+        delta['sectors'] = sectors
+
+    for ranking in ('top_gainers', 'top_losers'):
+        if current[ranking] != previous[ranking]:
+            delta[ranking] = current[ranking]
+
+    return delta or None
+
+
+def merge(older, newer):
+    """Combine two consecutive deltas into one"""
+    if 'snapshot' in newer:
+        return newer
+    if 'snapshot' in older:
+        return {'snapshot': apply(older['snapshot'], newer)}
+
+    merged = dict(older)
+    for section in ('totals', 'sectors'):
+        if section in newer:
+            merged[section] = {**older.get(section, {}), **newer[section]}
+    for ranking in ('top_gainers', 'top_losers'):
+        if ranking in newer:
+            merged[ranking] = newer[ranking]
+    return merged
+
+
+def apply(state, delta):
+    """Apply a delta to a snapshot (used when merging into a pending snapshot)"""
+    if state is None:
+        return None
+    state = {
+        'totals': {**state['totals'], **delta.get('totals', {})},
+        'sectors': {**state['sectors'], **delta.get('sectors', {})},
+        'top_gainers': delta.get('top_gainers', state['top_gainers']),
+        'top_losers': delta.get('top_losers', state['top_losers'])
+    }
+    state['sectors'] = {k: v for k, v in state['sectors'].items() if v is not None}
+    return state
+
+
+class Subscription:
+    """Single-slot mailbox for one connected dashboard"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = None
+        self.dropped = 0
+        self.closed = False
+
+    def offer(self, delta):
+        with self._cond:
+            if self._pending is None:
+                self._pending = delta
+            else:
+                self._pending = merge(self._pending, delta)
+                self.dropped += 1
+                record_stream_update(False)
+            self._cond.notify()
+
+    def next(self, timeout):
+        """Wait for the next (possibly merged) delta; None on timeout"""
+        with self._cond:
+            if self._pending is None and not self.closed:
+                self._cond.wait(timeout)
+            delta, self._pending = self._pending, None
+            return delta
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+
+class Broadcaster:
+    """Single producer for one user's analysis, shared by all their dashboards"""
+
+    def __init__(self, user_key, loader):
+        self.user_key = user_key
+        self.loader = loader
+        self.state = None
+        self.subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self):
+        """Register a client; returns (subscription, snapshot its deltas apply to)"""
+        initial = snapshot(self.loader()) if self.state is None else None
+        subscription = Subscription()
+        with self._lock:
+            if self.state is None:
+                self.state = initial
+            self.subscribers.add(subscription)
+            state = self.state
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return subscription, state
+
+    def unsubscribe(self, subscription):
+        subscription.close()
+        with self._lock:
+            self.subscribers.discard(subscription)
+
+    def _run(self):
+        try:
+            self._produce()
+        except Exception as e:
+            logger.error(f"Stream producer for {self.user_key} stopped: {e}")
+        finally:
+            with self._lock:
+                # Still ours: the producer died with subscribers attached
+                died = self._thread is threading.current_thread()
+                if died:
+                    self._thread = None
+                    self.state = None
+                    subscribers, self.subscribers = self.subscribers, set()
+            if died:
+                # Their dashboards reconnect, and the next subscribe() starts a new producer
+                for subscription in subscribers:
+                    subscription.close()
+
+    def _produce(self):
+        stop = threading.Event()
+        while not stop.wait(interval):
+            try:
+                current = snapshot(self.loader())
+            except Exception as e:
+                logger.error(f"Stream producer for {self.user_key} failed: {e}")
+                continue
+
+            with self._lock:
+                delta = diff(self.state, current)
+                self.state = current
+                subscribers = list(self.subscribers)
+                if not subscribers:
+                    self._thread = None
+                    return
+
+            if delta:
+                for subscription in subscribers:
+                    subscription.offer(delta)
+
+
+def get_broadcaster(user_key, loader):
+    """The user's broadcaster, created on first use"""
+    with _broadcasters_lock:
+        broadcaster = _broadcasters.get(user_key)
+        if broadcaster is None:
+            broadcaster = _broadcasters[user_key] = Broadcaster(user_key, loader)
+        else:
+            # Pick up the latest credentials after a re-login
+            broadcaster.loader = loader
+        return broadcaster
+
+
+def event_stream(broadcaster, keepalive=15.0):
+    """Yield SSE frames for one client until it disconnects"""
+    subscription, state = broadcaster.subscribe()
+    try:
+        yield f"event: snapshot\ndata: {json.dumps(state)}\n\n"
+
+        while True:
+            delta = subscription.next(keepalive)
+            if delta is None and subscription.closed:
+                return
+            if delta is None:
+                yield ": keepalive\n\n"
+            else:
+                record_stream_update(True)
+                yield f"event: delta\ndata: {json.dumps(delta)}\n\n"
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+
+def init_stream(app):
+    """Configure analysis push from app config"""
+    global enabled, interval
+    enabled = str(app.config.get('STREAM_ENABLED', 'false')).lower() in ('1', 'true', 'yes')
+    interval = float(app.config.get('STREAM_INTERVAL', 1.0))
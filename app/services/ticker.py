@@ -0,0 +1,269 @@
+"""Ticker service - live LTP ingestion from KiteTicker into an in-memory price table
+
+A LiveFeed per user subscribes to the instrument tokens of the user's holdings
+over the Kite WebSocket and writes every tick into a PriceTable. Analyses are
+then advanced from the table's changed prices instead of refetching holdings
+over REST (see portfolio.IncrementalAnalysis).
+
+For local runs set TICKER_REPLAY_FILE to a recording; ReplayTicker plays it
+back through the same callbacks KiteTicker uses.
+"""
+import json
+import logging
+import threading
+import time
+import numpy as np
+from kiteconnect import KiteTicker
+from app.services import records
+
+logger = logging.getLogger(__name__)
+
+enabled = False
+replay_file = None
+replay_speed = 1.0
+# How long an analysis priced from the feed is reused before re-pricing
+refresh_seconds = 1.0
+
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+# Called as listener(user_key, ticks) after every batch is written to the
+# price table, on the ticker's thread; must be quick (see alerts.on_ticks)
+tick_listeners = []
+
+
+class PriceTable:
+    """Array-backed last-price table indexed by instrument token.
+
+    Each token owns a slot in preallocated float64/int64 arrays. A global
+    sequence number is bumped on every write and stamped on the slot, so
+    readers can ask which prices changed since the last time they looked.
+    """
+
+    def __init__(self, capacity=256):
+        self._slots = {}
+        self.tokens = np.zeros(capacity, dtype=np.int64)
+        self.prices = np.full(capacity, np.nan)
+        self.updated_seq = np.zeros(capacity, dtype=np.int64)
+        self.size = 0
+        self.seq = 0
+        self._lock = threading.Lock()
+
+    def add_tokens(self, tokens):
+        """Reserve slots for tokens (existing ones are left alone)"""
+        with self._lock:
+            for token in tokens:
+                if token in self._slots:
+                    continue
+                if self.size == len(self.tokens):
+                    self._grow()
+                self._slots[token] = self.size
+                self.tokens[self.size] = token
+                self.size += 1
+
+    def _grow(self):
+        capacity = len(self.tokens) * 2
+        self.tokens = np.resize(self.tokens, capacity)
+        self.prices = np.concatenate([self.prices, np.full(capacity - len(self.prices), np.nan)])
+        self.updated_seq = np.resize(self.updated_seq, capacity)
+        self.updated_seq[self.size:] = 0
+
+    def update(self, ticks):
+        """Write a batch of ticks ({'instrument_token', 'last_price'} dicts)"""
+        with self._lock:
+            for tick in ticks:
+                slot = self._slots.get(tick.get('instrument_token'))
+                price = tick.get('last_price')
+                if slot is None or price is None:
+                    continue
+                self.seq += 1
+                self.prices[slot] = price
+                self.updated_seq[slot] = self.seq
+
+    def get(self, token):
+        """Last price for a token, or None if no tick has arrived yet"""
+        slot = self._slots.get(token)
+        if slot is None:
+            return None
+        price = self.prices[slot]
+        return None if np.isnan(price) else float(price)
+
+    def lookup(self, tokens):
+        """Last prices for many tokens as a float array (NaN where unknown)"""
+        slots = [self._slots.get(token, -1) for token in tokens]
+        with self._lock:
+            prices = np.append(self.prices[:self.size], np.nan)
+        return prices[slots]
+
+    def changed_since(self, seq):
+        """Return ({token: price} updated after seq, current seq)"""
+        with self._lock:
+            current = self.seq
+            changed = np.nonzero(self.updated_seq[:self.size] > seq)[0]
+            tokens = self.tokens[changed].tolist()
+            prices = self.prices[changed].tolist()
+        return dict(zip(tokens, prices)), current
+
+
+class ReplayTicker:
+    """Local stand-in for KiteTicker that plays back recorded ticks.
+
+    The recording is JSON lines, one frame per line:
+        {"t": <seconds from start>, "ticks": [{"instrument_token": 408065, "last_price": 1523.4}, ...]}
+    """
+
+    MODE_LTP = 'ltp'
+    MODE_QUOTE = 'quote'
+    MODE_FULL = 'full'
+
+    def __init__(self, path, speed=1.0, loop=False):
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.subscribed = set()
+        self.on_connect = None
+        self.on_ticks = None
+        self.on_close = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def connect(self, threaded=False, **kwargs):
+        if threaded:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        else:
+            self._run()
+
+    def subscribe(self, tokens):
+        self.subscribed.update(tokens)
+        return True
+
+    def set_mode(self, mode, tokens):
+        return True
+
+    def unsubscribe(self, tokens):
+        self.subscribed.difference_update(tokens)
+        return True
+
+    def is_connected(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def close(self, code=None, reason=None):
+        self._stop.set()
+
+    def stop(self):
+        self.close()
+
+    def _frames(self):
+        with open(self.path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def _run(self):
+        if self.on_connect:
+            self.on_connect(self, {})
+
+        while not self._stop.is_set():
+            started = time.monotonic()
+            for frame in self._frames():
+                delay = frame.get('t', 0) / self.speed - (time.monotonic() - started)
+                if delay > 0 and self._stop.wait(delay):
+                    break
+                ticks = [t for t in frame.get('ticks', []) if t.get('instrument_token') in self.subscribed]
+                if ticks and self.on_ticks:
+                    self.on_ticks(self, ticks)
+            if not self.loop:
+                break
+
+        if self.on_close:
+            self.on_close(self, 1000, 'replay finished')
+
+
+class LiveFeed:
+    """One WebSocket (or replay) connection feeding a PriceTable"""
+
+    def __init__(self, api_key, access_token, user_key=None):
+        self.user_key = user_key
+        self.prices = PriceTable()
+        self.tokens = set()
+        if replay_file:
+            self.ticker = ReplayTicker(replay_file, speed=replay_speed)
+        else:
+            self.ticker = KiteTicker(api_key, access_token)
+        self.ticker.on_connect = self._on_connect
+        self.ticker.on_ticks = self._on_ticks
+        self.ticker.on_close = self._on_close
+
+    def start(self, tokens):
+        self.subscribe(tokens)
+        self.ticker.connect(threaded=True)
+
+    def subscribe(self, tokens):
+        """Track more instruments; subscribes immediately when already connected"""
+        new_tokens = [t for t in tokens if t is not None and t not in self.tokens]
+        if not new_tokens:
+            return
+        self.prices.add_tokens(new_tokens)
+        self.tokens.update(new_tokens)
+        if self.ticker.is_connected():
+            self.ticker.subscribe(new_tokens)
+            self.ticker.set_mode(self.ticker.MODE_LTP, new_tokens)
+
+    def stop(self):
+        self.ticker.close()
+
+    def _on_connect(self, ws, response):
+        tokens = list(self.tokens)
+        ws.subscribe(tokens)
+        ws.set_mode(ws.MODE_LTP, tokens)
+        logger.info(f"Ticker connected, subscribed to {len(tokens)} instruments")
+
+    def _on_ticks(self, ws, ticks):
+        self.prices.update(ticks)
+        for listener in tick_listeners:
+            try:
+                listener(self.user_key, ticks)
+            except Exception as e:
+                logger.error(f"Tick listener failed: {e}")
+
+    def _on_close(self, ws, code, reason):
+        logger.info(f"Ticker closed: {code} {reason}")
+
+
+def ensure_feed(user_key, api_key, access_token, holdings):
+    """Start (or extend) the user's live feed to cover these holdings"""
+    if not enabled:
+        return None
+
+    tokens = records.values(holdings, 'instrument_token')
+    with _feeds_lock:
+        feed = _feeds.get(user_key)
+        if feed is None:
+            feed = _feeds[user_key] = LiveFeed(api_key, access_token, user_key)
+            feed.start(tokens)
+            return feed
+    feed.subscribe(tokens)
+    return feed
+
+
+def get_feed(user_key):
+    """The user's live feed, if one is running"""
+    return _feeds.get(user_key)
+
+
+def stop_feed(user_key):
+    """Disconnect and forget the user's live feed"""
+    with _feeds_lock:
+        feed = _feeds.pop(user_key, None)
+    if feed:
+        feed.stop()
+
+
+def init_ticker(app):
+    """Configure live price ingestion from app config"""
+    global enabled, replay_file, replay_speed, refresh_seconds
+    enabled = str(app.config.get('TICKER_ENABLED', 'false')).lower() in ('1', 'true', 'yes')
+    replay_file = app.config.get('TICKER_REPLAY_FILE') or None
+    replay_speed = float(app.config.get('TICKER_REPLAY_SPEED', 1.0))
+    refresh_seconds = float(app.config.get('TICKER_REFRESH_SECONDS', 1.0))
@@ -66,3 +66,8 @@ def login_required(f):
                 return redirect(url_for('auth.login'))
         return f(*args, **kwargs)
     return decorated_function
+
+
+def get_user_key():
+    """Key under which the current user's portfolio data is cached"""
+    return session.get('user_id') or session.get('access_token')
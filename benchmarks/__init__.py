@@ -0,0 +1 @@
+"""Benchmarks - synthetic portfolios, local API stand-ins and timing runners"""
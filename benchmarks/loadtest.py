@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""Load-test harness - drives the app under gunicorn against Kite and Resend stand-ins
+
+Usage:
+    python -m benchmarks.loadtest --concurrency 50 --duration 30
+    python -m benchmarks.loadtest --kite-latency 0.4 --kite-failure-rate 0.05 \\
+        --worker-class gthread --workers 2 --mix /=6,/api/portfolio=3,/api/send-email=1
+
+The harness starts the stand-ins in-process, launches `gunicorn wsgi:app -c
+gunicorn.conf.py` with KITE_API_ROOT / RESEND_API_URL pointed at them and a
+stored token so requests are authenticated, then runs closed-loop clients
+for --duration seconds and reports p50/p95/p99 latency, throughput and error
+rate per path.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from benchmarks.standins import KiteStandIn, ResendStandIn
+from benchmarks.synthetic import generate_holdings
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only POST routes need listing; everything else is a GET
+POST_PATHS = {'/api/send-email'}
+
+FRAGMENT_PATTERN = re.compile(r'data-fragment="([^"]+)"')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def parse_mix(mix):
+    """'/=6,/api/portfolio=3' -> [('/', 6.0), ('/api/portfolio', 3.0)]"""
+    weights = []
+    for item in mix.split(','):
+        path, _, weight = item.partition('=')
+        weights.append((path.strip(), float(weight or 1)))
+    return weights
+
+
+def start_gunicorn(args, kite_url, resend_url, workdir, port):
+    env = dict(os.environ,
+               PORT=str(port),
+               KITE_API_KEY='load-key',
+               KITE_API_SECRET='load-secret',
+               KITE_API_ROOT=kite_url,
+               RESEND_API_KEY='re_load',
+               RESEND_API_URL=resend_url,
+               RECIPIENT_EMAIL='load@example.com',
+               CACHE_TTL=str(args.cache_ttl),
+               WEB_CONCURRENCY=str(args.workers),
+               GUNICORN_WORKER_CLASS=args.worker_class,
+               GUNICORN_THREADS=str(args.threads))
+    log = open(os.path.join(workdir, 'gunicorn.log'), 'w')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--pythonpath', REPO_ROOT,
+         '-c', os.path.join(REPO_ROOT, 'gunicorn.conf.py'), 'wsgi:app'],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited early, see {log.name}')
+        try:
+            requests.get(f'{base_url}/metrics', timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn did not become ready within 30s')
+
+
+def run_clients(base_url, mix, concurrency, duration, expand_dashboard, timeout):
+    """Closed-loop clients; returns {path: [(latency, ok), ...]}"""
+    paths, weights = zip(*mix)
+    samples = {path: [] for path in paths}
+    samples_lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def client(seed):
+        rng = random.Random(seed)
+        session = requests.Session()
+        local = []
+        while time.monotonic() < stop_at:
+            path = rng.choices(paths, weights)[0]
+            method = 'POST' if path in POST_PATHS else 'GET'
+            start = time.perf_counter()
+            try:
+                response = session.request(method, base_url + path, timeout=timeout)
+                ok = response.status_code < 400
+                if ok and expand_dashboard and path == '/':
+                    for url in FRAGMENT_PATTERN.findall(response.text):
+                        ok = session.get(base_url + url, timeout=timeout).status_code < 400 and ok
+            except requests.RequestException:
+                ok = False
+            local.append((path, time.perf_counter() - start, ok))
+        with samples_lock:
+            for path, latency, ok in local:
+                samples[path].append((latency, ok))
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def summarize(samples, duration):
+    report = {}
+    all_latencies = []
+    total_errors = 0
+
+    for path, rows in samples.items():
+        latencies = sorted(latency for latency, _ in rows)
+        errors = sum(1 for _, ok in rows if not ok)
+        all_latencies.extend(latencies)
+        total_errors += errors
+        report[path] = {
+            'requests': len(rows),
+            'errors': errors,
+            'error_rate': errors / len(rows) if rows else 0.0,
+            'throughput_rps': len(rows) / duration,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000
+        }
+
+    all_latencies.sort()
+    report['TOTAL'] = {
+        'requests': len(all_latencies),
+        'errors': total_errors,
+        'error_rate': total_errors / len(all_latencies) if all_latencies else 0.0,
+        'throughput_rps': len(all_latencies) / duration,
+        'p50_ms': percentile(all_latencies, 50) * 1000,
+        'p95_ms': percentile(all_latencies, 95) * 1000,
+        'p99_ms': percentile(all_latencies, 99) * 1000
+    }
+    return report
+
+
+def print_report(report):
+    print(f'{"path":<20} {"reqs":>7} {"rps":>8} {"err%":>6} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+    for path, row in report.items():
+        print(f'{path:<20} {row["requests"]:>7} {row["throughput_rps"]:>8.1f} '
+              f'{row["error_rate"] * 100:>6.2f} {row["p50_ms"]:>9.1f} {row["p95_ms"]:>9.1f} '
+              f'{row["p99_ms"]:>9.1f}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Portfolio Reporter load test')
+    parser.add_argument('--concurrency', type=int, default=20, help='Concurrent clients')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds to run')
+    parser.add_argument('--mix', default='/=6,/api/portfolio=3,/api/send-email=1',
+                        help='Weighted paths, e.g. /=6,/api/portfolio=3,/api/send-email=1')
+    parser.add_argument('--expand-dashboard', action='store_true',
+                        help='Also fetch every dashboard fragment as part of a / page view')
+    parser.add_argument('--holdings', type=int, default=50, help='Holdings served by the Kite stand-in')
+    parser.add_argument('--kite-latency', type=float, default=0.2)
+    parser.add_argument('--kite-failure-rate', type=float, default=0.0)
+    parser.add_argument('--resend-latency', type=float, default=0.3)
+    parser.add_argument('--resend-failure-rate', type=float, default=0.0)
+    parser.add_argument('--cache-ttl', type=int, default=60, help='CACHE_TTL for the app (0 disables)')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--worker-class', default='gevent', choices=['gevent', 'gthread', 'sync'])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--timeout', type=float, default=30, help='Client request timeout')
+    parser.add_argument('--output', help='Write the report as JSON')
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = tempfile.mkdtemp(prefix='portfolio-load-')
+    os.chdir(workdir)
+
+    # Authenticate every client through the stored-token path of login_required
+    sys.path.insert(0, REPO_ROOT)
+    from app.services.token_manager import save_token
+    save_token('load-token', 'LOAD01')
+
+    kite = KiteStandIn(generate_holdings(args.holdings), latency=args.kite_latency,
+                       failure_rate=args.kite_failure_rate)
+    resend = ResendStandIn(latency=args.resend_latency, failure_rate=args.resend_failure_rate)
+
+    with kite, resend:
+        process, base_url = start_gunicorn(args, kite.url, resend.url, workdir, free_port())
+        try:
+            print(f'Driving {base_url} with {args.concurrency} clients for {args.duration:.0f}s '
+                  f'({args.worker_class} x{args.workers})')
+            samples = run_clients(base_url, parse_mix(args.mix), args.concurrency,
+                                  args.duration, args.expand_dashboard, args.timeout)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    report = summarize(samples, args.duration)
+    print_report(report)
+    print(f'Kite stand-in calls: {kite.calls}, Resend stand-in sends: {resend.sent}')
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'args': vars(args), 'report': report}, f, indent=2)
+        print(f'Report written to {output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""Benchmark runner - times the analysis, chart, email and dashboard paths
+
+Usage:
+    python -m benchmarks.run                          # all sizes, results to bench_results.json
+    python -m benchmarks.run --sizes 10,1000 --repeat 3
+    python -m benchmarks.run --output new.json --compare old.json
+
+Kite is replaced by a local stand-in (benchmarks.standins.KiteStandIn), so
+runs are offline and repeatable. The memory_* cases report traced memory in
+MB (tracemalloc) instead of seconds. Results are written as JSON; --compare
+reports the median ratio per case against an earlier run and exits non-zero
+when anything regressed by more than --threshold.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime
+
+import numpy as np
+
+from benchmarks.standins import KiteStandIn
+from benchmarks.synthetic import (SIZES, generate_holdings, generate_trades, write_tradebook,
+                                  generate_scenarios, generate_alert_rules)
+
+
+def measure(func, repeat):
+    """Run func `repeat` times and summarize wall-clock seconds"""
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return {
+        'min': min(runs),
+        'median': statistics.median(runs),
+        'mean': statistics.fmean(runs),
+        'runs': runs
+    }
+
+
+def memory_stats(size):
+    mb = size / 2 ** 20
+    return {'min': mb, 'median': mb, 'mean': mb, 'runs': [mb], 'unit': 'MB'}
+
+
+def measure_memory(func):
+    """Traced memory of one func() call: (peak while it ran, retained by its result)"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return memory_stats(peak), memory_stats(retained)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def make_client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['access_token'] = 'bench-token'
+        session['user_id'] = 'BENCH01'
+    return client
+
+
+def dashboard_urls(client):
+    """Fragments the dashboard shell asks the browser to load"""
+    html = client.get('/').get_data(as_text=True)
+    return re.findall(r'data-fragment="([^"]+)"', html)
+
+
+def seed_history(history, days=365, step=300):
+    """A year of 5-minute portfolio totals for one user; returns the user key"""
+    now = int(time.time())
+    rows = [('bench-history', now - i * step, 1e6 + i, 1e5, 50) for i in range(days * 86400 // step)]
+    conn = history.get_connection()
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO portfolio_history VALUES (?, ?, ?, ?, ?)', rows)
+    return 'bench-history'
+
+
+def float_analyze(holdings):
+    """analyze() as a per-holding Python float loop, the way it worked before
+    money moved to int64 units; the reference for analyze_sectors_only"""
+    analysis = {'total_value': 0, 'total_pnl': 0, 'sectors': {}, 'top_gainers': [], 'top_losers': []}
+    for holding in holdings:
+        quantity = holding.get('quantity', 0)
+        current_value = quantity * holding.get('last_price', 0)
+        invested_value = quantity * holding.get('average_price', 0)
+        pnl = current_value - invested_value
+        analysis['total_value'] += current_value
+        analysis['total_pnl'] += pnl
+
+        sector = analysis['sectors'].setdefault(holding.get('sector', 'Unknown'),
+                                                {'value': 0, 'pnl': 0, 'count': 0})
+        sector['value'] += current_value
+        sector['pnl'] += pnl
+        sector['count'] += 1
+
+        holding_info = {
+            'symbol': holding.get('tradingsymbol', 'Unknown'),
+            'pnl': pnl,
+            'pnl_percentage': (pnl / invested_value * 100) if invested_value > 0 else 0,
+            'current_value': current_value
+        }
+        (analysis['top_gainers'] if pnl > 0 else analysis['top_losers']).append(holding_info)
+
+    analysis['top_gainers'].sort(key=lambda x: x['pnl'], reverse=True)
+    analysis['top_losers'].sort(key=lambda x: x['pnl'])
+    return analysis
+
+
+def run_benchmarks(sizes, repeat, log=print):
+    from app import create_app
+    from app.services.cache import portfolio_cache
+    from app.services.charts import CHART_BUILDERS
+    from app.services.email import generate_email_content
+    from app.services.portfolio import PortfolioService, IncrementalAnalysis
+    from app.services.scheduler import shutdown_scheduler
+    from app.services import history, returns, portfolio
+    from app.services.scenarios import run_scenarios
+    from app.services import correlation, alerts
+    from app.services.holdings import HoldingsTable
+    from app.services import fragments, export
+    from app.services.shared_cache import SharedCache
+    from app.routes.dashboard import FRAGMENTS
+    from flask import render_template
+
+    results = {}
+
+    def record(case, size, stats):
+        results.setdefault(case, {})[str(size)] = stats
+        if stats.get('unit') == 'MB':
+            log(f'{case:<28} {size:>8}         {stats["median"]:10.2f} MB')
+            return
+        log(f'{case:<28} {size:>8}  median {stats["median"] * 1000:10.2f} ms  '
+            f'min {stats["min"] * 1000:10.2f} ms')
+
+    with KiteStandIn([]) as kite:
+        os.environ['KITE_API_KEY'] = 'bench-key'
+        os.environ['KITE_API_ROOT'] = kite.url
+        app = create_app()
+        client = make_client(app)
+        fragment_urls = dashboard_urls(client)
+        history_user = seed_history(history)
+
+        try:
+            # Fixed shape, independent of --sizes: 10k scenarios against 2k holdings
+            scenario_book = generate_holdings(2000)
+            scenario_specs = generate_scenarios(scenario_book, 10000)
+            record('scenarios_10k', len(scenario_book),
+                   measure(lambda: run_scenarios(scenario_book, scenario_specs), repeat))
+
+            # A year of daily returns for 1k holdings, then one day rolled in
+            correlation_book = generate_holdings(1000)
+            correlation_days = iter(range(10 ** 6))
+            returns_rng = random.Random(42)
+            store = correlation.CorrelationStore(correlation._user_dir('bench-correlation'))
+            store.load_days([f'seed-{d}' for d in range(correlation.window)],
+                            [h['tradingsymbol'] for h in correlation_book],
+                            np.array([[returns_rng.gauss(0, 0.015) for _ in correlation_book]
+                                      for _ in range(correlation.window)], dtype=np.float32))
+            store.save()
+
+            def correlation_update():
+                book = [dict(h, close_price=h['last_price'] / (1 + returns_rng.gauss(0, 0.015)))
+                        for h in correlation_book]
+                correlation.update('bench-correlation', book, date.fromordinal(700000 + next(correlation_days)))
+
+            record('correlation_update', len(correlation_book), measure(correlation_update, repeat))
+
+            # 10k alert rules on 2k holdings, then 10k ticks of up to 1% each
+            alert_holdings = generate_holdings(2000)
+            alert_book = alerts.AlertBook([alerts.parse_rule(spec)
+                                           for spec in generate_alert_rules(alert_holdings, 10000)],
+                                          None, alert_holdings)
+            tick_rng = random.Random(42)
+            alert_ticks = [(h['instrument_token'], round(h['last_price'] * tick_rng.uniform(0.99, 1.01), 2))
+                           for h in tick_rng.choices(alert_holdings, k=10000)]
+            record('alerts_10k_ticks', len(alert_holdings),
+                   measure(lambda: alert_book.check_prices(alert_ticks), repeat))
+
+            for size in sizes:
+                holdings = generate_holdings(size)
+                kite.set_holdings(holdings)
+                analysis = PortfolioService.analyze(holdings)
+
+                record('analyze', size, measure(lambda: PortfolioService.analyze(holdings), repeat))
+                # Sectors only, the same work as the float loop analyze() used to run
+                group_by, portfolio.group_by = portfolio.group_by, ()
+                record('analyze_sectors_only', size, measure(lambda: PortfolioService.analyze(holdings), repeat))
+                # The int64 array path on its own, which analyze() skips for books up to SMALL_BOOK
+                record('analyze_sectors_only_indexed', size,
+                       measure(lambda: PortfolioService._analyze(holdings, portfolio.analysis_top_n), repeat))
+                portfolio.group_by = group_by
+                record('analyze_float_loop', size, measure(lambda: float_analyze(holdings), repeat))
+
+                # A refresh where three instruments ticked, against a book built once
+                book = IncrementalAnalysis(holdings)
+                movers = [h['instrument_token'] for h in holdings[:3]]
+                ticks = iter(range(1, 10 ** 9))
+
+                def incremental_refresh():
+                    bump = 1 + next(ticks) % 7 / 1000
+                    book.update_prices({token: 100.0 * bump for token in movers})
+                    book.to_analysis(top_n=5)
+
+                record('incremental_update_3', size, measure(incremental_refresh, repeat))
+
+                # Memory: holdings as cached after a Kite fetch, the live book, one analysis
+                peak, retained = measure_memory(lambda: PortfolioService('bench-key', 'bench-token').fetch_holdings())
+                record('memory_holdings_fetch_peak', size, peak)
+                record('memory_holdings_cached', size, retained)
+                fetched = PortfolioService('bench-key', 'bench-token').fetch_holdings()
+                record('memory_live_book', size, measure_memory(lambda: IncrementalAnalysis(fetched))[1])
+                record('memory_analyze_peak', size, measure_memory(lambda: PortfolioService.analyze(fetched))[0])
+                del fetched
+
+                # Holdings table: build, then pages under a two-key sort and a prefix search.
+                # Each page is taken from a fresh table so the sort is paid every time;
+                # the _cached cases reuse one table, as repeated requests do
+                record('holdings_table_build', size, measure(lambda: HoldingsTable(holdings), repeat))
+                record('holdings_page_sorted', size,
+                       measure(lambda: HoldingsTable(holdings).query(sort='sector,-pnl', limit=50), repeat))
+                table = HoldingsTable(holdings)
+                second_page = table.query(sort='sector,-pnl', limit=50)['next_cursor']
+                record('holdings_page_cursor_cached', size,
+                       measure(lambda: table.query(sort='sector,-pnl', limit=50, cursor=second_page), repeat))
+                record('holdings_prefix_cached', size,
+                       measure(lambda: table.query(q='IN', side='gainers', limit=50), repeat))
+                positions = table.positions()
+                # The whole book, streamed and consumed as a client would
+                record('export_csv', size, measure(lambda: sum(map(len, export.stream(table, 'csv'))), repeat))
+
+                for name, builder in CHART_BUILDERS.items():
+                    record(f'chart_{name}', size, measure(lambda: builder(analysis), repeat))
+
+                # Every dashboard section rendered afresh, then served from the fragment cache
+                def render_sections():
+                    with app.test_request_context():
+                        for name, template in FRAGMENTS.items():
+                            fragments.section(name, analysis, lambda: render_template(template, analysis=analysis))
+
+                def render_sections_cold():
+                    fragments.fragment_cache.clear()
+                    render_sections()
+
+                record('render_sections_cold', size, measure(render_sections_cold, repeat))
+                record('render_sections_cached', size, measure(render_sections, repeat))
+
+                # Another worker's analysis, read back from the shared tier
+                shared = SharedCache(os.path.join(tempfile.mkdtemp(), 'shared.cache'), 64 * 1024 * 1024)
+                shared.set(('bench-shared', 'analysis'), analysis, 600)
+                record('shared_cache_get_analysis', size,
+                       measure(lambda: shared.get(('bench-shared', 'analysis')), repeat))
+
+                record('generate_email_content', size,
+                       measure(lambda: generate_email_content(analysis), repeat))
+
+                tradebook = os.path.join(tempfile.mkdtemp(), 'tradebook.csv')
+                write_tradebook(tradebook, generate_trades(holdings))
+                flows = returns.parse_tradebook([tradebook])
+                record('xirr', size, measure(lambda: returns.compute_xirr(holdings, flows), repeat))
+
+                stamps = iter(range(10 ** 9))
+                record('history_write', size,
+                       measure(lambda: history.write('bench-write', analysis, next(stamps), positions), repeat))
+                record('history_last_day', size,
+                       measure(lambda: history.portfolio_series(history_user, days=1), repeat))
+                record('history_year_200_points', size,
+                       measure(lambda: history.portfolio_series(history_user, days=365, max_points=200),
+                               repeat))
+
+                def dashboard_cold():
+                    portfolio_cache.clear()
+                    fragments.fragment_cache.clear()
+                    client.get('/')
+                    for url in fragment_urls:
+                        response = client.get(url)
+                        assert response.status_code == 200, (url, response.status_code)
+
+                def dashboard_warm():
+                    client.get('/')
+                    for url in fragment_urls:
+                        client.get(url)
+
+                record('dashboard_index_cold', size, measure(dashboard_cold, repeat))
+                record('dashboard_index_warm', size, measure(dashboard_warm, repeat))
+        finally:
+            shutdown_scheduler()
+
+    return results
+
+
+def compare(current, baseline, threshold):
+    """Print per-case median ratios; return the list of regressions"""
+    regressions = []
+    for case, by_size in current['results'].items():
+        for size, stats in by_size.items():
+            old = baseline.get('results', {}).get(case, {}).get(size)
+            if not old:
+                continue
+            ratio = stats['median'] / old['median'] if old['median'] else float('inf')
+            flag = ''
+            if ratio > 1 + threshold:
+                flag = '  REGRESSION'
+                regressions.append((case, size, ratio))
+            print(f'{case:<28} {size:>8}  {ratio:6.2f}x{flag}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Portfolio Reporter benchmark suite')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in SIZES),
+                        help='Comma separated holdings counts')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per case')
+    parser.add_argument('--output', default='bench_results.json', help='Where to write results')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Allowed median slowdown before flagging a regression')
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+    revision = git_revision()
+
+    # The app writes token/lock files relative to the working directory
+    workdir = tempfile.mkdtemp(prefix='portfolio-bench-')
+    os.chdir(workdir)
+
+    results = run_benchmarks(sizes, args.repeat)
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': revision,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat
+        },
+        'results': results
+    }
+
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {output}')
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regression(s) above {args.threshold:.0%}')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""Soak test - renders the dashboard thousands of times and checks memory stays flat
+
+Usage:
+    python -m benchmarks.soak                               # 10k renders of 50 holdings
+    python -m benchmarks.soak --iterations 2000 --holdings 1000 --max-growth-mb 10
+
+Each iteration loads the dashboard shell and every fragment it lists through
+the Flask test client, against the Kite stand-in. Every --rebuild-every
+iterations the stand-in's prices move and the caches are dropped, so the
+analysis, the charts and the fragments are built again instead of served
+from cache. After --warmup iterations (imports, template compilation and
+allocator pools settled) RSS and tracemalloc's traced memory are sampled;
+the run fails if either grew by more than --max-growth-mb, or if figures
+were left alive.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.run import make_client, dashboard_urls
+from benchmarks.standins import KiteStandIn
+from benchmarks.synthetic import generate_holdings
+
+MB = 2 ** 20
+
+
+def moved(holdings, step):
+    """The holdings with every price nudged, different for each step"""
+    factor = 1 + ((step % 7) - 3) / 100
+    return [dict(h, last_price=round(h['last_price'] * factor, 2)) for h in holdings]
+
+
+def sample(iteration, started):
+    from app.services import charts, memory
+    from app.services.cache import portfolio_cache
+    from app.services.fragments import fragment_cache
+    gc.collect()
+    return {
+        'iteration': iteration,
+        'seconds': round(time.perf_counter() - started, 1),
+        'rss_mb': round(memory.rss_bytes() / MB, 2),
+        'traced_mb': round(tracemalloc.get_traced_memory()[0] / MB, 2) if tracemalloc.is_tracing() else None,
+        'live_figures': charts.live_figures(),
+        'cached_entries': len(portfolio_cache) + len(fragment_cache)
+    }
+
+
+def print_sample(s):
+    traced = f"{s['traced_mb']:9.2f}" if s['traced_mb'] is not None else f"{'-':>9}"
+    print(f"{s['iteration']:>9}  {s['seconds']:>8.1f}s  rss {s['rss_mb']:9.2f} MB  traced {traced} MB  "
+          f"figures {s['live_figures']:>3}  cached {s['cached_entries']:>5}")
+
+
+def run_soak(args):
+    from app import create_app
+    from app.services.cache import portfolio_cache
+    from app.services.fragments import fragment_cache
+    from app.services.scheduler import shutdown_scheduler
+
+    holdings = generate_holdings(args.holdings)
+    samples = []
+    with KiteStandIn(holdings) as kite:
+        os.environ['KITE_API_KEY'] = 'soak-key'
+        os.environ['KITE_API_ROOT'] = kite.url
+        app = create_app()
+        client = make_client(app)
+        urls = ['/'] + dashboard_urls(client)
+        if args.trace:
+            # Started before the baseline so its own overhead is part of it
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            for iteration in range(1, args.iterations + 1):
+                if iteration % args.rebuild_every == 0:
+                    kite.set_holdings(moved(holdings, iteration // args.rebuild_every))
+                    portfolio_cache.clear()
+                    fragment_cache.clear()
+                for url in urls:
+                    response = client.get(url)
+                    if response.status_code != 200:
+                        raise RuntimeError(f'{url} returned {response.status_code}')
+                since_warmup = iteration - args.warmup
+                if since_warmup >= 0 and since_warmup % args.sample_every == 0 or iteration == args.iterations:
+                    samples.append(sample(iteration, started))
+                    print_sample(samples[-1])
+        finally:
+            tracemalloc.stop()
+            shutdown_scheduler()
+    return samples
+
+
+def check(samples, max_growth_mb):
+    """Failure messages; empty when memory stayed flat"""
+    if len(samples) < 2:
+        return ['Too few samples: raise --iterations or lower --warmup']
+    first, last = samples[0], samples[-1]
+    failures = []
+    for field in ('rss_mb', 'traced_mb'):
+        if first[field] is None:
+            continue
+        growth = last[field] - first[field]
+        print(f"{field[:-3]} growth: {growth:+.2f} MB over {last['iteration'] - first['iteration']} iterations")
+        if growth > max_growth_mb:
+            failures.append(f'{field[:-3]} grew {growth:.2f} MB (limit {max_growth_mb:g} MB)')
+    if last['live_figures']:
+        failures.append(f"{last['live_figures']} figure(s) still alive")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Portfolio Reporter memory soak test')
+    parser.add_argument('--iterations', type=int, default=10000, help='Dashboard renders')
+    parser.add_argument('--holdings', type=int, default=50, help='Holdings served by the Kite stand-in')
+    parser.add_argument('--rebuild-every', type=int, default=25,
+                        help='Renders between price moves (which rebuild analysis, charts and fragments)')
+    parser.add_argument('--warmup', type=int, default=500, help='Renders before the baseline sample')
+    parser.add_argument('--sample-every', type=int, default=1000, help='Renders between samples')
+    parser.add_argument('--max-growth-mb', type=float, default=20, help='Allowed growth after warm-up')
+    parser.add_argument('--no-trace', dest='trace', action='store_false',
+                        help='Skip tracemalloc (faster, RSS only)')
+    parser.add_argument('--output', help='Write the samples as JSON')
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output) if args.output else None
+    # The app writes token/lock/history files relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='portfolio-soak-'))
+
+    samples = run_soak(args)
+    failures = check(samples, args.max_growth_mb)
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'args': vars(args), 'samples': samples, 'failures': failures}, f, indent=2)
+        print(f'Samples written to {output}')
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
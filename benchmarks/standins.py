@@ -0,0 +1,227 @@
+"""Local HTTP stand-ins for the external APIs the app talks to
+
+Each stand-in runs a ThreadingHTTPServer on a free localhost port in a
+background thread. Point the app at them with KITE_API_ROOT=<kite url> and
+RESEND_API_URL=<resend url>. Every stand-in can add latency and fail a share
+of requests to mimic a slow or flaky upstream. sample_postback() and
+post_postback() play Kite's side of order postbacks against a running app.
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from benchmarks.synthetic import generate_candles
+
+
+class _Server(ThreadingHTTPServer):
+    # Load tests open hundreds of connections at once
+    request_queue_size = 512
+    daemon_threads = True
+
+
+class StandInServer:
+    """Background HTTP server; subclasses implement handle() and error_response()
+
+    - `latency` is seconds added to every response, with +/- `jitter` seconds
+    - `failure_rate` is the share of requests answered with error_response()
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, failure_rate=0.0, seed=None):
+        stand_in = self
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _dispatch(self, method):
+                parsed = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                status, content_type, payload = stand_in.respond(
+                    method, parsed.path, parse_qs(parsed.query), body, self.headers
+                )
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', content_type)
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up first (e.g. the app's Kite timeout fired)
+                    self.close_connection = True
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = _Server((host, port), Handler)
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def respond(self, method, path, query, body, headers):
+        """Apply the configured latency and failure rate, then dispatch"""
+        with self._rng_lock:
+            delay = self.latency + (self._rng.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+            fail = self._rng.random() < self.failure_rate
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            return self.error_response()
+        return self.handle(method, path, query, body, headers)
+
+    def handle(self, method, path, query, body, headers):
+        raise NotImplementedError
+
+    def error_response(self):
+        return self.json_response({'message': 'Injected failure'}, status=503)
+
+    @staticmethod
+    def json_response(payload, status=200):
+        return status, 'application/json', json.dumps(payload).encode()
+
+
+class KiteStandIn(StandInServer):
+    """Serves /portfolio/holdings and daily /instruments/historical candles"""
+
+    def __init__(self, holdings, seed=42, **kwargs):
+        super().__init__(seed=seed, **kwargs)
+        self.seed = seed
+        self.set_holdings(holdings)
+        self.calls = {'holdings': 0, 'historical': 0}
+
+    def set_holdings(self, holdings):
+        # Pre-serialize once so the stand-in is never the bottleneck being measured
+        self.holdings = holdings
+        self._holdings_body = json.dumps({'status': 'success', 'data': holdings}).encode()
+
+    def handle(self, method, path, query, body, headers):
+        if path == '/portfolio/holdings':
+            self.calls['holdings'] += 1
+            return 200, 'application/json', self._holdings_body
+
+        if path.startswith('/instruments/historical/'):
+            self.calls['historical'] += 1
+            return self.json_response({'status': 'success', 'data': {'candles': self.candles(path, query)}})
+
+        return self.json_response({'status': 'error', 'error_type': 'GeneralException',
+                                   'message': f'Route not found: {path}'}, status=404)
+
+    def error_response(self):
+        return self.json_response({'status': 'error', 'error_type': 'NetworkException',
+                                   'message': 'Injected upstream failure'}, status=503)
+
+    def candles(self, path, query):
+        instrument_token = int(path.split('/')[3])
+        start = date.fromisoformat(query['from'][0][:10])
+        end = date.fromisoformat(query['to'][0][:10])
+        days = (end - start).days + 1
+
+        rows = []
+        for day, open_price, high, low, close, volume in generate_candles(instrument_token, days, self.seed):
+            stamp = datetime.combine(start + timedelta(days=day), datetime.min.time())
+            rows.append([stamp.strftime('%Y-%m-%dT%H:%M:%S+0530'), open_price, high, low, close, volume])
+        return rows
+
+
+class ResendStandIn(StandInServer):
+    """Accepts POST /emails like the Resend API and keeps the sent payloads"""
+
+    def __init__(self, keep_messages=False, **kwargs):
+        super().__init__(**kwargs)
+        self.keep_messages = keep_messages
+        self.messages = []
+        self.sent = 0
+
+    def handle(self, method, path, query, body, headers):
+        if method == 'POST' and path == '/emails':
+            self.sent += 1
+            if self.keep_messages:
+                self.messages.append(json.loads(body or b'{}'))
+            return self.json_response({'id': str(uuid.uuid4())})
+
+        return self.json_response({'statusCode': 404, 'name': 'not_found',
+                                   'message': f'Route not found: {path}'}, status=404)
+
+    def error_response(self):
+        return self.json_response({'statusCode': 500, 'name': 'application_error',
+                                   'message': 'Injected upstream failure'}, status=500)
+
+
+def sample_postback(api_secret, holding, user_id='LOAD01', transaction_type='BUY', quantity=1,
+                    price=None, status='COMPLETE', product='CNC', order_id=None):
+    """A signed Kite order postback for a fill on `holding` (a Kite holdings row)"""
+    order_id = order_id or str(uuid.uuid4().int)[:15]
+    order_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    price = holding['last_price'] if price is None else price
+    filled = quantity if status == 'COMPLETE' else 0
+    checksum = hashlib.sha256(f'{order_id}{order_timestamp}{api_secret}'.encode()).hexdigest()
+
+    return {
+        'user_id': user_id,
+        'app_id': 1,
+        'order_id': order_id,
+        'exchange_order_id': str(uuid.uuid4().int)[:16],
+        'status': status,
+        'status_message': None,
+        'order_timestamp': order_timestamp,
+        'exchange_timestamp': order_timestamp,
+        'variety': 'regular',
+        'exchange': holding.get('exchange', 'NSE'),
+        'tradingsymbol': holding['tradingsymbol'],
+        'instrument_token': holding['instrument_token'],
+        'order_type': 'MARKET',
+        'transaction_type': transaction_type,
+        'validity': 'DAY',
+        'product': product,
+        'quantity': quantity,
+        'price': 0,
+        'trigger_price': 0,
+        'average_price': price if filled else 0,
+        'filled_quantity': filled,
+        'pending_quantity': quantity - filled,
+        'cancelled_quantity': 0,
+        'checksum': checksum
+    }
+
+
+def post_postback(app_url, payload, timeout=10):
+    """POST a postback to a running app the way Kite does (raw JSON body)"""
+    response = requests.post(f'{app_url}/api/postback', data=json.dumps(payload),
+                             headers={'Content-Type': 'application/json'}, timeout=timeout)
+    return response.status_code, response.json()
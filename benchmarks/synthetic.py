@@ -0,0 +1,187 @@
+"""Synthetic portfolio generator - Kite-shaped holdings with realistic symbols and sectors"""
+import csv
+import json
+import random
+from datetime import date, timedelta
+
+# Representative NSE listings per sector; larger books reuse them with a series suffix
+SECTOR_SYMBOLS = {
+    'IT': ['TCS', 'INFY', 'WIPRO', 'HCLTECH', 'TECHM', 'LTIM', 'PERSISTENT', 'COFORGE', 'MPHASIS'],
+    'Banking': ['HDFCBANK', 'ICICIBANK', 'SBIN', 'KOTAKBANK', 'AXISBANK', 'INDUSINDBK', 'BANKBARODA',
+                'PNB', 'FEDERALBNK', 'IDFCFIRSTB'],
+    'Financial Services': ['BAJFINANCE', 'BAJAJFINSV', 'HDFCLIFE', 'SBILIFE', 'ICICIGI', 'CHOLAFIN',
+                           'MUTHOOTFIN'],
+    'FMCG': ['HINDUNILVR', 'ITC', 'NESTLEIND', 'BRITANNIA', 'DABUR', 'MARICO', 'GODREJCP', 'TATACONSUM'],
+    'Pharma': ['SUNPHARMA', 'DRREDDY', 'CIPLA', 'DIVISLAB', 'LUPIN', 'AUROPHARMA', 'TORNTPHARM'],
+    'Auto': ['MARUTI', 'TATAMOTORS', 'M&M', 'BAJAJ-AUTO', 'HEROMOTOCO', 'EICHERMOT', 'TVSMOTOR'],
+    'Energy': ['RELIANCE', 'ONGC', 'NTPC', 'POWERGRID', 'BPCL', 'IOC', 'GAIL', 'TATAPOWER', 'ADANIGREEN'],
+    'Metals': ['TATASTEEL', 'JSWSTEEL', 'HINDALCO', 'VEDL', 'SAIL', 'NMDC', 'JINDALSTEL'],
+    'Cement': ['ULTRACEMCO', 'SHREECEM', 'AMBUJACEM', 'ACC', 'DALBHARAT'],
+    'Telecom': ['BHARTIARTL', 'IDEA', 'INDUSTOWER'],
+    'Infrastructure': ['LT', 'ADANIPORTS', 'GMRINFRA', 'IRB'],
+    'Consumer Durables': ['TITAN', 'ASIANPAINT', 'HAVELLS', 'VOLTAS', 'BERGEPAINT'],
+    'ETF': ['NIFTYBEES', 'BANKBEES', 'GOLDBEES', 'ITBEES', 'LIQUIDBEES'],
+}
+
+UNIVERSE = [(symbol, sector) for sector, symbols in SECTOR_SYMBOLS.items() for symbol in symbols]
+
+SIZES = (10, 1000, 10000, 100000)
+
+
+def generate_holdings(count, seed=42):
+    """Generate `count` holdings shaped like KiteConnect.holdings() rows"""
+    rng = random.Random(seed)
+    holdings = []
+
+    for i in range(count):
+        base_symbol, sector = UNIVERSE[i % len(UNIVERSE)]
+        series = i // len(UNIVERSE)
+        symbol = base_symbol if series == 0 else f'{base_symbol}-S{series}'
+
+        average_price = round(rng.lognormvariate(6.5, 1.0), 2)
+        # Daily-ish drift around the cost basis, skewed slightly positive
+        last_price = round(average_price * rng.lognormvariate(0.03, 0.25), 2)
+        close_price = round(last_price / (1 + rng.gauss(0, 0.015)), 2)
+        quantity = rng.choice([1, 2, 5, 10, 15, 25, 40, 50, 75, 100, 150, 250, 500])
+
+        holdings.append({
+            'tradingsymbol': symbol,
+            'exchange': 'BSE' if rng.random() < 0.15 else 'NSE',
+            'instrument_token': 100000 + i,
+            'isin': f'INE{i:06d}01{i % 10}',
+            'product': 'CNC',
+            'quantity': quantity,
+            't1_quantity': 0,
+            'average_price': average_price,
+            'last_price': last_price,
+            'close_price': close_price,
+            'pnl': round((last_price - average_price) * quantity, 2),
+            'day_change': round(last_price - close_price, 2),
+            'day_change_percentage': round((last_price - close_price) / close_price * 100, 4),
+            'sector': sector,
+        })
+
+    return holdings
+
+
+def generate_candles(instrument_token, days, seed=42):
+    """Daily OHLCV candles for one instrument, as Kite's historical endpoint returns them"""
+    rng = random.Random(seed * 1000003 + instrument_token)
+    price = rng.lognormvariate(6.5, 1.0)
+    candles = []
+
+    for day in range(days):
+        open_price = price
+        close = max(1.0, open_price * (1 + rng.gauss(0.0004, 0.015)))
+        high = max(open_price, close) * (1 + abs(rng.gauss(0, 0.005)))
+        low = min(open_price, close) * (1 - abs(rng.gauss(0, 0.005)))
+        candles.append((day, round(open_price, 2), round(high, 2), round(low, 2), round(close, 2),
+                        rng.randint(10_000, 5_000_000)))
+        price = close
+
+    return candles
+
+
+def write_tick_recording(path, holdings, frames=100, interval=0.5, movers=0.05, seed=42):
+    """Write a ReplayTicker recording: every `interval` seconds a share of instruments tick"""
+    rng = random.Random(seed)
+    prices = {h['instrument_token']: h['last_price'] for h in holdings}
+    tokens = list(prices)
+    per_frame = max(1, int(len(tokens) * movers))
+
+    with open(path, 'w') as f:
+        for frame in range(frames):
+            ticks = []
+            for token in rng.sample(tokens, min(per_frame, len(tokens))):
+                prices[token] = round(prices[token] * (1 + rng.gauss(0, 0.002)), 2)
+                ticks.append({'instrument_token': token, 'last_price': prices[token]})
+            f.write(json.dumps({'t': round(frame * interval, 3), 'ticks': ticks}) + '\n')
+
+
+def generate_trades(holdings, years=3, seed=42, today=None):
+    """Buy lots (plus the odd partial sell) that add up to each holding's quantity.
+
+    Rows are shaped like a Kite Console tradebook export.
+    """
+    rng = random.Random(seed)
+    today = today or date.today()
+    trades = []
+
+    for holding in holdings:
+        quantity = holding['quantity']
+        lots = rng.randint(1, min(5, quantity))
+        cuts = sorted(rng.sample(range(1, quantity), lots - 1)) if lots > 1 else []
+        sizes = [b - a for a, b in zip([0] + cuts, cuts + [quantity])]
+        price = holding['average_price']
+
+        for size in sizes:
+            day = today - timedelta(days=rng.randint(1, years * 365))
+            trades.append({'symbol': holding['tradingsymbol'], 'trade_date': day.isoformat(),
+                           'trade_type': 'buy', 'quantity': size,
+                           'price': round(price * rng.uniform(0.9, 1.1), 2)})
+        if rng.random() < 0.1:
+            day = today - timedelta(days=rng.randint(1, 30))
+            extra = rng.randint(1, 10)
+            trades.append({'symbol': holding['tradingsymbol'], 'trade_date': day.isoformat(),
+                           'trade_type': 'buy', 'quantity': extra, 'price': price})
+            trades.append({'symbol': holding['tradingsymbol'], 'trade_date': day.isoformat(),
+                           'trade_type': 'sell', 'quantity': extra,
+                           'price': round(price * rng.uniform(0.95, 1.05), 2)})
+
+    trades.sort(key=lambda t: t['trade_date'])
+    return trades
+
+
+def write_tradebook(path, trades):
+    """Write trades as a tradebook CSV (the columns the app reads)"""
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['symbol', 'trade_date', 'trade_type', 'quantity', 'price'])
+        writer.writeheader()
+        writer.writerows(trades)
+
+
+def generate_scenarios(holdings, count, seed=42):
+    """Scenario dicts for /api/scenarios: a market move, a few sector moves, the odd
+    single-stock shock and rebalance"""
+    rng = random.Random(seed)
+    sectors = sorted({h['sector'] for h in holdings})
+    symbols = [h['tradingsymbol'] for h in holdings]
+    scenarios = []
+
+    for n in range(count):
+        scenario = {
+            'name': f'Scenario {n + 1}',
+            'market': round(rng.gauss(0, 3), 2),
+            'sectors': {s: round(rng.gauss(0, 6), 2) for s in rng.sample(sectors, min(3, len(sectors)))},
+        }
+        if rng.random() < 0.3:
+            scenario['symbols'] = {s: round(rng.gauss(0, 15), 2) for s in rng.sample(symbols, min(2, len(symbols)))}
+        if rng.random() < 0.2:
+            scenario['rebalance'] = {s: rng.choice([-100, -50, -25, 25, 50])
+                                     for s in rng.sample(symbols, min(4, len(symbols)))}
+        scenarios.append(scenario)
+
+    return scenarios
+
+
+def generate_alert_rules(holdings, count, seed=42):
+    """Rule dicts for /api/alerts: mostly price levels within 10% of the last price,
+    some per-holding P&L % thresholds and a few sector weights"""
+    rng = random.Random(seed)
+    sectors = sorted({h['sector'] for h in holdings})
+    rules = []
+
+    for _ in range(count):
+        kind = rng.random()
+        holding = rng.choice(holdings)
+        if kind < 0.7:
+            rules.append({'type': 'price', 'symbol': holding['tradingsymbol'], 'op': rng.choice(['above', 'below']),
+                          'value': round(holding['last_price'] * rng.uniform(0.9, 1.1), 2)})
+        elif kind < 0.98:
+            rules.append({'type': 'pnl_percentage', 'symbol': holding['tradingsymbol'],
+                          'value': rng.choice([-20, -10, -5, 5, 10, 20, 50])})
+        else:
+            rules.append({'type': 'sector_weight', 'sector': rng.choice(sectors), 'op': 'above',
+                          'value': rng.choice([10, 20, 30])})
+
+    return rules
@@ -0,0 +1,46 @@
+"""Gunicorn configuration - worker model for the I/O-bound request path
+
+Almost all request time is spent waiting on api.kite.trade and Resend, so
+the default worker class is gevent: the worker monkey-patches sockets before
+the app is imported, every Kite and Resend call yields while it waits, and a
+single worker can hold up to GUNICORN_WORKER_CONNECTIONS concurrent requests.
+
+Set GUNICORN_WORKER_CLASS=gthread to run a fixed pool of GUNICORN_THREADS
+threads per worker instead (no monkey-patching, bounded concurrency).
+
+With more than one worker, the workers share cached holdings, analyses and
+charts through a file in /dev/shm (SHARED_CACHE_PATH), created for this
+master process and removed when it exits.
+"""
+import os
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+threads = int(os.environ.get('GUNICORN_THREADS', '32'))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '1000'))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = 30
+keepalive = 5
+
+# The app must be imported after gevent has patched the worker, so never preload
+preload_app = False
+
+# Workers inherit the environment, so they all open the same shared cache file
+_shared_cache = None
+if workers > 1 and not os.environ.get('SHARED_CACHE_PATH'):
+    shm = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    _shared_cache = os.environ['SHARED_CACHE_PATH'] = os.path.join(shm, f'portfolio-reporter-{os.getpid()}.cache')
+
+
+def post_fork(server, worker):
+    # Lets the memory watchdog recycle this worker with SIGTERM (MEMORY_CEILING_MB)
+    os.environ['GUNICORN_WORKER'] = '1'
+
+
+def on_exit(server):
+    if _shared_cache and os.path.exists(_shared_cache):
+        os.remove(_shared_cache)
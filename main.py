@@ -5,7 +5,14 @@ Using Official Kite Connect Library
 """
 
 import os
+import re
+import sys
 import json
+import time
+import base64
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -17,6 +24,9 @@ from email.mime.image import MIMEImage
 from dotenv import load_dotenv
 import logging
 from kiteconnect import KiteConnect
+from app.services.portfolio import PortfolioService
+from app.services.charts import create_all_charts
+from app.services.email import generate_email_content
 
 # Load environment variables
 load_dotenv()
@@ -201,8 +211,9 @@ class PortfolioReporter:
         
         plt.tight_layout()
         
-        # Save the chart
-        chart_path = 'portfolio_analysis.png'
+        # Save the chart to a private temp file so concurrent runs don't collide
+        fd, chart_path = tempfile.mkstemp(prefix='portfolio_analysis_', suffix='.png')
+        os.close(fd)
         plt.savefig(chart_path, dpi=300, bbox_inches='tight')
         plt.close()
         
@@ -384,8 +395,148 @@ class PortfolioReporter:
         
         return success
 
+# Anything else in an account name is replaced before it becomes a directory
+UNSAFE_ACCOUNT_CHARS = re.compile(r'[^A-Za-z0-9_-]')
+
+
+def account_name(path, data):
+    """Output directory name of a batch input: its "account", else the file name.
+
+    Only the last path component is kept, and characters outside
+    [A-Za-z0-9_-] become '_', so a name like "../x" stays under --output-dir.
+    """
+    account = data.get('account') if isinstance(data, dict) else None
+    name = os.path.basename(str(account)) if account else os.path.splitext(os.path.basename(path))[0]
+    name = UNSAFE_ACCOUNT_CHARS.sub('_', name)
+    if not name.strip('_'):
+        raise ValueError(f"unusable account name {account!r}")
+    return name
+
+
+def load_batch_input(path):
+    """Read one batch input file.
+
+    Accepted shapes:
+    - a list of holdings (a saved KiteConnect.holdings() snapshot)
+    - {"account": ..., "holdings": [...]}
+    - {"account": ..., "api_key": ..., "access_token": ...} to fetch live from Kite
+    """
+    with open(path) as f:
+        data = json.load(f)
+
+    account = account_name(path, data)
+    if isinstance(data, list):
+        return account, data
+
+    if 'holdings' in data:
+        return account, data['holdings']
+
+    if data.get('api_key') and data.get('access_token'):
+        return account, PortfolioService(data['api_key'], data['access_token']).get_holdings()
+
+    raise ValueError("expected a holdings list, 'holdings', or 'api_key' + 'access_token'")
+
+
+def process_account(path, output_root):
+    """Analyze one account and write its charts and report under output_root/<account>"""
+    start = time.perf_counter()
+    account, holdings = load_batch_input(path)
+    if not holdings:
+        raise ValueError("no holdings")
+
+    analysis = PortfolioService.analyze(holdings)
+    account_dir = os.path.join(output_root, account)
+    os.makedirs(account_dir, exist_ok=True)
+
+    for name, chart in create_all_charts(analysis).items():
+        if chart:
+            with open(os.path.join(account_dir, f'{name}.png'), 'wb') as f:
+                f.write(base64.b64decode(chart))
+
+    with open(os.path.join(account_dir, 'report.html'), 'w') as f:
+        f.write(generate_email_content(analysis))
+
+    with open(os.path.join(account_dir, 'analysis.json'), 'w') as f:
+        json.dump(analysis, f, indent=2, default=str)
+
+    return account, len(holdings), time.perf_counter() - start
+
+
+def claim_accounts(paths):
+    """{path: account} for inputs that can run, and the number rejected.
+
+    Two inputs naming the same account would write the same directory, so
+    every input after the first (in file name order) is rejected.
+    """
+    claimed, owners, rejected = {}, {}, 0
+    for path in paths:
+        try:
+            with open(path) as f:
+                account = account_name(path, json.load(f))
+        except Exception as e:
+            rejected += 1
+            logger.error(f"{path}: {e}")
+            continue
+        if account in owners:
+            rejected += 1
+            logger.error(f"{path}: account {account!r} is already written by {owners[account]}")
+            continue
+        owners[account] = path
+        claimed[path] = account
+    return claimed, rejected
+
+
+def run_batch(input_dir, output_root=None, workers=None):
+    """Process every *.json file in input_dir across a process pool"""
+    paths = sorted(
+        os.path.join(input_dir, name) for name in os.listdir(input_dir) if name.endswith('.json')
+    )
+    if not paths:
+        print(f"No .json snapshots or account configs found in {input_dir}")
+        return False
+
+    output_root = output_root or tempfile.mkdtemp(prefix='portfolio-batch-')
+    os.makedirs(output_root, exist_ok=True)
+
+    start = time.perf_counter()
+    claimed, failed = claim_accounts(paths)
+    succeeded, total_holdings = 0, 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_account, path, output_root): path for path in claimed}
+        for future in as_completed(futures):
+            try:
+                account, holdings_count, elapsed = future.result()
+                succeeded += 1
+                total_holdings += holdings_count
+                logger.info(f"{account}: {holdings_count} holdings in {elapsed:.2f}s")
+            except Exception as e:
+                failed += 1
+                logger.error(f"{futures[future]}: {e}")
+
+    elapsed = time.perf_counter() - start
+    print(f"Processed {succeeded}/{len(paths)} accounts ({failed} failed) in {elapsed:.2f}s")
+    print(f"Throughput: {succeeded / elapsed:.2f} accounts/s, {total_holdings / elapsed:,.0f} holdings/s")
+    print(f"Reports written to {output_root}")
+    return failed == 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Portfolio Reporter')
+    parser.add_argument('--batch', metavar='DIR',
+                        help='Generate reports offline for every holdings snapshot or account config in DIR')
+    parser.add_argument('--output-dir', help='Where batch reports are written (default: a new temp dir)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Batch worker processes (default: CPU count)')
+    return parser.parse_args(argv)
+
+
 def main():
     """Main function to run the portfolio reporter"""
+    args = parse_args()
+    if args.batch:
+        sys.exit(0 if run_batch(args.batch, args.output_dir, args.workers) else 1)
+
     try:
         reporter = PortfolioReporter()
         success = reporter.run_report()
@@ -0,0 +1,36 @@
+"""Shared fixtures: an app whose files all live in a temporary directory"""
+import os
+import pytest
+
+API_SECRET = 'test-secret'
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    root = tmp_path_factory.mktemp('app')
+    os.environ.update({
+        'KITE_API_KEY': 'test-key',
+        'KITE_API_SECRET': API_SECRET,
+        'SNAPSHOT_DIR': str(root / 'snapshots'),
+        'HISTORY_DB': str(root / 'history.db'),
+        'CORRELATION_DIR': str(root / 'correlation'),
+        'SCHEDULER_LOCK_FILE': str(root / 'scheduler.lock')
+    })
+    from app import create_app
+    from app.services.scheduler import shutdown_scheduler
+    app = create_app()
+    yield app
+    shutdown_scheduler()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    from app.services.cache import portfolio_cache
+    portfolio_cache.clear()
+    yield
+    portfolio_cache.clear()
@@ -0,0 +1,54 @@
+"""Order postbacks, driven by benchmarks.standins.sample_postback"""
+import json
+import pytest
+from app.services.cache import portfolio_cache
+from app.services.records import to_records
+from benchmarks.standins import sample_postback
+from benchmarks.synthetic import generate_holdings
+from tests.conftest import API_SECRET
+
+USER = 'LOAD01'
+
+
+@pytest.fixture
+def holdings():
+    holdings = to_records(generate_holdings(5))
+    portfolio_cache.set((USER, 'holdings'), holdings)
+    return holdings
+
+
+def post(client, payload):
+    response = client.post('/api/postback', data=json.dumps(payload), content_type='application/json')
+    return response.status_code, response.get_json()
+
+
+def cached_quantity(symbol):
+    return next(h['quantity'] for h in portfolio_cache.get((USER, 'holdings')) if h['tradingsymbol'] == symbol)
+
+
+def test_completed_buy_is_patched(client, holdings):
+    holding = holdings[0]
+    status, body = post(client, sample_postback(API_SECRET, holding.to_dict(), user_id=USER, quantity=3))
+    assert (status, body['action']) == (200, 'patched')
+    assert cached_quantity(holding['tradingsymbol']) == holding['quantity'] + 3
+
+
+def test_tampered_checksum_is_rejected(client, holdings):
+    payload = sample_postback(API_SECRET, holdings[0].to_dict(), user_id=USER, quantity=3)
+    payload['order_id'] = str(int(payload['order_id']) + 1)
+    status, _ = post(client, payload)
+    assert status == 403
+    assert portfolio_cache.get((USER, 'holdings')) is holdings
+
+
+def test_wrong_secret_is_rejected(client, holdings):
+    status, _ = post(client, sample_postback('not-the-secret', holdings[0].to_dict(), user_id=USER))
+    assert status == 403
+
+
+def test_redelivered_postback_is_applied_once(client, holdings):
+    holding = holdings[1]
+    payload = sample_postback(API_SECRET, holding.to_dict(), user_id=USER, quantity=2)
+    assert post(client, payload)[1]['action'] == 'patched'
+    assert post(client, payload)[1]['action'] == 'duplicate'
+    assert cached_quantity(holding['tradingsymbol']) == holding['quantity'] + 2
@@ -0,0 +1,52 @@
+"""Live prices from the ReplayTicker stand-in, into a cached IncrementalAnalysis"""
+import pytest
+from app.services import ticker
+from app.services.portfolio import PortfolioService, load_book
+from app.services.records import to_records
+from benchmarks.synthetic import generate_holdings, write_tick_recording
+
+USER = 'REPLAY01'
+
+
+@pytest.fixture
+def replay(tmp_path, monkeypatch):
+    """start(frames, seed): a new feed that has played a recording of that many frames"""
+    monkeypatch.setattr(ticker, 'enabled', True)
+    monkeypatch.setattr(ticker, 'replay_speed', 1000.0)
+
+    def start(holdings, frames, seed):
+        path = tmp_path / f'ticks-{seed}.jsonl'
+        write_tick_recording(path, holdings, frames=frames, interval=0.01, movers=0.5, seed=seed)
+        monkeypatch.setattr(ticker, 'replay_file', str(path))
+        feed = ticker.ensure_feed(USER, 'test-key', 'test-token', holdings)
+        feed.ticker._thread.join(10)
+        return feed
+
+    yield start
+    ticker.stop_feed(USER)
+
+
+def priced(holdings, *feeds):
+    """The holdings at the latest prices of the feeds, later feeds winning"""
+    prices = {}
+    for feed in feeds:
+        prices.update(feed.prices.changed_since(0)[0])
+    return [dict(h.to_dict(), last_price=prices.get(h['instrument_token'], h['last_price'])) for h in holdings]
+
+
+def test_book_follows_a_restarted_feed(replay):
+    holdings = to_records(generate_holdings(20))
+
+    first = replay(holdings, frames=50, seed=1)
+    book = load_book(USER, holdings, first)
+    assert book.seq == first.prices.seq > 0
+    assert book.to_analysis() == PortfolioService.analyze(priced(holdings, first), top_n=len(holdings))
+
+    # After a logout the new feed numbers its updates from 0 again, below the book's seq
+    ticker.stop_feed(USER)
+    second = replay(holdings, frames=2, seed=2)
+    assert second.prices.seq < book.seq
+    book = load_book(USER, holdings, second)
+    assert book.seq == second.prices.seq
+    # Instruments the new feed has not ticked yet keep the old feed's last price
+    assert book.to_analysis() == PortfolioService.analyze(priced(holdings, first, second), top_n=len(holdings))